@@ -0,0 +1,347 @@
+# benchmarks/run_benchmarks.py
+"""
+Offline benchmarks for the app's hot paths.
+
+Every API call goes to a local stand-in for the Anthropic Messages API
+(see stub_anthropic.py), so runs are repeatable and free. Run from the
+repository root:
+
+    python -m benchmarks.run_benchmarks --output bench_output.json
+
+Results are printed (or written) as JSON so runs can be diffed across commits.
+"""
+import os
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+import statistics
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List
+
+import anthropic
+
+from benchmarks.stub_anthropic import StubAnthropicServer, StubConfig
+from cache import ResponseCache
+from meal_library import MealLibrary
+from models import NutritionCoach, DEFAULT_DAYS_PER_REQUEST
+from nutrition_targets import compute_targets, compute_targets_batch
+from scheduler import RequestScheduler
+import history_store
+import storage
+import utils
+
+SAMPLE_PROFILE = {
+    "name": "Bench",
+    "weight": 180.0,
+    "height": 70,
+    "age": 30,
+    "biological_sex": "Male",
+    "dietary_restrictions": [],
+    "goal": "Cutting",
+    "activity_level": "Moderately Active",
+    "protein_target": 1.0,
+    "lean_body_mass": 0.0,
+    "rate_of_progress": "Lose 1 lb/week (recommended)",
+}
+
+
+def timed(fn: Callable, iterations: int) -> Dict:
+    """Runs fn `iterations` times and summarizes wall-clock durations in seconds."""
+    durations = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - started)
+    durations.sort()
+    return {
+        "iterations": iterations,
+        "mean_s": statistics.mean(durations),
+        "p50_s": durations[len(durations) // 2],
+        "p95_s": durations[min(len(durations) - 1, int(len(durations) * 0.95))],
+        "min_s": durations[0],
+        "max_s": durations[-1],
+    }
+
+
+def sample_user() -> Dict:
+    user = {"profile": dict(SAMPLE_PROFILE)}
+    user["targets"] = compute_targets(user["profile"])
+    return user
+
+
+def synthetic_users(count: int) -> Dict:
+    """A store of `count` users, each with a small plan, food log and chat history."""
+    base = sample_user()
+    meal = {
+        "meal_name": "Chicken Rice Bowl",
+        "ingredients": [{"name": "chicken breast", "quantity": "6 oz"}],
+        "instructions": "Cook and combine.",
+        "calories": 700, "protein": 50, "fat": 20, "carbohydrates": 70,
+    }
+    start = datetime(2024, 1, 1)
+    users = {}
+    for i in range(count):
+        users[f"user{i}"] = {
+            "profile": dict(base["profile"], name=f"User {i}"),
+            "targets": dict(base["targets"]),
+            "meals": {"Day 1": {"Breakfast": meal, "Lunch": meal, "Dinner": meal}},
+            "food_log": [
+                {
+                    "timestamp": (start + timedelta(hours=6 * j)).isoformat(),
+                    "food_item": "Chicken Breast", "calories": 187, "protein": 35,
+                    "fat": 4, "carbs": 0, "quantity": 1,
+                }
+                for j in range(5)
+            ],
+            "coach_chat": [
+                {"role": "user", "content": "How much protein should I eat?"},
+                {"role": "assistant", "content": "Aim for about 1 g per lb of body weight."},
+            ],
+        }
+    return users
+
+
+def bench_api(server: StubAnthropicServer, days_list: List[int], iterations: int) -> List[Dict]:
+    client = anthropic.Anthropic(api_key="stub", base_url=server.url, max_retries=0)
+    # Limits far above what the stub can serve: failed requests are retried, nothing is throttled
+    scheduler = RequestScheduler(requests_per_minute=1e9, tokens_per_minute=1e12)
+
+    def coach() -> NutritionCoach:
+        # A fresh memory-only cache and library per call so every run measures real round trips
+        return NutritionCoach(
+            cache=ResponseCache(cache_dir=None), client=client, library=MealLibrary(path=None), scheduler=scheduler
+        )
+
+    results = []
+    for days_per_request in (0, DEFAULT_DAYS_PER_REQUEST):
+        for meal_prep in (False, True):
+            for days in days_list:
+                before = server.config.requests
+                before_tokens = server.config.input_tokens
+                stats = timed(
+                    lambda: coach().generate_meal_plan(
+                        sample_user(), days, meal_prep=meal_prep, days_per_request=days_per_request
+                    ),
+                    iterations,
+                )
+                stats["api_requests"] = (server.config.requests - before) / iterations
+                stats["input_tokens"] = (server.config.input_tokens - before_tokens) / iterations
+                results.append({
+                    "name": "generate_meal_plan",
+                    "params": {"days": days, "meal_prep": meal_prep, "days_per_request": days_per_request},
+                    **stats,
+                })
+
+    user = sample_user()
+    results.append({
+        "name": "analyze_food_entry",
+        "params": {},
+        **timed(lambda: coach().analyze_food_entry(user, "Grilled chicken with rice"), iterations),
+    })
+    results.append({
+        "name": "get_ai_coach_response",
+        "params": {},
+        **timed(lambda: coach().get_ai_coach_response(user, "How much protein should I eat?"), iterations),
+    })
+    return results
+
+
+def bench_targets(iterations: int, batch_rows: int) -> List[Dict]:
+    profile = dict(SAMPLE_PROFILE)
+    results = [{
+        "name": "calculate_targets",
+        "params": {"rows": 1},
+        **timed(lambda: compute_targets(profile), max(iterations, 1000)),
+    }]
+
+    import pandas as pd
+    profiles = pd.DataFrame([profile] * batch_rows)
+    results.append({
+        "name": "calculate_targets_batch",
+        "params": {"rows": batch_rows},
+        **timed(lambda: compute_targets_batch(profiles), iterations),
+    })
+    return results
+
+
+def bench_library(iterations: int, meals: int) -> List[Dict]:
+    """Nearest-meal lookups against a library of `meals` synthetic meals."""
+    import random
+
+    rng = random.Random(0)
+    library = MealLibrary(path=None)
+    for i in range(meals):
+        library.add(rng.choice(["Breakfast", "Lunch", "Dinner"]), {
+            "meal_name": f"Meal {i}",
+            "calories": rng.randint(300, 1200), "protein": rng.randint(10, 80),
+            "fat": rng.randint(5, 50), "carbohydrates": rng.randint(10, 150),
+        }, rng.choice([[], ["vegetarian"], ["gluten-free"]]))
+    target = {"calories": 700, "protein": 50, "fat": 20, "carbohydrates": 70}
+    library.nearest("Lunch", target)  # build the trees outside the timed loop
+
+    return [{
+        "name": "meal_library_nearest",
+        "params": {"meals": meals},
+        **timed(lambda: library.nearest("Lunch", target, ["vegetarian"]), max(iterations, 1000)),
+    }]
+
+
+def bench_storage(user_counts: List[int], iterations: int) -> List[Dict]:
+    results = []
+    original_cwd = os.getcwd()
+    for count in user_counts:
+        users = synthetic_users(count)
+        workdir = tempfile.mkdtemp(prefix="nutrition-bench-")
+        try:
+            # utils resolves the per-user shards and journals relative to the working directory
+            os.chdir(workdir)
+            utils.save_user_data(users)
+            size = sum(
+                os.path.getsize(os.path.join(utils.SHARDS_DIR, name)) for name in os.listdir(utils.SHARDS_DIR)
+            )
+            one_user = {"user0": users["user0"]}
+            results.append({"name": "save_user_data", "params": {"backend": "json", "users": count, "bytes": size},
+                            **timed(lambda: utils.save_user_data(users), iterations)})
+            results.append({"name": "save_user_data", "params": {"backend": "json", "users": count, "scope": "one user"},
+                            **timed(lambda: utils.save_user_data(one_user), iterations)})
+            results.append({"name": "load_user_data", "params": {"backend": "json", "users": count, "bytes": size},
+                            **timed(utils.load_user_data, iterations)})
+            results.append({"name": "load_user_data", "params": {"backend": "json", "users": count, "scope": "one user"},
+                            **timed(lambda: utils.load_user_data("user0"), iterations)})
+
+            db_path = os.path.join(workdir, "users.db")
+            storage.save_user_data(users, db_path)
+            sqlite_users = storage.load_user_data(db_path)
+            entry = {"timestamp": datetime.now().isoformat(), "food_item": "Apple",
+                     "calories": 95, "protein": 0, "fat": 0, "carbs": 25, "quantity": 1}
+
+            def append_and_save():
+                sqlite_users["user0"]["food_log"].append(dict(entry))
+                storage.save_user_data(sqlite_users, db_path)
+
+            results.append({"name": "save_user_data", "params": {"backend": "sqlite", "users": count, "change": "one food_log append"},
+                            **timed(append_and_save, iterations)})
+            results.append({"name": "load_user_data", "params": {"backend": "sqlite", "users": count},
+                            **timed(lambda: storage.load_user_data(db_path), iterations)})
+            results.append({"name": "load_user_data", "params": {"backend": "sqlite", "users": count, "scope": "one user"},
+                            **timed(lambda: storage.load_user_data(db_path, user_id="user0"), iterations)})
+            storage.get_store(db_path).close()
+            storage._stores.pop(db_path, None)
+        finally:
+            os.chdir(original_cwd)
+            shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def bench_history(iterations: int, years: int) -> List[Dict]:
+    """Parquet history export and Trends-page queries over `years` of food log, vs scanning the JSON."""
+    import random
+
+    rng = random.Random(0)
+    started = datetime.now() - timedelta(days=365 * years)
+    food_log = [
+        {"timestamp": (started + timedelta(hours=4.8 * i)).isoformat(), "food_item": rng.choice(["Eggs", "Oats", "Rice"]),
+         "calories": rng.randint(100, 900), "protein": 20, "fat": 10, "carbs": 40, "quantity": 1}
+        for i in range(365 * years * 5)
+    ]
+    user_data = {"food_log": food_log}
+    document = json.dumps(user_data)
+    twelve_weeks_ago = (datetime.now() - timedelta(weeks=12)).date()
+    columns = ["date", "food_item", "calories", "protein", "fat", "carbs"]
+
+    def scan_json():
+        # What a Trends query costs without the history store: parse the document and filter
+        cutoff = twelve_weeks_ago.isoformat()
+        return [entry for entry in json.loads(document)["food_log"] if entry["timestamp"] >= cutoff]
+
+    workdir = tempfile.mkdtemp(prefix="nutrition-bench-")
+    original_dir = history_store.HISTORY_DIR
+    try:
+        history_store.HISTORY_DIR = workdir
+        params = {"years": years, "entries": len(food_log)}
+        results = [{"name": "history_export", "params": dict(params, mode="rebuild"),
+                    **timed(lambda: history_store.export_user_history("user0", user_data, rebuild=True), iterations)}]
+        results.append({"name": "history_export", "params": dict(params, mode="up to date"),
+                        **timed(lambda: history_store.export_user_history("user0", user_data), max(iterations, 100))})
+        results.append({"name": "history_query", "params": dict(params, window="12 weeks"),
+                        **timed(lambda: history_store.load_history("user0", "food_log", columns, start=twelve_weeks_ago),
+                                max(iterations, 20))})
+        results.append({"name": "history_query", "params": dict(params, window="all"),
+                        **timed(lambda: history_store.load_history("user0", "food_log", columns), max(iterations, 20))})
+        results.append({"name": "json_scan", "params": dict(params, window="12 weeks"),
+                        **timed(scan_json, max(iterations, 20))})
+    finally:
+        history_store.HISTORY_DIR = original_dir
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(part) for part in value.split(",") if part]
+
+
+def main(argv=None) -> Dict:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.2, help="stub API latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.05, help="± uniform jitter in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of stub requests that fail")
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--days", type=_int_list, default=[1, 3, 7, 14], help="comma-separated plan lengths")
+    parser.add_argument("--users", type=_int_list, default=[1, 100, 1000, 10000, 100000],
+                        help="comma-separated synthetic store sizes")
+    parser.add_argument("--batch-rows", type=int, default=1_000_000)
+    parser.add_argument("--library-meals", type=int, default=100_000)
+    parser.add_argument("--history-years", type=int, default=5)
+    parser.add_argument("--only", choices=["api", "targets", "library", "storage", "history"], action="append",
+                        help="run only these groups (repeatable)")
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+    groups = args.only or ["api", "targets", "library", "storage", "history"]
+
+    config = StubConfig(args.latency, args.jitter, args.error_rate, seed=0)
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "stub": config.as_dict(),
+        },
+        "results": [],
+    }
+
+    if "api" in groups:
+        with StubAnthropicServer(config) as server:
+            report["results"] += bench_api(server, args.days, args.iterations)
+        report["meta"]["stub"].update(requests=config.requests, errors=config.errors)
+    if "targets" in groups:
+        report["results"] += bench_targets(args.iterations, args.batch_rows)
+    if "library" in groups:
+        report["results"] += bench_library(args.iterations, args.library_meals)
+    if "storage" in groups:
+        report["results"] += bench_storage(args.users, args.iterations)
+    if "history" in groups:
+        report["results"] += bench_history(args.iterations, args.history_years)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+    return report
+
+
+if __name__ == "__main__":
+    main()
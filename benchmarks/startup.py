@@ -0,0 +1,100 @@
+# benchmarks/startup.py
+"""
+Cold-start import benchmark for the Streamlit entry point.
+
+Imports `main` in fresh interpreters with `python -X importtime` and reports
+wall time, per-module import cost, and which heavy dependencies were pulled
+in eagerly. Run from the repository root:
+
+    python -m benchmarks.startup --runs 5 --output startup.json
+"""
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from typing import Dict, List
+
+# Dependencies that should only load when a page actually needs them
+HEAVY_MODULES = ["anthropic", "httpx", "pandas", "numpy", "st_aggrid", "pyarrow", "scipy"]
+
+_PROBE = (
+    "import sys, time, json\n"
+    "started = time.perf_counter()\n"
+    "import {module}\n"
+    "elapsed = time.perf_counter() - started\n"
+    "print(json.dumps({{'seconds': elapsed, 'loaded': [m for m in {heavy!r} if m in sys.modules]}}))\n"
+)
+
+
+def parse_importtime(stderr: str) -> Dict[str, Dict]:
+    """Parses `-X importtime` output into {module: {"self_us", "cumulative_us"}}."""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = {"self_us": int(self_us), "cumulative_us": int(cumulative_us)}
+    return modules
+
+
+def measure(module: str) -> Dict:
+    """One cold import of `module` in a fresh interpreter."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _PROBE.format(module=module, heavy=HEAVY_MODULES)],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    probe = json.loads(result.stdout.strip().splitlines()[-1])
+    probe["modules"] = parse_importtime(result.stderr)
+    return probe
+
+
+def main(argv: List[str] = None) -> Dict:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="main", help="module to import (default: main)")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=25, help="number of most expensive modules to report")
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    runs = [measure(args.module) for _ in range(args.runs)]
+
+    # Median per-module cost across runs, keyed by the top-level package
+    per_module = {}
+    for run in runs:
+        for name, timing in run["modules"].items():
+            per_module.setdefault(name, []).append(timing["cumulative_us"])
+    top_level = {
+        name: statistics.median(values) / 1e6
+        for name, values in per_module.items()
+        if "." not in name
+    }
+    ranked = sorted(top_level.items(), key=lambda item: item[1], reverse=True)[: args.top]
+
+    seconds = sorted(run["seconds"] for run in runs)
+    report = {
+        "module": args.module,
+        "runs": args.runs,
+        "import_seconds": {
+            "mean": statistics.mean(seconds),
+            "p50": statistics.median(seconds),
+            "min": seconds[0],
+            "max": seconds[-1],
+        },
+        "eagerly_loaded_heavy_modules": runs[-1]["loaded"],
+        "top_modules_cumulative_seconds": dict(ranked),
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+    return report
+
+
+if __name__ == "__main__":
+    main()
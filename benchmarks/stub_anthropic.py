@@ -0,0 +1,211 @@
+# benchmarks/stub_anthropic.py
+import re
+import json
+import time
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+
+
+class StubConfig:
+    """Latency is in seconds; each request sleeps latency ± uniform jitter and fails with probability error_rate."""
+
+    def __init__(self, latency: float = 0.2, jitter: float = 0.05, error_rate: float = 0.0, seed: int = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.input_tokens = 0
+
+    def as_dict(self) -> Dict:
+        return {"latency": self.latency, "jitter": self.jitter, "error_rate": self.error_rate}
+
+
+def _meal(prompt: str) -> Dict:
+    numbers = dict(re.findall(r"- (Calories|Protein|Fat|Carbohydrates): (\d+)", prompt))
+    return {
+        "meal_name": "Stub Chicken Rice Bowl",
+        "ingredients": [
+            {"name": "chicken breast", "quantity": "6 oz"},
+            {"name": "white rice", "quantity": "1 cup"},
+            {"name": "broccoli", "quantity": "1 cup"},
+        ],
+        "instructions": "Cook the rice. Grill the chicken. Steam the broccoli. Combine.",
+        "calories": int(numbers.get("Calories", 700)),
+        "protein": int(numbers.get("Protein", 50)),
+        "fat": int(numbers.get("Fat", 20)),
+        "carbohydrates": int(numbers.get("Carbohydrates", 70)),
+    }
+
+
+def _day_plans(prompt: str) -> Dict:
+    """Whole-day reply: every requested day and meal, splitting the daily totals evenly."""
+    days = re.search(r"following days: (.*)\.", prompt).group(1).split(", ")
+    meal_types = re.search(r"these meals: (.*)\.", prompt).group(1).split(", ")
+    day_totals = _meal(prompt)
+    plans = {}
+    for day in days:
+        plans[day] = {}
+        for meal_type in meal_types:
+            meal = dict(day_totals, meal_name=f"Stub {meal_type}")
+            for column in ("calories", "protein", "fat", "carbohydrates"):
+                meal[column] = round(day_totals[column] / len(meal_types))
+            plans[day][meal_type] = meal
+    return plans
+
+
+def build_reply(body: Dict) -> str:
+    """Picks a plausible reply for whichever NutritionCoach prompt this is."""
+    prompt = body["messages"][-1]["content"]
+    if "Each day has these meals" in prompt:
+        return json.dumps(_day_plans(prompt))
+    if "Provide JSON" in prompt:
+        return json.dumps(_meal(prompt))
+    if "Each entry is prefixed with its id" in prompt:
+        ids = re.findall(r"^\s*(\d+): ", prompt, re.M)
+        return json.dumps({i: {"analysis": "Looks balanced.", "recommendations": ["Add vegetables"]} for i in ids})
+    if "Analyze the following meal" in prompt:
+        return json.dumps({"analysis": "Looks balanced.", "recommendations": ["Add vegetables"]})
+    return "Great question! Focus on hitting your protein target and staying consistent this week."
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config: StubConfig = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        config = self.config
+
+        with config.lock:
+            config.requests += 1
+            delay = max(0.0, config.latency + config.random.uniform(-config.jitter, config.jitter))
+            fail = config.random.random() < config.error_rate
+            if fail:
+                config.errors += 1
+        time.sleep(delay)
+
+        if not self.path.startswith("/v1/messages"):
+            return self._send_json(404, {"type": "error", "error": {"type": "not_found_error", "message": self.path}})
+        if fail:
+            return self._send_json(
+                529, {"type": "error", "error": {"type": "overloaded_error", "message": "Overloaded"}}
+            )
+
+        text = build_reply(body)
+        if body.get("stream"):
+            return self._send_stream(body, text)
+        self._send_json(200, self._message(body, text))
+
+    def _message(self, body: Dict, text: str) -> Dict:
+        prompt_chars = len(body.get("system", "")) + sum(len(str(m["content"])) for m in body["messages"])
+        with self.config.lock:
+            self.config.input_tokens += prompt_chars // 4
+        return {
+            "id": "msg_stub",
+            "type": "message",
+            "role": "assistant",
+            "model": body.get("model", "stub"),
+            "content": [{"type": "text", "text": text}],
+            "stop_reason": "end_turn",
+            "stop_sequence": None,
+            "usage": {"input_tokens": prompt_chars // 4, "output_tokens": len(text) // 4},
+        }
+
+    def _send_json(self, status: int, payload: Dict) -> None:
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, body: Dict, text: str) -> None:
+        """Server-sent events in the Messages streaming format, one delta per ~16 characters."""
+        message = self._message(body, "")
+        message["content"] = []
+        events = [("message_start", {"type": "message_start", "message": message})]
+        events.append(("content_block_start", {
+            "type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""},
+        }))
+        for start in range(0, len(text), 16):
+            events.append(("content_block_delta", {
+                "type": "content_block_delta", "index": 0,
+                "delta": {"type": "text_delta", "text": text[start:start + 16]},
+            }))
+        events.append(("content_block_stop", {"type": "content_block_stop", "index": 0}))
+        events.append(("message_delta", {
+            "type": "message_delta", "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+            "usage": {"output_tokens": len(text) // 4},
+        }))
+        events.append(("message_stop", {"type": "message_stop"}))
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        for name, payload in events:
+            self.wfile.write(f"event: {name}\ndata: {json.dumps(payload)}\n\n".encode())
+            self.wfile.flush()
+        self.close_connection = True
+
+
+class StubAnthropicServer:
+    """
+    Local HTTP server speaking enough of the Anthropic Messages API for
+    NutritionCoach: POST /v1/messages, plain or streaming.
+
+        with StubAnthropicServer(StubConfig(latency=0.1)) as server:
+            client = anthropic.Anthropic(api_key="stub", base_url=server.url)
+    """
+
+    def __init__(self, config: StubConfig = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or StubConfig()
+        handler = type("StubHandler", (_Handler,), {"config": self.config})
+        self._server = ThreadingHTTPServer((host, port), handler)
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StubAnthropicServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the Anthropic Messages API.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--jitter", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = StubAnthropicServer(StubConfig(args.latency, args.jitter, args.error_rate), port=args.port)
+    print(f"Stub Anthropic API listening on {server.url}")
+    server._server.serve_forever()
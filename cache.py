@@ -0,0 +1,224 @@
+# cache.py
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import metrics
+
+DEFAULT_CACHE_DIR = os.environ.get("LLM_CACHE_DIR", ".llm_cache")
+DEFAULT_MEMORY_ENTRIES = 512
+DEFAULT_MAX_DISK_BYTES = 50 * 1024 * 1024  # 50 MB
+DEFAULT_TTL_SECONDS = 7 * 24 * 60 * 60  # one week
+
+
+class ResponseCache:
+    """
+    Two-tier cache for LLM responses.
+
+    Entries are content-addressed: the key is a SHA-256 of the model, system
+    prompt, prompt text and sampling params. The memory tier is an LRU of
+    serialized values; the disk tier stores one JSON file per key so cached
+    responses survive restarts. Both tiers honor the same TTL, and the disk
+    tier evicts oldest files first once it grows past max_disk_bytes.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Optional[str] = DEFAULT_CACHE_DIR,
+        max_memory_entries: int = DEFAULT_MEMORY_ENTRIES,
+        max_disk_bytes: int = DEFAULT_MAX_DISK_BYTES,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+    ):
+        self.cache_dir = cache_dir
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl_seconds = ttl_seconds
+
+        self._memory = OrderedDict()  # key -> (created_at, serialized value)
+        self._lock = threading.Lock()
+        self._disk_bytes = None  # computed lazily on first disk write
+
+        self.hits = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(model: str, system: str, prompt: str, **params) -> str:
+        """Builds the content address for a request."""
+        payload = json.dumps(
+            {"model": model, "system": system, "prompt": prompt, "params": params},
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Returns a fresh copy of the cached value, or None on a miss."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created_at, serialized = entry
+                if now - created_at <= self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    self.memory_hits += 1
+                    return json.loads(serialized)
+                del self._memory[key]
+
+        entry = self._read_disk(key, now)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self._remember(key, *entry)
+            self.hits += 1
+            self.disk_hits += 1
+        return json.loads(entry[1])
+
+    def set(self, key: str, value: Any) -> None:
+        """
+        Stores a JSON-serializable value in both tiers. Best effort: a value
+        that can't be stored is skipped (and counted) rather than raised, so
+        a full disk never fails the call whose reply is being cached.
+        """
+        created_at = time.time()
+        try:
+            serialized = json.dumps(value)
+            with self._lock:
+                self._remember(key, created_at, serialized)
+            self._write_disk(key, created_at, serialized)
+        except (OSError, TypeError, ValueError) as e:
+            metrics.increment("cache_write_errors_total", error=type(e).__name__)
+
+    def clear(self) -> None:
+        """Drops every entry from both tiers."""
+        with self._lock:
+            self._memory.clear()
+            if self.cache_dir and os.path.isdir(self.cache_dir):
+                for path, _, _ in self._disk_entries():
+                    self._remove(path)
+            self._disk_bytes = 0
+
+    def stats(self) -> Dict:
+        """Hit/miss counters and current tier sizes."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "memory_entries": len(self._memory),
+                "disk_bytes": self._disk_bytes,
+            }
+
+    def _remember(self, key: str, created_at: float, serialized: str) -> None:
+        # Caller holds the lock
+        self._memory[key] = (created_at, serialized)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def _path_for(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _read_disk(self, key: str, now: float):
+        if not self.cache_dir:
+            return None
+        path = self._path_for(key)
+        try:
+            with open(path, "r") as f:
+                record = json.load(f)
+            created_at, serialized = record["created_at"], record["value"]
+            expired = now - created_at > self.ttl_seconds
+        except (FileNotFoundError, ValueError, KeyError, TypeError):
+            return None  # missing, or a malformed record, which counts as a miss
+        if not isinstance(serialized, str):
+            return None
+        if expired:
+            with self._lock:
+                self._remove(path)
+            return None
+        return created_at, serialized
+
+    def _write_disk(self, key: str, created_at: float, serialized: str) -> None:
+        if not self.cache_dir:
+            return
+        path = self._path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps({"created_at": created_at, "value": serialized})
+
+        # Write to a temp file and rename so readers never see a partial entry; the
+        # name is unique per process and thread since processes share the cache dir
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                f.write(data)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(size for _, size, _ in self._disk_entries())
+            if os.path.exists(path):
+                self._disk_bytes -= os.path.getsize(path)
+            os.replace(tmp_path, path)
+            self._disk_bytes += len(data)
+            if self._disk_bytes > self.max_disk_bytes:
+                self._evict_disk()
+
+    def _disk_entries(self):
+        """Yields (path, size, mtime) for every cached file."""
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, st.st_size, st.st_mtime
+
+    def _evict_disk(self) -> None:
+        # Caller holds the lock. Drop oldest files until under 90% of the limit
+        # so we don't rescan the directory on every subsequent write.
+        target = self.max_disk_bytes * 0.9
+        for path, _, _ in sorted(self._disk_entries(), key=lambda e: e[2]):
+            if self._disk_bytes <= target:
+                break
+            self._remove(path)
+            self.evictions += 1
+
+    def _remove(self, path: str) -> None:
+        # Caller holds the lock
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        if self._disk_bytes is not None:
+            self._disk_bytes -= size
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """Returns the process-wide cache shared by every NutritionCoach."""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ResponseCache()
+        return _default_cache
@@ -0,0 +1,87 @@
+# coach_memory.py
+import os
+import json
+from typing import Callable, Dict, List
+from utils import DATA_DIR, estimate_tokens
+
+# Token budget for everything sent to the coach (system prompt, summary, turns, new message)
+DEFAULT_CONTEXT_TOKEN_BUDGET = 3000
+
+# Once the hot chat grows past HOT_CHAT_LIMIT messages, everything but the
+# newest HOT_CHAT_KEEP is folded into the summary and moved to the archive.
+HOT_CHAT_LIMIT = 40
+HOT_CHAT_KEEP = 20
+
+# Archived chat messages, one JSONL file per user, beside the user shards and journals
+ARCHIVE_DIR = os.path.join(DATA_DIR, "chat_archive")
+
+
+def build_coach_messages(user_data: Dict, user_message: str, token_budget: int) -> List[Dict]:
+    """
+    Returns the Messages API conversation for a new user message: as many
+    recent turns from the hot chat as fit in `token_budget`, followed by the
+    new message. If the new message was already appended to coach_chat it
+    isn't sent twice.
+    """
+    history = user_data.get("coach_chat", [])
+    if history and history[-1].get("role") == "user" and history[-1].get("content") == user_message:
+        history = history[:-1]
+
+    budget = token_budget - estimate_tokens(user_message)
+    turns = []
+    for msg in reversed(history):
+        cost = estimate_tokens(msg["content"])
+        if cost > budget:
+            break
+        budget -= cost
+        turns.append({"role": msg["role"], "content": msg["content"]})
+    turns.reverse()
+    turns.append({"role": "user", "content": user_message})
+
+    # The API wants the conversation to open with a user turn and alternate roles
+    while turns[0]["role"] != "user":
+        turns.pop(0)
+    merged = [turns[0]]
+    for turn in turns[1:]:
+        if turn["role"] == merged[-1]["role"]:
+            merged[-1] = {"role": turn["role"], "content": merged[-1]["content"] + "\n\n" + turn["content"]}
+        else:
+            merged.append(turn)
+    return merged
+
+
+def conversation_summary(user_data: Dict) -> str:
+    return user_data.get("coach_memory", {}).get("summary", "")
+
+
+def archive_old_messages(
+    user_data: Dict, user_id: str, summarize: Callable[[str, List[Dict]], str]
+) -> bool:
+    """
+    Moves older chat messages out of the hot user document.
+
+    When coach_chat exceeds HOT_CHAT_LIMIT messages, all but the newest
+    HOT_CHAT_KEEP are appended to data/chat_archive/<user_id>.jsonl and folded
+    into the rolling summary via `summarize(previous_summary, messages)`.
+    Returns True if the document changed and should be saved.
+    """
+    chat = user_data.get("coach_chat", [])
+    if len(chat) <= HOT_CHAT_LIMIT:
+        return False
+
+    overflow, keep = chat[:-HOT_CHAT_KEEP], chat[-HOT_CHAT_KEEP:]
+    memory = user_data.setdefault("coach_memory", {"summary": "", "archived_messages": 0})
+
+    # Archive first: if we crash before the document is saved, the `seq`
+    # numbers let readers drop the duplicates written on the retry.
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    with open(os.path.join(ARCHIVE_DIR, f"{user_id}.jsonl"), "a") as f:
+        for offset, msg in enumerate(overflow):
+            f.write(json.dumps({"seq": memory["archived_messages"] + offset, **msg}) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+    memory["summary"] = summarize(memory["summary"], overflow)
+    memory["archived_messages"] += len(overflow)
+    user_data["coach_chat"] = keep
+    return True
@@ -0,0 +1,141 @@
+# food_db.py
+import os
+import re
+import csv
+import threading
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_FOODS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "foods.csv")
+
+MACRO_FIELDS = ("calories", "protein", "fat", "carbs")
+
+# Fuzzy matches scoring below this are treated as "not in the database"
+MIN_MATCH_SCORE = 0.45
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def _words(text: str) -> List[str]:
+    return _WORD_RE.findall(text.lower())
+
+
+def _trigrams(text: str) -> set:
+    padded = f"  {' '.join(_words(text))} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class FoodDatabase:
+    """
+    In-memory food composition table with prebuilt search indexes.
+
+    Two indexes are built once at load time:
+    - a sorted (word, food id) list, so autocomplete is a bisect on the last
+      word being typed plus a filter on the earlier words;
+    - a trigram inverted index, so fuzzy search only scores foods sharing at
+      least one trigram with the query (Dice coefficient on trigram sets).
+    Each food is a dict with name, serving and per-serving calories/protein/fat/carbs.
+    """
+
+    def __init__(self, foods: List[Dict]):
+        self.foods = foods
+        self._by_name = {food["name"].lower(): food for food in foods}
+        self._food_words = [set(_words(food["name"])) for food in foods]
+        self._food_trigrams = [_trigrams(food["name"]) for food in foods]
+
+        self._word_index = sorted(
+            (word, food_id)
+            for food_id, words in enumerate(self._food_words)
+            for word in words
+        )
+        self._trigram_index = defaultdict(list)
+        for food_id, grams in enumerate(self._food_trigrams):
+            for gram in grams:
+                self._trigram_index[gram].append(food_id)
+
+    @classmethod
+    def from_csv(cls, path: str = DEFAULT_FOODS_PATH) -> "FoodDatabase":
+        foods = []
+        with open(path, newline="") as f:
+            for row in csv.DictReader(f):
+                food = {"name": row["name"], "serving": row["serving"]}
+                for field in MACRO_FIELDS:
+                    food[field] = float(row[field])
+                foods.append(food)
+        return cls(foods)
+
+    def autocomplete(self, query: str, limit: int = 10) -> List[Dict]:
+        """Foods whose name has a word starting with each word of the query, in order typed."""
+        words = _words(query)
+        if not words:
+            return []
+        *complete_words, partial = words
+
+        candidates = set()
+        start = bisect_left(self._word_index, (partial, -1))
+        for word, food_id in self._word_index[start:]:
+            if not word.startswith(partial):
+                break
+            candidates.add(food_id)
+
+        matches = [
+            food_id for food_id in candidates
+            if all(
+                any(food_word.startswith(word) for food_word in self._food_words[food_id])
+                for word in complete_words
+            )
+        ]
+        lowered = query.strip().lower()
+        # Names that start with what was typed first, then shorter (more generic) names
+        matches.sort(key=lambda food_id: (
+            not self.foods[food_id]["name"].lower().startswith(lowered),
+            len(self.foods[food_id]["name"]),
+        ))
+        return [self.foods[food_id] for food_id in matches[:limit]]
+
+    def search(self, query: str, limit: int = 10) -> List[Tuple[float, Dict]]:
+        """Fuzzy search tolerant of typos; returns (score, food) pairs, best first."""
+        query_grams = _trigrams(query)
+        if not query_grams:
+            return []
+
+        overlaps = Counter()
+        for gram in query_grams:
+            for food_id in self._trigram_index.get(gram, ()):
+                overlaps[food_id] += 1
+
+        scored = [
+            (2 * overlap / (len(query_grams) + len(self._food_trigrams[food_id])), food_id)
+            for food_id, overlap in overlaps.items()
+        ]
+        scored.sort(key=lambda pair: (-pair[0], len(self.foods[pair[1]]["name"])))
+        return [(score, self.foods[food_id]) for score, food_id in scored[:limit]]
+
+    def lookup(self, name: str) -> Optional[Dict]:
+        """Exact (case-insensitive) match, else the best fuzzy match above MIN_MATCH_SCORE."""
+        food = self._by_name.get(name.strip().lower())
+        if food is not None:
+            return food
+        results = self.search(name, limit=1)
+        if results and results[0][0] >= MIN_MATCH_SCORE:
+            return results[0][1]
+        return None
+
+
+def scale_macros(food: Dict, quantity: float) -> Dict:
+    """Macros for `quantity` servings of a food."""
+    return {field: food[field] * quantity for field in MACRO_FIELDS}
+
+
+_food_db = None
+_food_db_lock = threading.Lock()
+
+
+def get_food_database() -> FoodDatabase:
+    """Returns the bundled food database, loading and indexing it on first use."""
+    global _food_db
+    with _food_db_lock:
+        if _food_db is None:
+            _food_db = FoodDatabase.from_csv()
+        return _food_db
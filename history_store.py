@@ -0,0 +1,277 @@
+# history_store.py
+import os
+import json
+import hashlib
+import threading
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
+
+import metrics
+
+HISTORY_DIR = os.environ.get(
+    "NUTRITION_HISTORY_DIR",
+    os.path.join(os.environ.get("NUTRITION_DATA_DIR", "data"), "history"),
+)
+
+
+def _schema(dataset: str):
+    """Columns of each exported dataset, besides the user_id/month partition keys."""
+    import pyarrow as pa
+
+    if dataset == "food_log":
+        return pa.schema([
+            ("timestamp", pa.timestamp("us")),
+            ("date", pa.date32()),
+            ("food_item", pa.string()),
+            ("quantity", pa.float64()),
+            ("calories", pa.float64()),
+            ("protein", pa.float64()),
+            ("fat", pa.float64()),
+            ("carbs", pa.float64()),
+        ])
+    if dataset == "meals":
+        return pa.schema([
+            ("date", pa.date32()),
+            ("day", pa.string()),
+            ("meal_type", pa.string()),
+            ("meal_name", pa.string()),
+            ("calories", pa.float64()),
+            ("protein", pa.float64()),
+            ("fat", pa.float64()),
+            ("carbohydrates", pa.float64()),
+        ])
+    raise ValueError(f"Unknown history dataset {dataset!r}")
+
+
+@metrics.timed("storage_seconds", operation="history_export", backend="parquet")
+def export_user_history(user_id: str, user_data: Dict, rebuild: bool = False) -> List[str]:
+    """
+    Brings the user's Parquet history up to date with their food log and
+    current meal plan; returns the partitions (dataset/month) rewritten.
+
+    History lives at <dataset>/user_id=<id>/month=YYYY-MM/part-0.parquet.
+    A per-user manifest records how far the food log was exported (entry
+    count plus a fingerprint of the last entry, like the rollup watermark),
+    so an up-to-date user costs one hash and appended entries rewrite only
+    the months they fall in. A log that shrank or changed at the watermark
+    is re-exported in full, as is everything with `rebuild` (the periodic
+    job uses it to pick up edits further back). Meal plans are dated from
+    meal_plan_settings["start_date"] and merged into their months,
+    replacing earlier plans for the same dates.
+    """
+    manifest = {} if rebuild else _read_manifest(user_id)
+    written = []
+    written += _export_food_log(user_id, user_data.get("food_log", []), manifest.setdefault("food_log", {}))
+    written += _export_meals(user_id, user_data, manifest.setdefault("meals", {}))
+    if written:
+        _write_manifest(user_id, manifest)
+    return written
+
+
+def _export_food_log(user_id: str, food_log: List[Dict], state: Dict) -> List[str]:
+    exported = state.get("entries", 0)
+    if exported == len(food_log) and state.get("last") == _fingerprint(food_log[-1:]):
+        return []
+
+    appended = 0 < exported < len(food_log) and state.get("last") == _fingerprint(food_log[exported - 1:exported])
+    if appended:
+        months = {_month(entry) for entry in food_log[exported:]}
+    else:
+        months = {_month(entry) for entry in food_log}
+        # Rebuilding: months that no longer have entries are dropped too
+        for month in _partition_months("food_log", user_id) - months:
+            os.remove(_partition_path("food_log", user_id, month))
+    months.discard(None)
+
+    rows = {month: [] for month in months}
+    for entry in food_log:
+        month = _month(entry)
+        if month in rows:
+            rows[month].append(_food_log_row(entry))
+    for month, month_rows in rows.items():
+        month_rows.sort(key=lambda row: row["timestamp"])
+        _write_partition("food_log", user_id, month, month_rows)
+
+    state["entries"] = len(food_log)
+    state["last"] = _fingerprint(food_log[-1:])
+    return [f"food_log/{month}" for month in sorted(months)]
+
+
+def _export_meals(user_id: str, user_data: Dict, state: Dict) -> List[str]:
+    meal_plan = user_data.get("meals") or {}
+    start_date = (user_data.get("meal_plan_settings") or {}).get("start_date")
+    fingerprint = _fingerprint([start_date, meal_plan])
+    if not meal_plan or not start_date or state.get("plan") == fingerprint:
+        return []
+
+    import pyarrow.parquet as pq
+
+    start = date.fromisoformat(start_date)
+    rows = []
+    for day_key, day_meals in meal_plan.items():
+        try:
+            day_number = int(day_key.split()[-1])
+        except ValueError:
+            continue
+        for meal_type, meal in day_meals.items():
+            if isinstance(meal, dict):
+                rows.append(_meal_row(start + timedelta(days=day_number - 1), day_key, meal_type, meal))
+
+    by_month = {}
+    for row in rows:
+        by_month.setdefault(row["date"].strftime("%Y-%m"), []).append(row)
+    for month, month_rows in by_month.items():
+        path = _partition_path("meals", user_id, month)
+        if os.path.exists(path):
+            # Keep earlier plans' rows for dates this plan doesn't cover
+            planned = {row["date"] for row in month_rows}
+            kept = [row for row in pq.read_table(path).to_pylist() if row["date"] not in planned]
+            month_rows = kept + month_rows
+        month_rows.sort(key=lambda row: row["date"])
+        _write_partition("meals", user_id, month, month_rows)
+
+    state["plan"] = fingerprint
+    return [f"meals/{month}" for month in sorted(by_month)]
+
+
+@metrics.timed("storage_seconds", operation="history_query", backend="parquet")
+def load_history(
+    user_id: str,
+    dataset: str,
+    columns: Optional[List[str]] = None,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+) -> "pd.DataFrame":
+    """
+    Rows of one user's `dataset` ("food_log" or "meals") between the
+    inclusive `start`/`end` dates, as a DataFrame of `columns` only.
+
+    Only the user's directory is scanned, month partitions outside the
+    range are pruned by path, the date filter is pushed down to Parquet
+    row-group statistics, and only the requested columns are decoded.
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    schema = _schema(dataset)
+    columns = columns or schema.names
+    root = os.path.join(HISTORY_DIR, dataset, f"user_id={user_id}")
+    if not os.path.isdir(root):
+        return schema.empty_table().select(columns).to_pandas(date_as_object=False)
+
+    history = ds.dataset(
+        root,
+        schema=schema.append(pa.field("month", pa.string())),
+        format="parquet",
+        partitioning=ds.partitioning(pa.schema([("month", pa.string())]), flavor="hive"),
+    )
+    condition = None
+    if start is not None:
+        condition = (ds.field("month") >= start.strftime("%Y-%m")) & (ds.field("date") >= start)
+    if end is not None:
+        before_end = (ds.field("month") <= end.strftime("%Y-%m")) & (ds.field("date") <= end)
+        condition = before_end if condition is None else condition & before_end
+    return history.to_table(columns=columns, filter=condition).to_pandas(date_as_object=False)
+
+
+def has_history(user_id: str, dataset: str) -> bool:
+    """Whether any of the user's `dataset` has been exported yet."""
+    return bool(_partition_months(dataset, user_id))
+
+
+def _food_log_row(entry: Dict) -> Dict:
+    timestamp = datetime.fromisoformat(entry["timestamp"])
+    row = {
+        "timestamp": timestamp,
+        "date": timestamp.date(),
+        "food_item": entry.get("food_item", ""),
+        "quantity": _number(entry.get("quantity", 1)),
+    }
+    for column in ("calories", "protein", "fat", "carbs"):
+        row[column] = _number(entry.get(column, 0))
+    return row
+
+
+def _meal_row(day: date, day_key: str, meal_type: str, meal: Dict) -> Dict:
+    row = {"date": day, "day": day_key, "meal_type": meal_type, "meal_name": meal.get("meal_name", "")}
+    for column in ("calories", "protein", "fat", "carbohydrates"):
+        row[column] = _number(meal.get(column, 0))
+    return row
+
+
+def _number(value) -> float:
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _month(entry: Dict) -> Optional[str]:
+    # ISO timestamps start with YYYY-MM
+    timestamp = entry.get("timestamp")
+    return timestamp[:7] if timestamp else None
+
+
+def _fingerprint(value) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _partition_path(dataset: str, user_id: str, month: str) -> str:
+    return os.path.join(HISTORY_DIR, dataset, f"user_id={user_id}", f"month={month}", "part-0.parquet")
+
+
+def _partition_months(dataset: str, user_id: str) -> set:
+    root = os.path.join(HISTORY_DIR, dataset, f"user_id={user_id}")
+    if not os.path.isdir(root):
+        return set()
+    return {name.split("=", 1)[1] for name in os.listdir(root) if name.startswith("month=")}
+
+
+def _write_partition(dataset: str, user_id: str, month: str, rows: List[Dict]) -> None:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    path = _partition_path(dataset, user_id, month)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    table = pa.Table.from_pylist(rows, schema=_schema(dataset))
+    # Written beside the target and swapped in, so readers never see a partial file
+    tmp_path = _tmp_path(path)
+    pq.write_table(table, tmp_path, compression="zstd")
+    os.replace(tmp_path, path)
+
+
+def _tmp_path(path: str) -> str:
+    # Unique per process and thread, so concurrent exports never share a temp file
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def _manifest_path(user_id: str) -> str:
+    return os.path.join(HISTORY_DIR, "_manifest", f"{user_id}.json")
+
+
+def _read_manifest(user_id: str) -> Dict:
+    try:
+        with open(_manifest_path(user_id), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_manifest(user_id: str, manifest: Dict) -> None:
+    path = _manifest_path(user_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = _tmp_path(path)
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+
+if __name__ == "__main__":
+    # Periodic job: export every user's history
+    from utils import list_user_ids, load_user_data
+
+    for user_id in list_user_ids():
+        users = load_user_data(user_id)
+        if user_id in users:
+            written = export_user_history(user_id, users[user_id], rebuild=True)
+            print(f"{user_id}: {len(written)} partition(s) written")
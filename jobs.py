@@ -0,0 +1,481 @@
+# jobs.py
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+import metrics
+
+DEFAULT_JOBS_DB_PATH = os.environ.get(
+    "NUTRITION_JOBS_DB",
+    os.path.join(os.environ.get("NUTRITION_DATA_DIR", "data"), "jobs.db"),
+)
+
+# A running job whose lease isn't renewed for this long is considered abandoned
+# (its process died) and may be claimed by another worker
+JOB_LEASE_SECONDS = 180
+
+# How often a worker renews the leases of the jobs it is running and looks for
+# jobs whose lease lapsed
+LEASE_RENEW_SECONDS = JOB_LEASE_SECONDS / 3
+
+# Meal requests a worker runs at once, across all of its jobs
+DEFAULT_WORKER_CONCURRENCY = 6
+
+ACTIVE_STATUSES = ("queued", "running")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    completed INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_expires REAL,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_by_user ON jobs (user_id, created_at);
+CREATE TABLE IF NOT EXISTS tasks (
+    job_id TEXT NOT NULL REFERENCES jobs(job_id),
+    task_key TEXT NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    PRIMARY KEY (job_id, task_key)
+);
+"""
+
+
+class JobStore:
+    """
+    Persistent job table (SQLite, WAL) shared by every worker and session.
+
+    A job is a set of named tasks. Task results are written as each one
+    finishes, so a job interrupted by a restart only has its unfinished
+    tasks left to run. Workers take a time-limited lease on a job so two
+    processes never run the same job, and a dead worker's job can be
+    picked up once its lease lapses. Each user has one current job per
+    kind: creating a job supersedes the user's earlier unfinished ones.
+    """
+
+    def __init__(self, db_path: str = DEFAULT_JOBS_DB_PATH):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def create_job(self, user_id: str, kind: str, params: Dict, task_keys: List[str],
+                   done: Dict[str, Dict] = None) -> str:
+        """
+        Adds a queued job, superseding the user's unfinished jobs of the same
+        kind; tasks in `done` are recorded as already finished.
+        """
+        done = done or {}
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'superseded', lease_expires = NULL, updated_at = ?"
+                    " WHERE user_id = ? AND kind = ? AND status IN ('queued', 'running', 'failed')",
+                    (now, user_id, kind),
+                )
+                self._conn.execute(
+                    "INSERT INTO jobs (job_id, user_id, kind, params, status, total, completed, created_at, updated_at)"
+                    " VALUES (?, ?, ?, ?, 'queued', ?, ?, ?, ?)",
+                    (job_id, user_id, kind, json.dumps(params), len(task_keys), len(done), now, now),
+                )
+                self._conn.executemany(
+                    "INSERT INTO tasks (job_id, task_key, status, result) VALUES (?, ?, ?, ?)",
+                    [
+                        (job_id, key, "done", json.dumps(done[key])) if key in done else (job_id, key, "pending", None)
+                        for key in task_keys
+                    ],
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return job_id
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            cursor = self._conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,))
+            return self._job_row(cursor)
+
+    def latest_job(self, user_id: str, kind: str) -> Optional[Dict]:
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT * FROM jobs WHERE user_id = ? AND kind = ? ORDER BY created_at DESC LIMIT 1",
+                (user_id, kind),
+            )
+            return self._job_row(cursor)
+
+    def resumable_jobs(self) -> List[str]:
+        """Queued jobs, plus running jobs whose worker stopped renewing its lease."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT job_id FROM jobs WHERE status = 'queued'"
+                " OR (status = 'running' AND lease_expires < ?) ORDER BY created_at",
+                (time.time(),),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def claim(self, job_id: str, worker: str) -> bool:
+        """Takes (or renews) the lease on a job; False if another live worker holds it."""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, lease_expires = ?, updated_at = ?"
+                " WHERE job_id = ? AND (status IN ('queued', 'failed')"
+                " OR (status = 'running' AND (worker = ? OR lease_expires < ?)))",
+                (worker, now + JOB_LEASE_SECONDS, now, job_id, worker, now),
+            )
+            return cursor.rowcount == 1
+
+    def renew_lease(self, job_id: str, worker: str) -> bool:
+        """Extends the worker's lease on a running job; False if it no longer holds it."""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET lease_expires = ?, updated_at = ?"
+                " WHERE job_id = ? AND status = 'running' AND worker = ?",
+                (now + JOB_LEASE_SECONDS, now, job_id, worker),
+            )
+            return cursor.rowcount == 1
+
+    def pending_tasks(self, job_id: str) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT task_key FROM tasks WHERE job_id = ? AND status != 'done'", (job_id,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def complete_task(self, job_id: str, task_key: str, result: Dict, ok: bool, worker: str) -> None:
+        """Checkpoints one task result and renews the worker's lease."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "UPDATE tasks SET status = ?, result = ? WHERE job_id = ? AND task_key = ?",
+                    ("done" if ok else "failed", json.dumps(result), job_id, task_key),
+                )
+                self._conn.execute(
+                    "UPDATE jobs SET"
+                    " completed = (SELECT COUNT(*) FROM tasks WHERE job_id = ? AND status = 'done'),"
+                    " failed = (SELECT COUNT(*) FROM tasks WHERE job_id = ? AND status = 'failed'),"
+                    " lease_expires = ?, updated_at = ? WHERE job_id = ? AND worker = ?",
+                    (job_id, job_id, now + JOB_LEASE_SECONDS, now, job_id, worker),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def save_partial(self, job_id: str, task_key: str, fields: Dict) -> None:
+        """Stores the fields of a meal that is still streaming in."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE tasks SET result = ? WHERE job_id = ? AND task_key = ? AND status = 'pending'",
+                (json.dumps(fields), job_id, task_key),
+            )
+
+    def partial_results(self, job_id: str) -> Dict[str, Dict]:
+        """Fields received so far for meals that are still being generated."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT task_key, result FROM tasks WHERE job_id = ? AND status = 'pending' AND result IS NOT NULL",
+                (job_id,),
+            ).fetchall()
+        return {key: json.loads(result) for key, result in rows}
+
+    def task_results(self, job_id: str) -> Dict[str, Dict]:
+        """Results of the finished tasks, keyed by task key."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT task_key, result FROM tasks WHERE job_id = ? AND status = 'done'", (job_id,)
+            ).fetchall()
+        return {key: json.loads(result) for key, result in rows}
+
+    def finish(self, job_id: str, status: str, error: str = None) -> bool:
+        """Records a running job's outcome; False if it was superseded meanwhile."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, lease_expires = NULL, updated_at = ?"
+                " WHERE job_id = ? AND status = 'running'",
+                (status, error, time.time(), job_id),
+            )
+            return cursor.rowcount == 1
+
+    def _job_row(self, cursor) -> Optional[Dict]:
+        # Caller holds the lock
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        job = dict(zip([column[0] for column in cursor.description], row))
+        job["params"] = json.loads(job["params"])
+        return job
+
+
+class JobRunner:
+    """
+    In-process worker for meal plan jobs.
+
+    Each meal slot of a plan is its own task, run on a shared bounded pool.
+    Whenever a meal finishes it is checkpointed in the job table and the
+    user's stored plan is rebuilt from every finished task, so the plan
+    fills in while the job runs and survives reruns, closed tabs and
+    restarts. A background thread renews the lease on every job in
+    progress, so a slow API call can't let another worker claim it, and
+    periodically runs `resume_all` to pick up jobs that were queued or
+    whose worker died, including ones whose lease hadn't lapsed yet when
+    the runner started. A job superseded by a newer plan for the same user
+    stops starting meals and no longer writes to the user's plan.
+    """
+
+    def __init__(
+        self,
+        store: JobStore = None,
+        coach_factory: Callable = None,
+        max_concurrency: int = DEFAULT_WORKER_CONCURRENCY,
+    ):
+        self.store = store if store is not None else JobStore()
+        self._coach_factory = coach_factory
+        self._coach = None
+        self.worker = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="meal-job")
+        self._lock = threading.Lock()
+        self._active = set()  # job ids this runner is working on
+        self._checkpoint_locks = {}
+        self._heartbeat = None
+
+    @property
+    def coach(self):
+        with self._lock:
+            if self._coach is None:
+                if self._coach_factory is None:
+                    from models import NutritionCoach
+                    self._coach_factory = NutritionCoach
+                self._coach = self._coach_factory()
+            return self._coach
+
+    def submit_meal_plan(
+        self,
+        user_id: str,
+        user_data: Dict,
+        num_days: int,
+        meal_prep: bool = False,
+        use_library: bool = False,
+        nonce: str = None,
+    ) -> str:
+        """
+        Queues a meal plan for `user_id` and starts it. The profile and
+        targets are copied into the job so a resumed job plans against the
+        same numbers, and so is `nonce` (see NutritionCoach.generate_meal_plan).
+        Slots the meal library can fill are recorded as done up front.
+        """
+        params = {
+            "profile": user_data["profile"],
+            "targets": user_data["targets"],
+            "num_days": num_days,
+            "meal_prep": meal_prep,
+            "nonce": nonce,
+        }
+        task_keys = meal_plan_task_keys(num_days, meal_prep)
+        done = {}
+        if use_library:
+            slots = [_slot(key) for key in task_keys]
+            hits = self.coach._fill_from_library(
+                slots, params["targets"], params["profile"], len(MEAL_TYPES), recent_plan=user_data.get("meals")
+            )
+            done = {key: hits[_slot(key)] for key in task_keys if _slot(key) in hits}
+
+        job_id = self.store.create_job(user_id, "meal_plan", params, task_keys, done)
+        metrics.increment("jobs_total", kind="meal_plan", event="submitted")
+        # Replaces the previous plan right away, with any meals the library filled
+        self._checkpoint(self.store.get_job(job_id))
+        self.resume(job_id)
+        return job_id
+
+    def resume(self, job_id: str) -> bool:
+        """Starts (or restarts) a job's unfinished tasks unless it's already running somewhere."""
+        with self._lock:
+            if job_id in self._active:
+                return False
+            if not self.store.claim(job_id, self.worker):
+                return False
+            self._active.add(job_id)
+            self._start_heartbeat()
+
+        job = self.store.get_job(job_id)
+        pending = self.store.pending_tasks(job_id)
+        if not pending:
+            self._finish(job)
+            return True
+
+        remaining = {"count": len(pending)}
+        for key in pending:
+            future = self._executor.submit(self._run_task, job, key)
+            future.add_done_callback(lambda _, job=job: self._task_done(job, remaining))
+        return True
+
+    def resume_all(self) -> List[str]:
+        """Resumes every queued or abandoned job and keeps checking for more from then on."""
+        with self._lock:
+            self._start_heartbeat()
+        return [job_id for job_id in self.store.resumable_jobs() if self.resume(job_id)]
+
+    def _start_heartbeat(self) -> None:
+        # Caller holds the lock
+        if self._heartbeat is None or not self._heartbeat.is_alive():
+            self._heartbeat = threading.Thread(target=self._heartbeat_loop, name="meal-job-leases", daemon=True)
+            self._heartbeat.start()
+
+    def _heartbeat_loop(self) -> None:
+        while True:
+            time.sleep(LEASE_RENEW_SECONDS)
+            with self._lock:
+                job_ids = list(self._active)
+            for job_id in job_ids:
+                self.store.renew_lease(job_id, self.worker)
+            # A restart within the lease leaves its jobs "running" until the lease lapses
+            self.resume_all()
+
+    def _run_task(self, job: Dict, key: str) -> None:
+        if self.store.get_job(job["job_id"])["status"] == "superseded":
+            return
+        params = job["params"]
+        try:
+            from models import ERROR_MEAL_NAME
+
+            coach = self.coach
+            meal_type = "LUNCH" if key == "prepped_lunch" else key.split("/", 1)[1]
+            # Same prompts (and therefore cache entries) as generate_meal_plan's per-meal path
+            prompt = coach._build_meal_prompt(
+                meal_type, params["targets"], params["profile"], len(MEAL_TYPES),
+                **({"example_ingredient": ("chicken breast", "8 oz")} if key == "prepped_lunch" else {}),
+            )
+            fields = {}
+
+            def on_field(field, value):
+                # Lets the progress view show the meal while it is being written
+                fields[field] = value
+                self.store.save_partial(job["job_id"], key, fields)
+
+            meal = coach._call_anthropic_api(
+                prompt, params["profile"], variant=key, on_field=on_field, nonce=params.get("nonce")
+            )
+            ok = meal.get("meal_name") != ERROR_MEAL_NAME
+        except Exception as e:
+            meal, ok = {"error": str(e)}, False
+
+        self.store.complete_task(job["job_id"], key, meal, ok, self.worker)
+        if ok:
+            self._checkpoint(job)
+
+    def _task_done(self, job: Dict, remaining: Dict) -> None:
+        with self._lock:
+            remaining["count"] -= 1
+            last = remaining["count"] == 0
+        if last:
+            self._finish(job)
+
+    def _finish(self, job: Dict) -> None:
+        job_id = job["job_id"]
+        current = self.store.get_job(job_id)
+        if current["completed"] == current["total"]:
+            if self.store.finish(job_id, "done"):
+                plan = assemble_meal_plan(job["params"], self.store.task_results(job_id))
+                self.coach._remember_meals(plan, job["params"]["profile"])
+                metrics.increment("jobs_total", kind="meal_plan", event="done")
+        elif self.store.finish(job_id, "failed", f"{current['total'] - current['completed']} meal(s) failed"):
+            metrics.increment("jobs_total", kind="meal_plan", event="failed")
+        with self._lock:
+            self._active.discard(job_id)
+            self._checkpoint_locks.pop(job_id, None)
+
+    def _checkpoint(self, job: Dict) -> None:
+        """Writes the plan assembled from every finished task into the user's data."""
+        from utils import update_user_data
+
+        job_id = job["job_id"]
+
+        def write_plan(user_data):
+            # Runs under the user's storage locks, so appends made meanwhile aren't lost.
+            # A newer job supersedes this one before its own first checkpoint, which
+            # waits for these locks, so the newer plan is always written last.
+            if self.store.get_job(job_id)["status"] == "superseded":
+                return False
+            user_data["meals"] = assemble_meal_plan(job["params"], self.store.task_results(job_id))
+            return True
+
+        with self._lock:
+            lock = self._checkpoint_locks.setdefault(job_id, threading.Lock())
+        with lock:
+            update_user_data(job["user_id"], write_plan)
+
+
+MEAL_TYPES = ["Breakfast", "Lunch", "Dinner"]
+
+
+def meal_plan_task_keys(num_days: int, meal_prep: bool) -> List[str]:
+    """Task keys in plan order: "prepped_lunch" and "Day N/<meal type>"."""
+    keys = ["prepped_lunch"] if meal_prep else []
+    for day in range(1, num_days + 1):
+        for meal_type in MEAL_TYPES:
+            if meal_type == "Lunch" and meal_prep:
+                continue
+            keys.append(f"Day {day}/{meal_type}")
+    return keys
+
+
+def assemble_meal_plan(params: Dict, results: Dict[str, Dict]) -> Dict:
+    """The {"Day N": {meal type: meal}} plan from the finished tasks; unfinished slots are left out."""
+    meal_plan = {}
+    for day in range(1, params["num_days"] + 1):
+        day_key = f"Day {day}"
+        meal_plan[day_key] = {}
+        for meal_type in MEAL_TYPES:
+            if meal_type == "Lunch" and params["meal_prep"]:
+                meal = results.get("prepped_lunch")
+            else:
+                meal = results.get(f"{day_key}/{meal_type}")
+            if meal is not None:
+                meal_plan[day_key][meal_type] = meal
+    return meal_plan
+
+
+def _slot(key: str):
+    """Task key -> the slot form used by NutritionCoach ("prepped_lunch" or (day, meal type))."""
+    if key == "prepped_lunch":
+        return key
+    day, meal_type = key.split("/", 1)
+    return int(day.split()[1]), meal_type
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_job_runner() -> JobRunner:
+    """Returns this process's runner, resuming interrupted jobs the first time it's created."""
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = JobRunner()
+            _runner.resume_all()
+        return _runner
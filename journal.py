@@ -0,0 +1,139 @@
+# journal.py
+import os
+import json
+import threading
+from typing import Dict, Optional
+
+# Number of journaled events after which a background compaction is started
+DEFAULT_COMPACT_THRESHOLD = 500
+
+
+class EventJournal:
+    """
+    Append-only JSONL log of small list appends (food log entries, chat messages).
+
+    Each event records a sequence number, the user, the section and the
+    record itself. Appending writes and fsyncs a single line, so its cost
+    doesn't depend on how much data the user already has. Sequence numbers
+    only ever increase: `truncate` leaves a marker line holding the last
+    one, so numbering carries on after a compaction. A snapshot records the
+    last sequence number folded into it (its watermark) and `replay` applies
+    every event above that, which keeps replay idempotent if a crash happens
+    between writing a snapshot and truncating the journal, and keeps both
+    of two appends made from the same copy of a list.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.RLock()
+        self._count = None  # events in the journal, counted lazily
+        self._compaction_thread: Optional[threading.Thread] = None
+
+    def append(self, user_id: str, section: str, record: Dict) -> int:
+        """
+        Durably appends one event and returns the number of pending events.
+        Callers appending from several processes hold a file lock around it.
+        """
+        with self.lock:
+            count = len(self)
+            line = json.dumps(
+                {"seq": self.last_seq() + 1, "user_id": user_id, "section": section, "record": record}
+            )
+            with open(self.path, "a") as f:
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._count = count + 1
+            return self._count
+
+    def replay(self, users: Dict, watermark: int = 0) -> Dict:
+        """Applies the events after `watermark` to `users` in place and returns it."""
+        with self.lock:
+            count = 0
+            for event in self._read_events():
+                if "record" not in event:
+                    continue  # truncation marker
+                count += 1
+                if event["seq"] > watermark:
+                    user = users.setdefault(event["user_id"], {})
+                    user.setdefault(event["section"], []).append(event["record"])
+            self._count = count
+        return users
+
+    def last_seq(self) -> int:
+        """Sequence number of the newest event (or of the last one before a truncation)."""
+        with self.lock:
+            last_line = self._last_line()
+            if last_line is not None:
+                try:
+                    return json.loads(last_line)["seq"]
+                except (ValueError, KeyError):
+                    pass
+            # Torn final line from a crash mid-append: fall back to a full scan
+            return max((event.get("seq", 0) for event in self._read_events()), default=0)
+
+    def truncate(self) -> None:
+        """Drops all events; call only after they are folded into the snapshot."""
+        with self.lock:
+            marker = json.dumps({"seq": self.last_seq()})
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(marker + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self._count = 0
+
+    def __len__(self) -> int:
+        with self.lock:
+            if self._count is None:
+                self._count = sum(1 for event in self._read_events() if "record" in event)
+            return self._count
+
+    def _last_line(self) -> Optional[bytes]:
+        # Reads backwards from the end so appends don't rescan the whole journal
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return None
+        with f:
+            end = f.seek(0, os.SEEK_END)
+            size = 4096
+            while True:
+                start = max(0, end - size)
+                f.seek(start)
+                lines = f.read(end - start).rstrip(b"\n").split(b"\n")
+                if len(lines) > 1 or start == 0:
+                    return lines[-1] or None
+                size *= 2
+
+    def _read_events(self):
+        try:
+            f = open(self.path, "r")
+        except FileNotFoundError:
+            return
+        with f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # A torn final line from a crash mid-append; everything before it is intact
+                    break
+
+
+def compact_in_background(journal: EventJournal, compact) -> bool:
+    """
+    Runs `compact()` on a daemon thread unless a compaction of this journal is
+    already running. Returns True if a new compaction was started.
+    """
+    with journal.lock:
+        thread = journal._compaction_thread
+        if thread is not None and thread.is_alive():
+            return False
+        thread = threading.Thread(target=compact, name="journal-compaction", daemon=True)
+        journal._compaction_thread = thread
+        thread.start()
+        return True
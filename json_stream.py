@@ -0,0 +1,110 @@
+# json_stream.py
+import json
+from typing import Any, Dict, List, Tuple
+
+
+class JSONObjectStream:
+    """
+    Incremental parser for the first JSON object in streamed model output.
+
+    Text is fed in chunks as it arrives. Anything outside the object (prose,
+    code fences) is skipped, and each top-level member is parsed as soon as
+    the comma or brace that ends it arrives, so callers can show
+    `meal_name` long before the macros are written. Once the object closes,
+    `value` holds the whole thing. A candidate that turns out not to be
+    JSON (e.g. "{see below}" in the prose) is dropped and scanning resumes
+    after it. If only the assembly fails (e.g. a trailing comma) while every
+    member parsed, the members are used as the object.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.fields: Dict[str, Any] = {}  # completed top-level members, in arrival order
+        self.value = None  # the whole object, once it has closed
+        self._pos = 0  # next character to scan
+        self._reset()
+
+    def _reset(self) -> None:
+        self._start = None  # index of the candidate object's opening brace
+        self._member_start = None
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._bad_members = 0
+        self.fields = {}
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """Adds streamed text; returns the (key, value) members it completed."""
+        self.text += chunk
+        completed = []
+        text = self.text
+        while self.value is None and self._pos < len(text):
+            char = text[self._pos]
+            if self._depth == 0:
+                # Outside the object only an opening brace matters; prose can hold stray quotes
+                if char == "{":
+                    self._start = self._pos
+                    self._member_start = self._pos + 1
+                    self._depth = 1
+            elif self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    completed += self._end_member(self._pos)
+                    self._close(self._pos)
+            elif char == "," and self._depth == 1:
+                completed += self._end_member(self._pos)
+            self._pos += 1
+        return completed
+
+    def _end_member(self, end: int) -> List[Tuple[str, Any]]:
+        segment = self.text[self._member_start:end].strip()
+        self._member_start = end + 1
+        if not segment:
+            return []
+        try:
+            member = json.loads("{" + segment + "}")
+        except ValueError:
+            self._bad_members += 1
+            return []
+        self.fields.update(member)
+        return list(member.items())
+
+    def _close(self, end: int) -> None:
+        try:
+            value = json.loads(self.text[self._start:end + 1])
+        except ValueError:
+            value = dict(self.fields) if self.fields and not self._bad_members else None
+        if isinstance(value, dict):
+            self.value = value
+        else:
+            self._reset()
+
+
+def loads_object(text: str) -> Dict:
+    """
+    json.loads for model replies: the first JSON object in `text`, ignoring
+    any prose or code fences around it. Raises json.JSONDecodeError if
+    there is none.
+    """
+    try:
+        value = json.loads(text)
+        if isinstance(value, dict):
+            return value
+    except ValueError:
+        pass
+    stream = JSONObjectStream()
+    stream.feed(text)
+    if stream.value is None:
+        raise json.JSONDecodeError("No JSON object found in reply", text, 0)
+    return stream.value
@@ -6,37 +6,57 @@ from ui import (
     display_calendar_page,
     display_group_page,
     display_profile_page,
-    display_meal_plan_page
+    display_meal_plan_page,
+    display_trends_page,
+    display_diagnostics_page,
 )
-from utils import load_user_data, save_user_data
-from models import NutritionCoach
+from utils import load_user_data, normalize_user_id
+from jobs import get_job_runner
+import metrics
 
 
 def main():
     st.title("Nutrition Coach App")
 
-    # Load user data (replace with actual loading logic)
-    users = load_user_data()
+    # Starts this process's job worker on first run, resuming jobs a restart interrupted
+    get_job_runner()
+
+    # Each browser session picks who it is; only that user's data is loaded
+    name = st.sidebar.text_input("User", value=st.session_state.get("user_id", ""), placeholder="Your name")
+    user_id = normalize_user_id(name)
+    if not user_id:
+        # Nothing is loaded until the session names a user, so no one lands in someone else's data
+        st.info("Enter your name in the sidebar to get started.")
+        return
+    st.session_state["user_id"] = user_id
+    users = load_user_data(user_id)
 
     # Sidebar navigation
-    page = st.sidebar.selectbox(
-        "Select Page",
-        ["Tracker", "Coach", "Calendar", "Profile", "Meal Plan"],  # Add "Meal Plan" here
-    )
+    pages = ["Tracker", "Coach", "Calendar", "Profile", "Meal Plan", "Trends"]  # Add "Meal Plan" here
+    if metrics.ENABLED:
+        pages.append("Diagnostics")  # Hidden unless NUTRITION_METRICS is set
+    page = st.sidebar.selectbox("Select Page", pages)
 
     # Display the selected page
     if page == "Tracker":
-        display_tracker_page(users)
+        display_tracker_page(users, user_id)
     elif page == "Coach":
-        display_coach_page(users)
+        display_coach_page(users, user_id)
     elif page == "Calendar":
-        display_calendar_page(users)
+        display_calendar_page(users, user_id)
     elif page == "Group":
-        display_group_page(users)
+        display_group_page(users, user_id)
     elif page == "Profile":
-        display_profile_page(users)
+        display_profile_page(users, user_id)
     elif page == "Meal Plan":
-        display_meal_plan_page(users)
+        display_meal_plan_page(users, user_id)
+    elif page == "Trends":
+        display_trends_page(users, user_id)
+    elif page == "Diagnostics":
+        display_diagnostics_page(users)
+
+    # Export metrics for scraping (no-op when disabled)
+    metrics.maybe_flush()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,158 @@
+# meal_library.py
+import os
+import json
+import hashlib
+import threading
+from collections import defaultdict
+from typing import Dict, Iterable, Optional, Tuple
+
+DEFAULT_LIBRARY_PATH = os.environ.get(
+    "NUTRITION_MEAL_LIBRARY",
+    os.path.join(os.environ.get("NUTRITION_DATA_DIR", "data"), "meal_library.jsonl"),
+)
+
+# A library meal is a hit if its macro vector is within this fraction of the target's calories
+DEFAULT_MATCH_TOLERANCE = 0.1
+
+# Candidates fetched per tree when skipping meals that are excluded (e.g. already in the plan)
+_QUERY_BATCH = 8
+
+MACRO_FIELDS = ("calories", "protein", "fat", "carbohydrates")
+
+# Macros are compared in kcal so a gram of fat weighs more than a gram of protein
+_KCAL_PER_UNIT = (1.0, 4.0, 9.0, 4.0)
+
+
+def macro_vector(meal: Dict) -> Tuple[float, ...]:
+    """(calories, protein, fat, carbohydrates) expressed in kcal."""
+    return tuple(float(meal.get(field, 0) or 0) * scale for field, scale in zip(MACRO_FIELDS, _KCAL_PER_UNIT))
+
+
+def restriction_tags(restrictions: Iterable[str]) -> frozenset:
+    return frozenset(r.strip().lower() for r in restrictions if r and r.strip())
+
+
+class MealLibrary:
+    """
+    Persistent library of every generated meal, searchable by macro profile.
+
+    Meals are appended to a JSONL file, one record per distinct meal and
+    meal type (addressed by both, so regenerating the same meal doesn't
+    duplicate it, while a meal saved as Breakfast can also be stored as a
+    Lunch), tagged with the dietary restrictions it was generated under.
+    For lookups, meals are grouped by (meal type, restriction tags) with a
+    KD-tree over each group's macro vectors; `nearest` searches only the
+    groups whose tags cover the requested restrictions. Trees are rebuilt
+    lazily after new meals arrive.
+    """
+
+    def __init__(self, path: Optional[str] = DEFAULT_LIBRARY_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._meals: Dict[str, Dict] = {}  # meal id -> {"meal_type", "tags", "meal"}
+        self._groups = None  # (meal type, tags) -> (KD-tree, [meal ids]); None when stale
+
+        if path and os.path.exists(path):
+            with open(path, "r") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # torn final line from a crash mid-append
+                    self._meals[record["id"]] = record
+
+    def __len__(self) -> int:
+        return len(self._meals)
+
+    @staticmethod
+    def meal_id(meal_type: str, meal: Dict) -> str:
+        return hashlib.sha256(json.dumps([meal_type.capitalize(), meal], sort_keys=True).encode()).hexdigest()
+
+    def add(self, meal_type: str, meal: Dict, restrictions: Iterable[str] = ()) -> bool:
+        """Adds a meal; returns False if it was already in the library as this meal type."""
+        meal_id = self.meal_id(meal_type, meal)
+        record = {
+            "id": meal_id,
+            "meal_type": meal_type.capitalize(),
+            "tags": sorted(restriction_tags(restrictions)),
+            "meal": meal,
+        }
+        with self._lock:
+            if meal_id in self._meals:
+                return False
+            self._meals[meal_id] = record
+            self._groups = None
+            if self.path:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                with open(self.path, "a") as f:
+                    f.write(json.dumps(record) + "\n")
+        return True
+
+    def nearest(
+        self,
+        meal_type: str,
+        target: Dict,
+        restrictions: Iterable[str] = (),
+        exclude: Iterable[str] = (),
+        tolerance: float = DEFAULT_MATCH_TOLERANCE,
+    ) -> Optional[Tuple[str, Dict]]:
+        """
+        Closest meal of `meal_type` to the `target` macros whose restriction
+        tags include all of `restrictions`, skipping meal ids in `exclude`.
+        Returns (meal id, meal), or None if nothing lies within `tolerance`.
+        """
+        meal_type = meal_type.capitalize()
+        wanted = restriction_tags(restrictions)
+        exclude = set(exclude)
+        point = macro_vector(target)
+        max_distance = tolerance * max(point[0], 1)
+
+        best = None
+        for (group_type, tags), (tree, ids) in self._index().items():
+            if group_type != meal_type or not wanted <= tags:
+                continue
+            k = min(len(ids), len(exclude) + _QUERY_BATCH)
+            distances, positions = tree.query(point, k=k, distance_upper_bound=max_distance)
+            if k == 1:
+                distances, positions = [distances], [positions]
+            for distance, position in zip(distances, positions):
+                if position >= len(ids):
+                    break  # no more neighbours within max_distance
+                if ids[position] in exclude:
+                    continue
+                if best is None or distance < best[0]:
+                    best = (distance, ids[position])
+                break
+
+        if best is None:
+            return None
+        return best[1], self._meals[best[1]]["meal"]
+
+    def _index(self) -> Dict:
+        with self._lock:
+            if self._groups is None:
+                # Imported here so only plan generation with the library loads scipy
+                import numpy as np
+                from scipy.spatial import cKDTree
+
+                members = defaultdict(list)
+                for meal_id, record in self._meals.items():
+                    members[(record["meal_type"], frozenset(record["tags"]))].append(meal_id)
+                self._groups = {
+                    key: (cKDTree(np.array([macro_vector(self._meals[i]["meal"]) for i in ids])), ids)
+                    for key, ids in members.items()
+                }
+            return self._groups
+
+
+_default_library = None
+_default_library_lock = threading.Lock()
+
+
+def get_meal_library() -> MealLibrary:
+    """Returns the process-wide library shared by every NutritionCoach."""
+    global _default_library
+    with _default_library_lock:
+        if _default_library is None:
+            _default_library = MealLibrary()
+        return _default_library
@@ -0,0 +1,175 @@
+# metrics.py
+import os
+import time
+import threading
+from bisect import bisect_left
+from functools import wraps
+from typing import Dict, Tuple
+
+# Metrics are off unless NUTRITION_METRICS is set; disabled calls return immediately
+ENABLED = os.environ.get("NUTRITION_METRICS", "") not in ("", "0", "false")
+
+# Prometheus text exposition file, rewritten at most every METRICS_FLUSH_INTERVAL seconds
+METRICS_FILE = os.environ.get("NUTRITION_METRICS_FILE", "metrics.prom")
+METRICS_FLUSH_INTERVAL = 10.0
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+BYTES_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8, 1e9)
+TOKEN_BUCKETS = (10, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+_HELP = {
+    "nutrition_coach_call_seconds": "Latency of NutritionCoach methods",
+    "anthropic_input_tokens": "Input tokens per Anthropic API call",
+    "anthropic_output_tokens": "Output tokens per Anthropic API call",
+    "json_parse_failures_total": "Model replies that were not valid JSON",
+    "meals_generated_total": "Meals produced by generate_meal_plan, by outcome",
+    "coach_time_to_first_token_seconds": "Time to first streamed coach token",
+    "storage_seconds": "Duration of load_user_data/save_user_data",
+    "storage_bytes": "Bytes read or written by load_user_data/save_user_data",
+    "storage_coalesced_saves_total": "User documents written by coalesced save_user_data flushes",
+    "page_render_seconds": "Time to render each display_*_page",
+    "jobs_total": "Background jobs by kind and lifecycle event",
+    "api_retries_total": "Anthropic API attempts retried by the request scheduler, by call and error",
+    "api_hedges_total": "Duplicate (hedged) Anthropic API attempts sent for slow calls",
+    "api_queue_wait_seconds": "Time API calls waited for rate limit capacity, by priority",
+    "cache_write_errors_total": "LLM responses that could not be written to the response cache",
+}
+
+_lock = threading.Lock()
+_counters: Dict[Tuple[str, Tuple], float] = {}
+_histograms: Dict[Tuple[str, Tuple], Dict] = {}
+_last_flush = 0.0
+
+
+def _key(name: str, labels: Dict) -> Tuple[str, Tuple]:
+    return name, tuple(sorted(labels.items()))
+
+
+def increment(name: str, amount: float = 1, **labels) -> None:
+    """Adds `amount` to a counter."""
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def observe(name: str, value: float, buckets=LATENCY_BUCKETS, **labels) -> None:
+    """Records one observation in a histogram (buckets are fixed on first use)."""
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = {"buckets": buckets, "counts": [0] * (len(buckets) + 1), "sum": 0.0, "count": 0}
+            _histograms[key] = histogram
+        histogram["counts"][bisect_left(histogram["buckets"], value)] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+
+def timed(name: str, **labels):
+    """Decorator that records the wrapped function's duration in a latency histogram."""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return fn(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - started, **labels)
+        return wrapper
+    return decorator
+
+
+def record_usage(method: str, message) -> None:
+    """Records token usage from an Anthropic response, if it reports any."""
+    usage = getattr(message, "usage", None)
+    if not ENABLED or usage is None:
+        return
+    observe("anthropic_input_tokens", usage.input_tokens, buckets=TOKEN_BUCKETS, method=method)
+    observe("anthropic_output_tokens", usage.output_tokens, buckets=TOKEN_BUCKETS, method=method)
+
+
+def snapshot() -> Dict:
+    """Copy of every counter and histogram, keyed by (name, labels)."""
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "histograms": {
+                key: {**histogram, "counts": list(histogram["counts"])}
+                for key, histogram in _histograms.items()
+            },
+        }
+
+
+def reset() -> None:
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Tuple, extra: Tuple = ()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def render_prometheus() -> str:
+    """Renders all metrics in the Prometheus text exposition format."""
+    data = snapshot()
+    lines = []
+    seen = set()
+
+    def header(name: str, kind: str) -> None:
+        if name in seen:
+            return
+        seen.add(name)
+        if name in _HELP:
+            lines.append(f"# HELP {name} {_HELP[name]}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    for (name, labels), value in sorted(data["counters"].items()):
+        header(name, "counter")
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+
+    for (name, labels), histogram in sorted(data["histograms"].items(), key=lambda item: item[0]):
+        header(name, "histogram")
+        cumulative = 0
+        for bound, count in zip(histogram["buckets"], histogram["counts"]):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels(labels, (('le', bound),))} {cumulative}")
+        lines.append(f"{name}_bucket{_format_labels(labels, (('le', '+Inf'),))} {histogram['count']}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {histogram['sum']}")
+        lines.append(f"{name}_count{_format_labels(labels)} {histogram['count']}")
+
+    return "\n".join(lines) + "\n"
+
+
+def maybe_flush(path: str = METRICS_FILE, force: bool = False) -> bool:
+    """
+    Writes the exposition text to `path` (for a node-exporter textfile
+    collector or similar) if enabled and the flush interval has passed.
+    """
+    global _last_flush
+    if not ENABLED:
+        return False
+    now = time.monotonic()
+    with _lock:
+        if not force and now - _last_flush < METRICS_FLUSH_INTERVAL:
+            return False
+        _last_flush = now
+
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(render_prometheus())
+    os.replace(tmp_path, path)
+    return True
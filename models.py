@@ -1,119 +1,297 @@
 # models.py
 import os
 import json
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import anthropic
+import httpx
 import streamlit as st
-from typing import Dict, List
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from typing import Callable, Dict, Iterator, List
+from cache import ResponseCache, get_response_cache
+from json_stream import JSONObjectStream, loads_object
+from meal_library import MealLibrary, get_meal_library
+from scheduler import (
+    RequestScheduler,
+    get_request_scheduler,
+    DEADLINE_SECONDS,
+    PRIORITY_BULK,
+    PRIORITY_INTERACTIVE,
+)
+from portion_optimizer import optimize_day
+from nutrition_targets import compute_targets, TARGET_COLUMNS
+from utils import estimate_tokens
+import metrics
+from coach_memory import DEFAULT_CONTEXT_TOKEN_BUDGET, build_coach_messages, conversation_summary
+
+# Upper bound on meal requests sent to the API at the same time
+DEFAULT_MAX_CONCURRENCY = 6
+
+# Name of the placeholder meal returned when generation fails
+ERROR_MEAL_NAME = "Error Meal"
+
+# Whole-day mode: days requested per API call, reply tokens reserved per meal,
+# and how far (as a fraction) a day's totals may drift from the targets
+DEFAULT_DAYS_PER_REQUEST = 3
+DAY_PLAN_OUTPUT_TOKENS_PER_MEAL = 350
+DAY_TOTAL_TOLERANCE = 0.1
+
+ANALYSIS_SYSTEM_PROMPT = (
+    "You are a highly skilled nutritionist. The user will provide a description "
+    "of a food item or meal they consumed. Analyze the meal with respect to "
+    "its nutritional content, healthiness, and alignment with the user's goals."
+)
+
+# Batch analysis packs entries into requests of roughly this many tokens (prompt + reply)
+ANALYSIS_TOKEN_BUDGET = 4000
+ANALYSIS_OUTPUT_TOKENS_PER_ENTRY = 150
+
+# Upper bound on the rolling conversation summary kept for the coach
+SUMMARY_MAX_TOKENS = 400
+
+COACH_ERROR_RESPONSE = "Sorry, I encountered an error while processing your request."
+
+# Connection pool and timeout settings for the shared Anthropic client
+ANTHROPIC_MAX_CONNECTIONS = int(os.environ.get("ANTHROPIC_MAX_CONNECTIONS", 20))
+ANTHROPIC_MAX_KEEPALIVE = int(os.environ.get("ANTHROPIC_MAX_KEEPALIVE", 10))
+ANTHROPIC_KEEPALIVE_EXPIRY = float(os.environ.get("ANTHROPIC_KEEPALIVE_EXPIRY", 120))
+ANTHROPIC_CONNECT_TIMEOUT = float(os.environ.get("ANTHROPIC_CONNECT_TIMEOUT", 5))
+ANTHROPIC_READ_TIMEOUT = float(os.environ.get("ANTHROPIC_READ_TIMEOUT", 120))
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_anthropic_client() -> anthropic.Anthropic:
+    """
+    Returns the process-wide Anthropic client.
+
+    Built once and shared by every NutritionCoach, so all Streamlit script
+    threads reuse the same keep-alive connection pool instead of paying
+    connection and TLS setup on each click. The underlying HTTP client is
+    thread-safe.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            # Get API key from environment variable (required)
+            anthropic_api_key = os.environ.get("ANTHROPIC_API_KEY")
+
+            if not anthropic_api_key:
+                raise ValueError("The ANTHROPIC_API_KEY environment variable is not set!")
+
+            _client = anthropic.Anthropic(
+                api_key=anthropic_api_key,
+                # Retries are done by the RequestScheduler, which knows the rate limits and deadlines
+                max_retries=0,
+                timeout=httpx.Timeout(ANTHROPIC_READ_TIMEOUT, connect=ANTHROPIC_CONNECT_TIMEOUT),
+                http_client=anthropic.DefaultHttpxClient(
+                    limits=httpx.Limits(
+                        max_connections=ANTHROPIC_MAX_CONNECTIONS,
+                        max_keepalive_connections=ANTHROPIC_MAX_KEEPALIVE,
+                        keepalive_expiry=ANTHROPIC_KEEPALIVE_EXPIRY,
+                    ),
+                ),
+            )
+        return _client
+
 
 class NutritionCoach:
-    def __init__(self):
-        # Get API key from environment variable (required)
-        anthropic_api_key = os.environ.get("ANTHROPIC_API_KEY")
+    def __init__(
+        self,
+        cache: ResponseCache = None,
+        client: anthropic.Anthropic = None,
+        library: MealLibrary = None,
+        scheduler: RequestScheduler = None,
+    ):
+        # Reuse the pooled client; constructing a NutritionCoach is now cheap
+        self.client = client if client is not None else get_anthropic_client()
+
+        # Shared across instances so repeated prompts skip the API entirely
+        self.cache = cache if cache is not None else get_response_cache()
 
-        if not anthropic_api_key:
-            raise ValueError("The ANTHROPIC_API_KEY environment variable is not set!")
+        # Every generated meal is kept here so later plans can reuse it
+        self.library = library if library is not None else get_meal_library()
 
-        self.client = anthropic.Anthropic(api_key=anthropic_api_key)
+        # Every API call goes through one process-wide set of rate limits
+        self.scheduler = scheduler if scheduler is not None else get_request_scheduler()
 
+        # Filled in by stream_ai_coach_response once a response finishes
+        self.last_response_timing = None
+
+    @metrics.timed("nutrition_coach_call_seconds", method="calculate_targets")
     def calculate_targets(self, user_data: Dict) -> Dict:
         """Calculates calorie and macro targets based on user data."""
-        user_profile = user_data.get("profile", {})
-
-        # 1. Basic BMR/TDEE logic
-        weight_kg = user_profile.get("weight", 0) * 0.453592
-        height_cm = user_profile.get("height", 0) * 2.54
-        age = user_profile.get("age", 0)
-        sex = user_profile.get("biological_sex", "Male")
-
-        if sex == "Male":
-            bmr = (10 * weight_kg) + (6.25 * height_cm) - (5 * age) + 5
-        else:  # Female
-            bmr = (10 * weight_kg) + (6.25 * height_cm) - (5 * age) - 161
-
-        activity_multipliers = {
-            "Sedentary": 1.2,
-            "Lightly Active": 1.375,
-            "Moderately Active": 1.55,
-            "Very Active": 1.725,
-            "Extremely Active": 1.9,
-        }
-        activity_level = user_profile.get("activity_level", "Sedentary")
-        tdee = bmr * activity_multipliers.get(activity_level, 1.2)
-
-        # 2. Rate of Progress => Calorie adjustment
-        # 1 lb of body weight ≈ 3500 calories. So 1 lb/week ~ -500 cals/day, 0.5 lb/week ~ -250 cals/day, etc.
-        progress_map = {
-            "Lose 1 lb/week (recommended)": -500,
-            "Lose 0.5 lb/week": -250,
-            "Maintenance": 0,
-            "Gain 0.5 lb/week": 250,
-            "Gain 1 lb/week (recommended)": 500
-        }
-        rate_of_progress = user_profile.get("rate_of_progress", "Maintenance")
-        daily_calorie_delta = progress_map.get(rate_of_progress, 0)
-
-        # Final calorie target
-        calorie_target = tdee + daily_calorie_delta
-
-        # 3. If you still want to factor "goal" (Cutting, Bulking, etc.), you can integrate or override
-        #    For example, if user_profile["goal"] == "Cutting", you might do additional logic. 
-        #    Or ignore "goal" entirely if you're always using rate_of_progress.
-
-        # 4. Calculate macros
-        # Protein
-        if user_profile.get("lean_body_mass", 0) == 0:
-            # If no LBM given, use total weight for the protein calculation
-            protein_target = user_profile.get("protein_target", 0.8) * user_profile.get("weight", 0)
-        else:
-            protein_target = user_profile.get("protein_target", 0.8) * user_profile.get("lean_body_mass", 0)
-
-        # Fat: ensure at least 20% of total cals, etc.
-        # (Below is the same logic you had, but you might want to tweak the "max" logic if you prefer a simpler approach)
-        # Example: we'll just do a minimum of 20% cals from fat:
-        fat_min = 0.2 * calorie_target / 9
-        # We also subtract macros for protein from total cals:
-        # Then see how we handle the remainder. 
-        # If you'd like to set a max for carbs, you can do so similarly.
-
-        # We'll keep your original logic for demonstration, but watch out for negative values if the math doesn't align:
-        fat_target = max(fat_min, calorie_target - (protein_target * 4) - (tdee * 0.5)) / 9
-
-        # Carbs: leftover
-        carb_target = (calorie_target - (protein_target * 4) - (fat_target * 9)) / 4
-
-        # 5. Round and store
-        targets = {
-            "calories": max(round(calorie_target), 0),
-            "protein": max(round(protein_target), 0),
-            "fat": max(round(fat_target), 0),
-            "carbohydrates": max(round(carb_target), 0),
-        }
-
-        user_data["targets"] = targets
+        user_data["targets"] = compute_targets(user_data.get("profile", {}))
         return user_data
 
-    def generate_meal_plan(self, user_data: Dict, num_days: int, meal_prep: bool = False) -> Dict:
+    @metrics.timed("nutrition_coach_call_seconds", method="generate_meal_plan")
+    def generate_meal_plan(
+        self,
+        user_data: Dict,
+        num_days: int,
+        meal_prep: bool = False,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        days_per_request: int = 0,
+        use_library: bool = False,
+        scale_portions: bool = True,
+        on_meal_field: Callable = None,
+        nonce: str = None,
+    ) -> Dict:
         """
         Generate meal recommendations based on user data.
         If meal_prep is True, then lunch is the same each day, etc.
+
+        All meal prompts are sent concurrently, with at most `max_concurrency`
+        requests in flight. A value of 1 generates the meals one at a time.
+
+        With `days_per_request` > 0, whole days are requested instead of single
+        meals (see _generate_day_plans); 0 keeps one request per meal.
+
+        With `use_library`, slots are first filled from the meal library
+        (closest stored meal to the slot's macros that fits the user's
+        restrictions, each used at most once per plan) and only the misses go
+        to the API. Every generated meal is added to the library either way.
+
+        `scale_portions` lets whole-day mode fix a day whose totals are off by
+        rescaling its meals' portions (portion_optimizer) before it falls back
+        to re-requesting meals.
+
+        `on_meal_field(slot, key, value)` is called from the worker threads as
+        each field of a per-meal request completes, with slot labels like
+        'Day 2/Dinner' or 'prepped_lunch', so the page can show meals while
+        they are still being written.
+
+        Generated meals are cached by prompt and slot, so the same inputs give
+        back the same plan. A `nonce` is folded into every cache key: pass a
+        fresh one to get new meals instead (the page does when replacing a
+        plan); resuming with the same nonce still reuses what was generated.
         """
         user_profile = user_data["profile"]
         targets = user_data["targets"]
 
         meals_per_day = 3
-        meal_plan = {}
+        meal_types = ["Breakfast", "Lunch", "Dinner"]
+
+        library_meals = {}
+        if use_library:
+            slots = ["prepped_lunch"] if meal_prep else []
+            slots += [
+                (day, meal_type)
+                for day in range(1, num_days + 1)
+                for meal_type in meal_types
+                if not (meal_type == "Lunch" and meal_prep)
+            ]
+            library_meals = self._fill_from_library(
+                slots, targets, user_profile, meals_per_day, recent_plan=user_data.get("meals")
+            )
+
+        if days_per_request > 0:
+            user_data["meals"] = self._generate_day_plans(
+                user_profile, targets, num_days, meal_types, meal_prep, days_per_request, max_concurrency,
+                library_meals, scale_portions, on_meal_field, nonce,
+            )
+            self._remember_meals(user_data["meals"], user_profile)
+            return user_data
+
+        # Build every prompt up front, keyed by the (day, meal type) slot it fills
+        prompts = {}
 
         # Optionally, pre-generate a single lunch if meal prep is True
-        prepped_lunch = None
         if meal_prep:
-            # Generate one lunch meal here to reuse
-            meal_calories = targets["calories"] / meals_per_day
-            meal_protein = targets["protein"] / meals_per_day
-            meal_fat = targets["fat"] / meals_per_day
-            meal_carbs = targets["carbohydrates"] / meals_per_day
+            prompts["prepped_lunch"] = self._build_meal_prompt(
+                "LUNCH", targets, user_profile, meals_per_day,
+                example_ingredient=("chicken breast", "8 oz"),
+            )
 
-            prompt = f"""
-    Create a LUNCH that fits the following criteria:
+        for day in range(1, num_days + 1):
+            for meal_type in meal_types[:meals_per_day]:
+                if meal_type == "Lunch" and meal_prep:
+                    # Filled from the prepped lunch below
+                    continue
+                prompts[(day, meal_type)] = self._build_meal_prompt(
+                    meal_type, targets, user_profile, meals_per_day
+                )
+
+        prompts = {key: prompt for key, prompt in prompts.items() if key not in library_meals}
+        results = self._run_meal_prompts(
+            prompts, user_profile, max_concurrency, on_field=on_meal_field, nonce=nonce
+        )
+        results.update(library_meals)
+
+        # Assemble in Day N order regardless of completion order
+        prepped_lunch = results.get("prepped_lunch")
+        meal_plan = {}
+        for day in range(1, num_days + 1):
+            day_key = f"Day {day}"
+            meal_plan[day_key] = {}
+
+            for meal_type in meal_types[:meals_per_day]:
+                if meal_type == "Lunch" and meal_prep and prepped_lunch:
+                    # Reuse the prepped lunch
+                    meal_plan[day_key][meal_type] = prepped_lunch
+                else:
+                    meal_plan[day_key][meal_type] = results[(day, meal_type)]
+
+        user_data["meals"] = meal_plan
+        self._remember_meals(meal_plan, user_profile)
+        return user_data
+
+    def _fill_from_library(
+        self, slots: List, targets: Dict, user_profile: Dict, meals_per_day: int, recent_plan: Dict = None
+    ) -> Dict:
+        """
+        Looks up each slot ("prepped_lunch" or (day, meal type)) in the meal
+        library at an even share of the daily targets. Returns {slot: meal}
+        for the hits; a library meal fills at most one slot per plan, and
+        meals of `recent_plan` (the plan being replaced) aren't reused, so
+        regenerating doesn't hand back the same plan reshuffled.
+        """
+        share = {column: targets[column] / meals_per_day for column in TARGET_COLUMNS}
+        restrictions = user_profile.get("dietary_restrictions", [])
+        used = {
+            MealLibrary.meal_id(meal_type, meal)
+            for day_meals in (recent_plan or {}).values() if isinstance(day_meals, dict)
+            for meal_type, meal in day_meals.items() if isinstance(meal, dict)
+        }
+        hits = {}
+        for slot in slots:
+            meal_type = "Lunch" if slot == "prepped_lunch" else slot[1]
+            match = self.library.nearest(meal_type, share, restrictions, exclude=used)
+            if match is not None:
+                meal_id, meal = match
+                used.add(meal_id)
+                hits[slot] = meal
+        metrics.increment("meals_generated_total", len(hits), outcome="library")
+        return hits
+
+    def _remember_meals(self, meal_plan: Dict, user_profile: Dict) -> None:
+        """Adds every real (non-fallback) meal of the plan to the library."""
+        restrictions = user_profile.get("dietary_restrictions", [])
+        for day_meals in meal_plan.values():
+            for meal_type, meal in day_meals.items():
+                if isinstance(meal, dict) and meal.get("meal_name") not in (None, ERROR_MEAL_NAME):
+                    self.library.add(meal_type, meal, restrictions)
+
+    def _build_meal_prompt(
+        self,
+        meal_type: str,
+        targets: Dict,
+        user_profile: Dict,
+        meals_per_day: int,
+        example_ingredient=("food item", "amount"),
+    ) -> str:
+        """Builds the prompt for a single meal holding an even share of the daily targets."""
+        meal_calories = targets["calories"] / meals_per_day
+        meal_protein = targets["protein"] / meals_per_day
+        meal_fat = targets["fat"] / meals_per_day
+        meal_carbs = targets["carbohydrates"] / meals_per_day
+        example_name, example_quantity = example_ingredient
+
+        return f"""
+    Create a {meal_type} that fits the following criteria:
 
     - Calories: {round(meal_calories)}
     - Protein: {round(meal_protein)}g
@@ -125,7 +303,7 @@ class NutritionCoach:
     {{
         "meal_name": "...",
         "ingredients": [
-            {{"name": "chicken breast", "quantity": "8 oz"}},
+            {{"name": "{example_name}", "quantity": "{example_quantity}"}},
             ...
         ],
         "instructions": "...",
@@ -135,87 +313,342 @@ class NutritionCoach:
         "carbohydrates": ...
     }}
     """
-            prepped_lunch = self._call_anthropic_api(prompt, user_profile)
 
-        for day in range(1, num_days + 1):
-            day_key = f"Day {day}"
-            meal_plan[day_key] = {}
+    def _generate_day_plans(
+        self,
+        user_profile: Dict,
+        targets: Dict,
+        num_days: int,
+        meal_types: List[str],
+        meal_prep: bool,
+        days_per_request: int,
+        max_concurrency: int,
+        library_meals: Dict = None,
+        scale_portions: bool = True,
+        on_meal_field: Callable = None,
+        nonce: str = None,
+    ) -> Dict:
+        """
+        Whole-day generation: each request asks for every meal of up to
+        `days_per_request` days as one JSON object, so the schema and
+        restrictions are sent once per chunk instead of once per meal.
 
-            for meal_num in range(1, meals_per_day + 1):
-                if meal_num == 1:
-                    meal_type = "Breakfast"
-                elif meal_num == 2:
-                    meal_type = "Lunch"
-                else:
-                    meal_type = "Dinner"
+        Each day's meals are then checked against the day's targets, and only
+        the meals that are missing, malformed or pull the totals outside
+        DAY_TOTAL_TOLERANCE are re-requested one by one, aimed at whatever
+        the kept meals left of the day's budget. With `scale_portions`, a day
+        whose meals are all valid but whose totals are off is first rescaled,
+        and only re-requested if rescaling can't bring it within tolerance.
 
-                meal_calories = targets["calories"] / meals_per_day
-                meal_protein = targets["protein"] / meals_per_day
-                meal_fat = targets["fat"] / meals_per_day
-                meal_carbs = targets["carbohydrates"] / meals_per_day
+        Days with any slot in `library_meals` aren't requested as a whole;
+        their remaining slots go through the same per-meal re-requests, which
+        report their fields through `on_meal_field`.
+        """
+        library_meals = library_meals or {}
+        meals_per_day = len(meal_types)
+        day_meal_types = list(meal_types)
+        prompts = {}
 
-                if meal_type == "Lunch" and meal_prep and prepped_lunch:
-                    # Reuse the prepped lunch
+        if meal_prep:
+            if "prepped_lunch" not in library_meals:
+                # Same prompt (and cache slot) as the per-meal path
+                prompts["prepped_lunch"] = self._build_meal_prompt(
+                    "LUNCH", targets, user_profile, meals_per_day,
+                    example_ingredient=("chicken breast", "8 oz"),
+                )
+            day_meal_types.remove("Lunch")
+
+        # The generated meals cover their share of the day; a prepped lunch covers the rest
+        day_targets = {
+            column: targets[column] * len(day_meal_types) / meals_per_day for column in TARGET_COLUMNS
+        }
+
+        days = list(range(1, num_days + 1))
+        requested_days = [
+            day for day in days
+            if not any((day, meal_type) in library_meals for meal_type in day_meal_types)
+        ]
+        for start in range(0, len(requested_days), days_per_request):
+            chunk = requested_days[start:start + days_per_request]
+            prompts[tuple(chunk)] = self._build_day_plan_prompt(chunk, day_meal_types, day_targets, user_profile)
+
+        max_tokens = DAY_PLAN_OUTPUT_TOKENS_PER_MEAL * days_per_request * len(day_meal_types) + 100
+
+        def call(prompt, user_profile, variant=None, nonce=None):
+            if variant == "prepped_lunch":
+                return self._call_anthropic_api(prompt, user_profile, variant, nonce=nonce)
+            return self._call_day_plan_api(prompt, user_profile, variant, max_tokens=max_tokens, nonce=nonce)
+
+        results = self._run_meal_prompts(prompts, user_profile, max_concurrency, call=call, nonce=nonce)
+        prepped_lunch = results.pop("prepped_lunch", library_meals.get("prepped_lunch"))
+        day_plans = {}
+        for plan in results.values():
+            day_plans.update(plan)
+
+        # Validate each day and collect per-meal re-requests for the meals that failed
+        meal_plan = {}
+        retry_prompts = {}
+        accepted = 0
+        for day in days:
+            day_key = f"Day {day}"
+            day_plan = day_plans.get(day_key)
+            if not isinstance(day_plan, dict):
+                day_plan = {}
+            meals = {
+                meal_type: library_meals.get((day, meal_type), day_plan.get(meal_type))
+                for meal_type in day_meal_types
+            }
+            failing = self._failing_meals(meals, day_targets)
+            if failing and scale_portions and all(self._is_valid_meal(meal) for meal in meals.values()):
+                scaled = optimize_day(meals, day_targets)
+                if not self._failing_meals(scaled, day_targets):
+                    meals, failing = scaled, []
+                    metrics.increment("meals_generated_total", len(meals), outcome="rescaled")
+
+            kept = [meals[meal_type] for meal_type in day_meal_types if meal_type not in failing]
+            remaining = {
+                column: max(day_targets[column] - sum(float(meal[column]) for meal in kept), 0)
+                for column in TARGET_COLUMNS
+            }
+            for meal_type in failing:
+                retry_prompts[(day, meal_type)] = self._build_meal_prompt(
+                    meal_type, remaining, user_profile, len(failing)
+                )
+            accepted += sum(
+                1 for meal_type in day_meal_types
+                if meal_type not in failing and (day, meal_type) not in library_meals
+            )
+
+            meal_plan[day_key] = {}
+            for meal_type in meal_types:
+                if meal_type == "Lunch" and prepped_lunch is not None:
                     meal_plan[day_key][meal_type] = prepped_lunch
                 else:
-                    # Generate a fresh meal
-                    prompt = f"""
-    Create a {meal_type} that fits the following criteria:
+                    meal_plan[day_key][meal_type] = meals[meal_type]
 
-    - Calories: {round(meal_calories)}
-    - Protein: {round(meal_protein)}g
-    - Fat: {round(meal_fat)}g
-    - Carbohydrates: {round(meal_carbs)}g
+        metrics.increment("meals_generated_total", accepted, outcome="day_plan")
+        if retry_prompts:
+            metrics.increment("meals_generated_total", len(retry_prompts), outcome="rerequested")
+            retries = self._run_meal_prompts(
+                retry_prompts, user_profile, max_concurrency, on_field=on_meal_field, nonce=nonce
+            )
+            for (day, meal_type), meal in retries.items():
+                meal_plan[f"Day {day}"][meal_type] = meal
+
+        return meal_plan
+
+    def _build_day_plan_prompt(
+        self,
+        days: List[int],
+        meal_types: List[str],
+        day_targets: Dict,
+        user_profile: Dict,
+    ) -> str:
+        """Builds one prompt covering every meal of `days`, with the daily totals stated once."""
+        day_names = ", ".join(f"Day {day}" for day in days)
+
+        return f"""
+    Create meal plans for the following days: {day_names}.
+    Each day has these meals: {', '.join(meal_types)}.
+
+    The meals of each day must add up to these daily totals:
+
+    - Calories: {round(day_targets["calories"])}
+    - Protein: {round(day_targets["protein"])}g
+    - Fat: {round(day_targets["fat"])}g
+    - Carbohydrates: {round(day_targets["carbohydrates"])}g
     - Dietary Restrictions: {', '.join(user_profile["dietary_restrictions"])}
 
-    Provide JSON:
+    Split the totals sensibly across the meals and vary the meals from day to day.
+
+    Provide JSON with one object per day, keyed by day and then by meal:
     {{
-        "meal_name": "...",
-        "ingredients": [
-            {{"name": "food item", "quantity": "amount"}},
+        "Day {days[0]}": {{
+            "{meal_types[0]}": {{
+                "meal_name": "...",
+                "ingredients": [
+                    {{"name": "food item", "quantity": "amount"}},
+                    ...
+                ],
+                "instructions": "...",
+                "calories": ...,
+                "protein": ...,
+                "fat": ...,
+                "carbohydrates": ...
+            }},
             ...
-        ],
-        "instructions": "...",
-        "calories": ...,
-        "protein": ...,
-        "fat": ...,
-        "carbohydrates": ...
+        }},
+        ...
     }}
     """
-                    generated_meal = self._call_anthropic_api(prompt, user_profile)
-                    meal_plan[day_key][meal_type] = generated_meal
 
-        user_data["meals"] = meal_plan
-        return user_data
+    @staticmethod
+    def _is_valid_meal(meal) -> bool:
+        """A named meal with a non-negative number for every macro."""
+        if not isinstance(meal, dict) or not meal.get("meal_name"):
+            return False
+        try:
+            return all(float(meal[column]) >= 0 for column in TARGET_COLUMNS)
+        except (KeyError, TypeError, ValueError):
+            return False
+
+    @staticmethod
+    def _failing_meals(meals: Dict, day_targets: Dict, tolerance: float = DAY_TOTAL_TOLERANCE) -> List[str]:
+        """
+        Meal types that should be re-requested: missing or malformed meals, or,
+        if the day's totals miss a target by more than `tolerance`, the meals
+        that are furthest off their even share of that macro.
+        """
+        invalid = [meal_type for meal_type, meal in meals.items() if not NutritionCoach._is_valid_meal(meal)]
+        if invalid:
+            return invalid
 
-    def _call_anthropic_api(self, prompt: str, user_profile: Dict) -> Dict:
+        def off_by(value, target) -> bool:
+            return abs(value - target) > tolerance * max(target, 1)
+
+        totals = {column: sum(float(meal[column]) for meal in meals.values()) for column in TARGET_COLUMNS}
+        off_columns = [column for column in TARGET_COLUMNS if off_by(totals[column], day_targets[column])]
+        if not off_columns:
+            return []
+
+        share = 1 / len(meals)
+        failing = [
+            meal_type for meal_type, meal in meals.items()
+            if any(off_by(float(meal[column]), day_targets[column] * share) for column in off_columns)
+        ]
+        if failing:
+            return failing
+        # Every meal is individually close but the errors add up; replace the worst one
+        return [max(
+            meals,
+            key=lambda meal_type: sum(
+                abs(float(meals[meal_type][column]) - day_targets[column] * share) / max(day_targets[column], 1)
+                for column in off_columns
+            ),
+        )]
+
+    def _run_meal_prompts(
+        self, prompts: Dict, user_profile: Dict, max_concurrency: int, call=None, on_field: Callable = None,
+        nonce: str = None,
+    ) -> Dict:
+        """
+        Sends each prompt through `call` (default `_call_anthropic_api`) and
+        returns the results under the same keys. Runs on a bounded thread pool
+        when max_concurrency > 1. `on_field(slot, key, value)` is passed on
+        to `call` bound to each prompt's slot label, `nonce` as is.
+        """
+        call = call or self._call_anthropic_api
+
+        def run(key, prompt):
+            slot = self._slot_name(key)
+            if on_field is None:
+                return call(prompt, user_profile, variant=slot, nonce=nonce)
+            return call(
+                prompt, user_profile, variant=slot, nonce=nonce,
+                on_field=lambda field, value: on_field(slot, field, value),
+            )
+
+        if max_concurrency <= 1 or len(prompts) <= 1:
+            return {key: run(key, prompt) for key, prompt in prompts.items()}
+
+        # Worker threads need the script context so st.error still renders
+        ctx = get_script_run_ctx()
+
+        def attach_script_ctx():
+            if ctx is not None:
+                add_script_run_ctx(threading.current_thread(), ctx)
+
+        with ThreadPoolExecutor(
+            max_workers=min(max_concurrency, len(prompts)),
+            initializer=attach_script_ctx,
+        ) as executor:
+            futures = {key: executor.submit(run, key, prompt) for key, prompt in prompts.items()}
+            return {key: future.result() for key, future in futures.items()}
+
+    @staticmethod
+    def _slot_name(key) -> str:
+        """
+        Turns a prompt key into a stable label: (day, meal type) becomes
+        'Day 2/Dinner' and a tuple of day numbers becomes 'Days 1-3'.
+        """
+        if isinstance(key, str):
+            return key
+        if all(isinstance(part, int) for part in key):
+            return f"Days {key[0]}-{key[-1]}"
+        day, meal_type = key
+        return f"Day {day}/{meal_type}"
+
+    def _meal_cache_key(self, prompt: str, request: Dict, variant: str = None, nonce: str = None) -> str:
+        # Keys without a nonce stay as they were, so existing cache entries still match
+        extra = {"nonce": nonce} if nonce is not None else {}
+        return self.cache.make_key(prompt=prompt, variant=variant, **extra, **request)
+
+    @metrics.timed("nutrition_coach_call_seconds", method="_call_anthropic_api")
+    def _call_anthropic_api(
+        self, prompt: str, user_profile: Dict, variant: str = None, on_field: Callable = None, nonce: str = None
+    ) -> Dict:
         """
         Helper function to call the Anthropic API and parse JSON output.
+        `variant` is folded into the cache key so distinct plan slots sharing
+        a prompt don't all collapse onto the same cached meal, and so is
+        `nonce` (see generate_meal_plan).
+
+        The reply is streamed into a JSONObjectStream, which calls
+        `on_field(key, value)` as each field of the meal completes (meal_name
+        first) and recovers the meal even when the model wraps it in prose.
         """
+        request = {
+            "model": "claude-2.0",
+            "max_tokens": 1000,
+            "temperature": 0.7,
+            "system": "You are an expert nutritionist ...",
+        }
+        cache_key = self._meal_cache_key(prompt, request, variant, nonce)
+        cached_meal = self.cache.get(cache_key)
+        if cached_meal is not None:
+            metrics.increment("meals_generated_total", outcome="cached")
+            if on_field is not None:
+                for key, value in cached_meal.items():
+                    on_field(key, value)
+            return cached_meal
+
+        messages = [{"role": "user", "content": prompt}]
+        attempt = {}
+
+        def stream_meal(timeout):
+            # Each attempt (including scheduler retries) parses from scratch
+            attempt["parser"] = parser = JSONObjectStream()
+            with self.client.messages.stream(timeout=timeout, messages=messages, **request) as stream:
+                for text in stream.text_stream:
+                    for key, value in parser.feed(text):
+                        if on_field is not None:
+                            on_field(key, value)
+                return stream.get_final_message()
+
         try:
-            message = self.client.messages.create(
-                model="claude-2.0",
-                max_tokens=1000,
-                temperature=0.7,
-                system="You are an expert nutritionist ...",
-                messages=[{"role": "user", "content": prompt}],
+            message = self.scheduler.call(
+                stream_meal,
+                kind="_call_anthropic_api",
+                tokens=self._estimate_request_tokens(dict(request, messages=messages)),
             )
+            metrics.record_usage("_call_anthropic_api", message)
 
-            # Extract text
-            if isinstance(message.content, list):
-                content = message.content[0].text
-            else:
-                content = message.content
-
-            # Attempt JSON parse
-            meal_data = json.loads(content)
+            meal_data = attempt["parser"].value
+            if meal_data is None:
+                raise json.JSONDecodeError("No JSON object found in reply", attempt["parser"].text, 0)
+            if meal_data.get("meal_name") != ERROR_MEAL_NAME:
+                self.cache.set(cache_key, meal_data)
+            metrics.increment("meals_generated_total", outcome="ok")
             return meal_data
 
         except Exception as e:
             st.error(f"Error generating meal: {e}")
-            # Return a fallback meal
+            if isinstance(e, json.JSONDecodeError):
+                metrics.increment("json_parse_failures_total", method="_call_anthropic_api")
+            metrics.increment("meals_generated_total", outcome="fallback")
+            # Return a fallback meal (never cached)
             return {
-                "meal_name": "Error Meal",
+                "meal_name": ERROR_MEAL_NAME,
                 "ingredients": [],
                 "instructions": "Error",
                 "calories": 0,
@@ -224,7 +657,50 @@ class NutritionCoach:
                 "carbohydrates": 0,
             }
 
+    @metrics.timed("nutrition_coach_call_seconds", method="_call_day_plan_api")
+    def _call_day_plan_api(
+        self, prompt: str, user_profile: Dict, variant: str = None, max_tokens: int = 1000, nonce: str = None
+    ) -> Dict:
+        """
+        Whole-day counterpart of `_call_anthropic_api`. Returns
+        {"Day N": {meal type: meal}}, or {} on failure so every meal of the
+        chunk gets re-requested individually.
+        """
+        request = {
+            "model": "claude-2.0",
+            "max_tokens": max_tokens,
+            "temperature": 0.7,
+            "system": "You are an expert nutritionist ...",
+        }
+        cache_key = self._meal_cache_key(prompt, request, variant, nonce)
+        cached_plan = self.cache.get(cache_key)
+        if cached_plan is not None:
+            return cached_plan
+
+        try:
+            message = self._create_message(
+                "_call_day_plan_api",
+                messages=[{"role": "user", "content": prompt}],
+                **request,
+            )
+            metrics.record_usage("_call_day_plan_api", message)
+
+            if isinstance(message.content, list):
+                content = message.content[0].text
+            else:
+                content = message.content
+
+            day_plans = loads_object(content)
+            self.cache.set(cache_key, day_plans)
+            return day_plans
+
+        except Exception as e:
+            st.error(f"Error generating meal plan days ({variant}): {e}")
+            if isinstance(e, json.JSONDecodeError):
+                metrics.increment("json_parse_failures_total", method="_call_day_plan_api")
+            return {}
 
+    @metrics.timed("nutrition_coach_call_seconds", method="analyze_food_entry")
     def analyze_food_entry(self, user_data: Dict, food_entry: str) -> Dict:
             """
             Analyzes a user's food entry using the Anthropic API.
@@ -232,11 +708,7 @@ class NutritionCoach:
             or provide suggestions for healthier alternatives.
             """
 
-            system_prompt = (
-                "You are a highly skilled nutritionist. The user will provide a description "
-                "of a food item or meal they consumed. Analyze the meal with respect to "
-                "its nutritional content, healthiness, and alignment with the user's goals."
-            )
+            system_prompt = ANALYSIS_SYSTEM_PROMPT
 
             user_profile = user_data.get("profile", {})
             user_goal = user_profile.get("goal", "Maintenance")
@@ -250,56 +722,172 @@ class NutritionCoach:
     - "recommendations": Suggestions on how to modify or improve the meal
             """
 
+            request = {
+                "model": "claude-2.0",  # Or whichever Anthropic model you have
+                "max_tokens": 500,
+                "temperature": 0.7,
+                "system": system_prompt,
+            }
+            cache_key = self.cache.make_key(prompt=prompt, **request)
+            cached_analysis = self.cache.get(cache_key)
+            if cached_analysis is not None:
+                return cached_analysis
+
             try:
-                message = self.client.messages.create(
-                    model="claude-2.0",  # Or whichever Anthropic model you have
-                    max_tokens=500,
-                    temperature=0.7,
-                    system=system_prompt,
+                message = self._create_message(
+                    "analyze_food_entry",
+                    priority=PRIORITY_INTERACTIVE,
+                    hedge=True,
                     messages=[
                         {"role": "user", "content": prompt}
-                    ]
+                    ],
+                    **request,
                 )
+                metrics.record_usage("analyze_food_entry", message)
 
                 if isinstance(message.content, list):
                     content = message.content[0].text
                 else:
                     content = message.content
 
-                return json.loads(content)
+                analysis = loads_object(content)
+                self.cache.set(cache_key, analysis)
+                return analysis
 
             except Exception as e:
                 st.error(f"An error occurred while analyzing the food entry: {e}")
+                if isinstance(e, json.JSONDecodeError):
+                    metrics.increment("json_parse_failures_total", method="analyze_food_entry")
                 return {
                     "analysis": "Error occurred.",
                     "recommendations": []
                 }
 
-    def get_ai_coach_response(self, user_data: Dict, user_message: str) -> str:
+    @metrics.timed("nutrition_coach_call_seconds", method="analyze_food_entries")
+    def analyze_food_entries(
+        self,
+        user_data: Dict,
+        indices: List[int],
+        token_budget: int = ANALYSIS_TOKEN_BUDGET,
+    ) -> Dict[int, Dict]:
         """
-        Gets a response from the AI coach based on user data and a message.
-        We pass some user info and goals to contextualize the response.
+        Analyzes several food log entries with as few API calls as possible.
+
+        Entries are packed into one structured prompt per chunk, where each
+        chunk's estimated prompt plus reply stays under `token_budget`. Returns
+        {log index: {"analysis": ..., "recommendations": [...]}}; entries the
+        model skipped or that failed get the same fallback as analyze_food_entry.
         """
+        food_log = user_data.get("food_log", [])
+        user_goal = user_data.get("profile", {}).get("goal", "Maintenance")
 
-        system_prompt = (
-            "You are a helpful AI nutrition coach. You have access to the user's profile data: "
-            f"{json.dumps(user_data.get('profile', {}), indent=2)} "
-            "Be informative, motivational, and accurate in your responses."
+        header = f"""
+    Analyze each of the following meal/food entries in the context of a user whose goal is '{user_goal}'.
+    Each entry is prefixed with its id.
+
+"""
+        footer = """
+    Respond with a single JSON object mapping each id (as a string) to an object with:
+    - "analysis": A brief analysis of whether this is healthy or not and how it fits the user's goal
+    - "recommendations": Suggestions on how to modify or improve the meal
+    """
+        base_tokens = estimate_tokens(header + footer)
+
+        # Greedily pack entry lines into chunks under the budget
+        chunks = []
+        chunk, chunk_tokens = [], base_tokens
+        for index in indices:
+            line = self._format_log_entry(index, food_log[index])
+            line_tokens = estimate_tokens(line) + ANALYSIS_OUTPUT_TOKENS_PER_ENTRY
+            if chunk and chunk_tokens + line_tokens > token_budget:
+                chunks.append(chunk)
+                chunk, chunk_tokens = [], base_tokens
+            chunk.append((index, line))
+            chunk_tokens += line_tokens
+        if chunk:
+            chunks.append(chunk)
+
+        results = {}
+        for chunk in chunks:
+            prompt = header + "\n".join(line for _, line in chunk) + "\n" + footer
+            request = {
+                "model": "claude-2.0",
+                "max_tokens": ANALYSIS_OUTPUT_TOKENS_PER_ENTRY * len(chunk) + 100,
+                "temperature": 0.7,
+                "system": ANALYSIS_SYSTEM_PROMPT,
+            }
+            cache_key = self.cache.make_key(prompt=prompt, **request)
+            analyses = self.cache.get(cache_key)
+
+            if analyses is None:
+                try:
+                    message = self._create_message(
+                        "analyze_food_entries",
+                        priority=PRIORITY_INTERACTIVE,
+                        messages=[{"role": "user", "content": prompt}],
+                        **request,
+                    )
+                    metrics.record_usage("analyze_food_entries", message)
+
+                    if isinstance(message.content, list):
+                        content = message.content[0].text
+                    else:
+                        content = message.content
+
+                    analyses = loads_object(content)
+                    self.cache.set(cache_key, analyses)
+
+                except Exception as e:
+                    st.error(f"An error occurred while analyzing food entries: {e}")
+                    if isinstance(e, json.JSONDecodeError):
+                        metrics.increment("json_parse_failures_total", method="analyze_food_entries")
+                    analyses = {}
+
+            for index, _ in chunk:
+                results[index] = analyses.get(str(index)) or {
+                    "analysis": "Error occurred.",
+                    "recommendations": []
+                }
+
+        return results
+
+    @staticmethod
+    def _format_log_entry(index: int, entry: Dict) -> str:
+        return (
+            f'    {index}: "{entry.get("food_item", "")}" '
+            f'(quantity {entry.get("quantity", 1)}, {entry.get("calories", 0)} kcal, '
+            f'{entry.get("protein", 0)}g protein, {entry.get("fat", 0)}g fat, '
+            f'{entry.get("carbs", 0)}g carbs)'
         )
 
+    @metrics.timed("nutrition_coach_call_seconds", method="get_ai_coach_response")
+    def get_ai_coach_response(
+        self,
+        user_data: Dict,
+        user_message: str,
+        token_budget: int = DEFAULT_CONTEXT_TOKEN_BUDGET,
+    ) -> str:
+        """
+        Gets a response from the AI coach based on user data and a message.
+        We pass some user info and goals to contextualize the response, along
+        with the conversation summary and as many recent turns as fit in
+        `token_budget`.
+        """
+
+        system_prompt, messages = self._coach_context(user_data, user_message, token_budget)
+
         try:
-            message = self.client.messages.create(
+            message = self._create_message(
+                "get_ai_coach_response",
+                priority=PRIORITY_INTERACTIVE,
+                hedge=True,
                 model="claude-2.0",
                 max_tokens=500,
                 temperature=0.7,
                 system=system_prompt,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": user_message
-                    }
-                ]
+                messages=messages,
             )
+            metrics.record_usage("get_ai_coach_response", message)
 
             if isinstance(message.content, list):
                 content = message.content[0].text
@@ -310,4 +898,151 @@ class NutritionCoach:
 
         except Exception as e:
             st.error(f"An error occurred while getting AI coach response: {e}")
-            return "Sorry, I encountered an error while processing your request."
\ No newline at end of file
+            return COACH_ERROR_RESPONSE
+
+    def stream_ai_coach_response(
+        self,
+        user_data: Dict,
+        user_message: str,
+        token_budget: int = DEFAULT_CONTEXT_TOKEN_BUDGET,
+    ) -> Iterator[str]:
+        """
+        Streaming variant of get_ai_coach_response that yields text deltas as
+        they arrive. Once the generator is exhausted, `self.last_response_timing`
+        holds the time to first token and total time in seconds.
+        """
+        system_prompt, messages = self._coach_context(user_data, user_message, token_budget)
+
+        request = {
+            "model": "claude-2.0",
+            "max_tokens": 500,
+            "temperature": 0.7,
+            "system": system_prompt,
+            "messages": messages,
+        }
+        deadline_at = time.monotonic() + DEADLINE_SECONDS[PRIORITY_INTERACTIVE]
+
+        started_at = time.perf_counter()
+        first_token_at = None
+        try:
+            for attempt in itertools.count():
+                self.scheduler.acquire(
+                    PRIORITY_INTERACTIVE, self._estimate_request_tokens(request), deadline_at, "stream_ai_coach_response"
+                )
+                try:
+                    with self.client.messages.stream(
+                        timeout=max(0.1, deadline_at - time.monotonic()), **request
+                    ) as stream:
+                        for text in stream.text_stream:
+                            if first_token_at is None:
+                                first_token_at = time.perf_counter()
+                            yield text
+                        if metrics.ENABLED:
+                            metrics.record_usage("stream_ai_coach_response", stream.get_final_message())
+                    break
+                except Exception as e:
+                    # Text already shown can't be taken back, so only retry before the first token
+                    if first_token_at is not None:
+                        raise
+                    delay = self.scheduler.retry_delay(e, attempt, deadline_at, "stream_ai_coach_response")
+                    if delay is None:
+                        raise
+                    time.sleep(delay)
+
+        except Exception as e:
+            st.error(f"An error occurred while getting AI coach response: {e}")
+            if first_token_at is None:
+                yield COACH_ERROR_RESPONSE
+
+        finally:
+            finished_at = time.perf_counter()
+            self.last_response_timing = {
+                "time_to_first_token": (
+                    round(first_token_at - started_at, 3) if first_token_at is not None else None
+                ),
+                "total_time": round(finished_at - started_at, 3),
+            }
+            metrics.observe(
+                "nutrition_coach_call_seconds", finished_at - started_at, method="stream_ai_coach_response"
+            )
+            if first_token_at is not None:
+                metrics.observe("coach_time_to_first_token_seconds", first_token_at - started_at)
+
+    @metrics.timed("nutrition_coach_call_seconds", method="summarize_conversation")
+    def summarize_conversation(self, previous_summary: str, messages: List[Dict]) -> str:
+        """
+        Folds `messages` into the rolling conversation summary. On failure the
+        previous summary is kept; the messages themselves are still archived.
+        """
+        transcript = "\n".join(
+            f"{'User' if msg['role'] == 'user' else 'Coach'}: {msg['content']}" for msg in messages
+        )
+        prompt = f"""
+    Current summary of your conversation with this user:
+    {previous_summary or "(none yet)"}
+
+    Newer messages:
+    {transcript}
+
+    Rewrite the summary so it also covers the newer messages. Keep the facts a
+    coach should remember (goals, preferences, struggles, advice already given)
+    and stay under {SUMMARY_MAX_TOKENS * 3 // 4} words. Reply with the summary only.
+    """
+
+        try:
+            message = self._create_message(
+                "summarize_conversation",
+                model="claude-2.0",
+                max_tokens=SUMMARY_MAX_TOKENS,
+                temperature=0.3,
+                system="You keep concise memory notes for a nutrition coach.",
+                messages=[{"role": "user", "content": prompt}],
+            )
+            metrics.record_usage("summarize_conversation", message)
+
+            if isinstance(message.content, list):
+                return message.content[0].text.strip()
+            return message.content.strip()
+
+        except Exception as e:
+            st.error(f"An error occurred while summarizing the conversation: {e}")
+            return previous_summary
+
+    def _create_message(self, kind: str, priority: int = PRIORITY_BULK, hedge: bool = False, **request):
+        """
+        messages.create through the shared scheduler: waits for rate limit
+        capacity (ahead of lower-priority calls), retries transient failures
+        and gives up at the priority's deadline by raising the last error.
+        """
+        return self.scheduler.call(
+            lambda timeout: self.client.messages.create(timeout=timeout, **request),
+            kind=kind,
+            priority=priority,
+            tokens=self._estimate_request_tokens(request),
+            hedge=hedge,
+        )
+
+    @staticmethod
+    def _estimate_request_tokens(request: Dict) -> int:
+        """Prompt estimate plus the full reply allowance, as reserved against the token budget."""
+        prompt = request.get("system", "") + "".join(str(message["content"]) for message in request["messages"])
+        return estimate_tokens(prompt) + request["max_tokens"]
+
+    def _coach_context(self, user_data: Dict, user_message: str, token_budget: int):
+        """System prompt plus as many recent turns as fit in the remaining budget."""
+        system_prompt = self._coach_system_prompt(user_data)
+        messages = build_coach_messages(
+            user_data, user_message, token_budget - estimate_tokens(system_prompt)
+        )
+        return system_prompt, messages
+
+    def _coach_system_prompt(self, user_data: Dict) -> str:
+        system_prompt = (
+            "You are a helpful AI nutrition coach. You have access to the user's profile data: "
+            f"{json.dumps(user_data.get('profile', {}))} "
+            "Be informative, motivational, and accurate in your responses."
+        )
+        summary = conversation_summary(user_data)
+        if summary:
+            system_prompt += f" Summary of your earlier conversation with this user: {summary}"
+        return system_prompt
@@ -0,0 +1,169 @@
+# nutrition_targets.py
+from typing import Dict
+
+ACTIVITY_MULTIPLIERS = {
+    "Sedentary": 1.2,
+    "Lightly Active": 1.375,
+    "Moderately Active": 1.55,
+    "Very Active": 1.725,
+    "Extremely Active": 1.9,
+}
+
+# 1 lb of body weight ≈ 3500 calories. So 1 lb/week ~ -500 cals/day, 0.5 lb/week ~ -250 cals/day, etc.
+PROGRESS_CALORIE_DELTAS = {
+    "Lose 1 lb/week (recommended)": -500,
+    "Lose 0.5 lb/week": -250,
+    "Maintenance": 0,
+    "Gain 0.5 lb/week": 250,
+    "Gain 1 lb/week (recommended)": 500,
+}
+
+# Values used when a profile field is missing, matching the scalar .get() defaults
+PROFILE_DEFAULTS = {
+    "weight": 0,
+    "height": 0,
+    "age": 0,
+    "biological_sex": "Male",
+    "activity_level": "Sedentary",
+    "rate_of_progress": "Maintenance",
+    "protein_target": 0.8,
+    "lean_body_mass": 0,
+}
+
+TARGET_COLUMNS = ["calories", "protein", "fat", "carbohydrates"]
+
+
+def compute_targets(user_profile: Dict) -> Dict:
+    """Calculates calorie and macro targets for a single profile."""
+    # 1. Basic BMR/TDEE logic
+    weight_kg = user_profile.get("weight", 0) * 0.453592
+    height_cm = user_profile.get("height", 0) * 2.54
+    age = user_profile.get("age", 0)
+    sex = user_profile.get("biological_sex", "Male")
+
+    if sex == "Male":
+        bmr = (10 * weight_kg) + (6.25 * height_cm) - (5 * age) + 5
+    else:  # Female
+        bmr = (10 * weight_kg) + (6.25 * height_cm) - (5 * age) - 161
+
+    activity_level = user_profile.get("activity_level", "Sedentary")
+    tdee = bmr * ACTIVITY_MULTIPLIERS.get(activity_level, 1.2)
+
+    # 2. Rate of Progress => Calorie adjustment
+    rate_of_progress = user_profile.get("rate_of_progress", "Maintenance")
+    daily_calorie_delta = PROGRESS_CALORIE_DELTAS.get(rate_of_progress, 0)
+
+    # Final calorie target
+    calorie_target = tdee + daily_calorie_delta
+
+    # 3. Calculate macros
+    # Protein
+    if user_profile.get("lean_body_mass", 0) == 0:
+        # If no LBM given, use total weight for the protein calculation
+        protein_target = user_profile.get("protein_target", 0.8) * user_profile.get("weight", 0)
+    else:
+        protein_target = user_profile.get("protein_target", 0.8) * user_profile.get("lean_body_mass", 0)
+
+    # Fat: a minimum of 20% of cals, or whatever is left after protein and half of TDEE
+    fat_min = 0.2 * calorie_target / 9
+    fat_target = max(fat_min, calorie_target - (protein_target * 4) - (tdee * 0.5)) / 9
+
+    # Carbs: leftover
+    carb_target = (calorie_target - (protein_target * 4) - (fat_target * 9)) / 4
+
+    # 4. Round and clamp at 0
+    return {
+        "calories": max(round(calorie_target), 0),
+        "protein": max(round(protein_target), 0),
+        "fat": max(round(fat_target), 0),
+        "carbohydrates": max(round(carb_target), 0),
+    }
+
+
+def compute_targets_batch(profiles) -> "pd.DataFrame":
+    """
+    Vectorized compute_targets over many profiles.
+
+    `profiles` is a DataFrame (or a dict of equal-length arrays) with the
+    profile fields as columns; missing columns and NaNs take the same
+    defaults as the scalar version. Returns a DataFrame with the four target
+    columns, aligned to the input index. Every step mirrors compute_targets
+    operation for operation so results are identical, including numpy's
+    round-half-to-even matching Python's round().
+    """
+    # Imported here so the scalar path used by the profile page doesn't load numpy/pandas
+    import numpy as np
+    import pandas as pd
+
+    if not isinstance(profiles, pd.DataFrame):
+        profiles = pd.DataFrame(profiles)
+
+    def column(name):
+        if name in profiles:
+            return profiles[name].fillna(PROFILE_DEFAULTS[name])
+        return pd.Series(PROFILE_DEFAULTS[name], index=profiles.index)
+
+    weight = column("weight").to_numpy(dtype=np.float64)
+    height = column("height").to_numpy(dtype=np.float64)
+    age = column("age").to_numpy(dtype=np.float64)
+    is_male = (column("biological_sex") == "Male").to_numpy()
+    activity = column("activity_level").map(ACTIVITY_MULTIPLIERS).fillna(1.2).to_numpy(dtype=np.float64)
+    delta = column("rate_of_progress").map(PROGRESS_CALORIE_DELTAS).fillna(0).to_numpy(dtype=np.float64)
+    protein_per_lb = column("protein_target").to_numpy(dtype=np.float64)
+    lean_body_mass = column("lean_body_mass").to_numpy(dtype=np.float64)
+
+    weight_kg = weight * 0.453592
+    height_cm = height * 2.54
+    base = (10 * weight_kg) + (6.25 * height_cm) - (5 * age)
+    bmr = np.where(is_male, base + 5, base - 161)
+    tdee = bmr * activity
+
+    calorie_target = tdee + delta
+
+    protein_target = protein_per_lb * np.where(lean_body_mass == 0, weight, lean_body_mass)
+
+    fat_min = 0.2 * calorie_target / 9
+    fat_target = np.maximum(fat_min, calorie_target - (protein_target * 4) - (tdee * 0.5)) / 9
+
+    carb_target = (calorie_target - (protein_target * 4) - (fat_target * 9)) / 4
+
+    def round_and_clamp(values):
+        return np.maximum(np.round(values), 0).astype(np.int64)
+
+    return pd.DataFrame(
+        {
+            "calories": round_and_clamp(calorie_target),
+            "protein": round_and_clamp(protein_target),
+            "fat": round_and_clamp(fat_target),
+            "carbohydrates": round_and_clamp(carb_target),
+        },
+        index=profiles.index,
+    )
+
+
+def recompute_all_targets(users: Dict) -> Dict:
+    """Refreshes `targets` for every user with a profile, in one vectorized pass."""
+    import pandas as pd
+
+    user_ids = [user_id for user_id, data in users.items() if data.get("profile")]
+    if not user_ids:
+        return users
+
+    profiles = pd.DataFrame.from_records(
+        [users[user_id]["profile"] for user_id in user_ids], index=user_ids
+    )
+    targets = compute_targets_batch(profiles)
+    for user_id, row in zip(user_ids, targets.itertuples(index=False)):
+        users[user_id]["targets"] = {
+            column: int(value) for column, value in zip(TARGET_COLUMNS, row)
+        }
+    return users
+
+
+if __name__ == "__main__":
+    # Nightly job: recompute targets for every account
+    from utils import load_user_data, save_user_data
+
+    users = recompute_all_targets(load_user_data())
+    save_user_data(users)
+    print(f"Recomputed targets for {len(users)} user(s)")
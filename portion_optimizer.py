@@ -0,0 +1,157 @@
+# portion_optimizer.py
+import re
+from fractions import Fraction
+from typing import Dict, Iterable, Optional, Tuple
+
+MACRO_FIELDS = ("calories", "protein", "fat", "carbohydrates")
+
+# Smallest and largest portion multiplier the optimizer may pick for a meal
+DEFAULT_PORTION_BOUNDS = (0.5, 2.0)
+
+# Leading amount of an ingredient quantity: "1 1/2 cups", "3/4 cup", "8 oz", "0.5 lb"
+_AMOUNT_RE = re.compile(r"^\s*(\d+\s+\d+/\d+|\d+/\d+|\d*\.\d+|\d+)(.*)$", re.S)
+
+
+def portion_multipliers(
+    meals: Dict[str, Dict],
+    targets: Dict,
+    bounds: Tuple[float, float] = DEFAULT_PORTION_BOUNDS,
+) -> Dict[str, float]:
+    """
+    Portion multiplier per meal so the day's scaled totals best match `targets`.
+
+    Solves min ||A x - 1||^2 subject to bounds[0] <= x <= bounds[1], where
+    A[i, j] is meal j's amount of macro i divided by the day's target for
+    that macro, so every macro's error counts relative to its own target.
+    Meals are scaled as a whole: their macros are all the model reports.
+    Meals whose macros aren't numbers (see `macro_value`) are left out of
+    the fit and keep a multiplier of 1.
+    """
+    # Imported here so pages that never scale portions don't load numpy/scipy
+    import numpy as np
+    from scipy.optimize import lsq_linear
+
+    multipliers = {meal_type: 1.0 for meal_type in meals}
+    meal_types = [meal_type for meal_type, meal in meals.items() if _macros(meal) is not None]
+    if not meal_types:
+        return multipliers
+
+    fields = [field for field in MACRO_FIELDS if targets.get(field, 0) > 0]
+    matrix = np.array(
+        [[_macros(meals[meal_type])[field] / targets[field] for meal_type in meal_types] for field in fields]
+    )
+    if matrix.size == 0 or not matrix.any():
+        return multipliers
+
+    solution = lsq_linear(matrix, np.ones(len(fields)), bounds=bounds, method="bvls")
+    multipliers.update({meal_type: round(float(x), 2) for meal_type, x in zip(meal_types, solution.x)})
+    return multipliers
+
+
+def macro_value(value) -> Optional[float]:
+    """A macro as a number: 800, "800" and "800 kcal" all give 800.0; None if it isn't one."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value) if value >= 0 else None
+    parsed = _parse_amount(str(value))
+    return parsed[0] if parsed else None
+
+
+def _macros(meal) -> Optional[Dict[str, float]]:
+    # Every macro of a meal as a number, or None if any is missing or unparseable
+    if not isinstance(meal, dict):
+        return None
+    values = {field: macro_value(meal.get(field)) for field in MACRO_FIELDS}
+    return None if None in values.values() else values
+
+
+def scale_meal(meal: Dict, multiplier: float) -> Dict:
+    """Copy of `meal` with macros and parseable ingredient quantities scaled by `multiplier`."""
+    if multiplier == 1:
+        return meal
+    scaled = dict(meal)
+    for field in MACRO_FIELDS:
+        value = meal.get(field)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            scaled[field] = round(value * multiplier)
+        elif isinstance(value, str):
+            scaled[field] = scale_quantity(value, multiplier)
+    scaled["ingredients"] = [_scale_ingredient(ingredient, multiplier) for ingredient in meal.get("ingredients", [])]
+    scaled["portion_multiplier"] = round(meal.get("portion_multiplier", 1) * multiplier, 2)
+    return scaled
+
+
+def _scale_ingredient(ingredient, multiplier: float):
+    # Older plans store ingredients as plain strings ("1 cup cooked rice")
+    if isinstance(ingredient, str):
+        return scale_quantity(ingredient, multiplier)
+    return dict(ingredient, quantity=scale_quantity(ingredient.get("quantity", ""), multiplier))
+
+
+def scale_quantity(quantity: str, multiplier: float) -> str:
+    """Scales the leading amount of a quantity string; anything unparseable is left as is."""
+    parsed = _parse_amount(str(quantity))
+    if not parsed:
+        return quantity
+    amount, rest = parsed
+    return _format_amount(amount * multiplier) + rest
+
+
+def _parse_amount(text: str) -> Optional[Tuple[float, str]]:
+    # Leading amount of a string and the rest of it: "1 1/2 cups" -> (1.5, " cups")
+    match = _AMOUNT_RE.match(text)
+    if not match:
+        return None
+    amount, rest = match.groups()
+    try:
+        return float(sum(Fraction(part) for part in amount.split())), rest
+    except ZeroDivisionError:  # "1/0"
+        return None
+
+
+def _format_amount(value: float) -> str:
+    if value >= 10:
+        return str(round(value))
+    # Quarter steps read naturally for cups, tbsp, oz and the like
+    quarters = round(value * 4) / 4 or round(value, 2)
+    return f"{quarters:g}"
+
+
+def optimize_day(
+    meals: Dict[str, Dict],
+    targets: Dict,
+    bounds: Tuple[float, float] = DEFAULT_PORTION_BOUNDS,
+) -> Dict[str, Dict]:
+    """A day's meals ({meal type: meal}) rescaled to best hit `targets`."""
+    multipliers = portion_multipliers(meals, targets, bounds)
+    return {meal_type: scale_meal(meal, multipliers[meal_type]) for meal_type, meal in meals.items()}
+
+
+def optimize_meal_plan(
+    meal_plan: Dict[str, Dict],
+    targets: Dict,
+    meal_types: Iterable[str],
+    skip_meal_names: Iterable[str] = (),
+    bounds: Tuple[float, float] = DEFAULT_PORTION_BOUNDS,
+) -> Dict[str, Dict]:
+    """
+    A {"Day N": {meal type: meal}} plan with every complete day rescaled
+    against the daily `targets`. A day is complete when it has a meal for
+    each of `meal_types`, all with numeric macros and none named in
+    `skip_meal_names` (placeholders for failed meals). Other days, such as
+    those still being generated, are left as they are: fitting part of a
+    day to a whole day's targets would blow up the meals it has.
+    """
+    meal_types, skip_meal_names = list(meal_types), set(skip_meal_names)
+
+    def is_complete(meals) -> bool:
+        return isinstance(meals, dict) and all(
+            _macros(meals.get(meal_type)) is not None and meals[meal_type].get("meal_name") not in skip_meal_names
+            for meal_type in meal_types
+        )
+
+    return {
+        day: optimize_day(meals, targets, bounds) if is_complete(meals) else meals
+        for day, meals in meal_plan.items()
+    }
@@ -0,0 +1,99 @@
+# rollups.py
+from datetime import date, timedelta
+from typing import Dict
+
+# Macros summed per day; the food log uses "carbs" where targets use "carbohydrates"
+ROLLUP_FIELDS = ("calories", "protein", "fat", "carbs")
+
+
+def ensure_daily_totals(user_data: Dict) -> Dict:
+    """
+    Returns the user's per-day rollup, folding in any food log entries that
+    aren't indexed yet.
+
+    The rollup lives at user_data["daily_totals"] as
+    {"entries_indexed": n, "days": {"YYYY-MM-DD": {calories, protein, fat, carbs, entries}}}.
+    `entries_indexed` is a watermark into food_log, so an append costs one
+    fold and a reload only folds entries added since the rollup was saved.
+    If the log has shrunk (entries removed or rewritten), it is rebuilt.
+    """
+    food_log = user_data.get("food_log", [])
+    rollup = user_data.get("daily_totals")
+    if rollup is None or rollup.get("entries_indexed", 0) > len(food_log):
+        rollup = {"entries_indexed": 0, "days": {}}
+        user_data["daily_totals"] = rollup
+
+    for entry in food_log[rollup["entries_indexed"]:]:
+        _fold_entry(rollup["days"], entry)
+    rollup["entries_indexed"] = len(food_log)
+    return rollup
+
+
+def _fold_entry(days: Dict, entry: Dict) -> None:
+    timestamp = entry.get("timestamp")
+    if not timestamp:
+        return
+    # ISO timestamps start with the date, so no parsing is needed
+    day = days.setdefault(timestamp[:10], _empty_day())
+    for field in ROLLUP_FIELDS:
+        day[field] += entry.get(field, 0) or 0
+    day["entries"] += 1
+
+
+def _empty_day() -> Dict:
+    totals = {field: 0 for field in ROLLUP_FIELDS}
+    totals["entries"] = 0
+    return totals
+
+
+def day_totals(rollup: Dict, day: date) -> Dict:
+    """Totals for a single day (zeros if nothing was logged)."""
+    return rollup["days"].get(day.isoformat(), _empty_day())
+
+
+def rolling_average(rollup: Dict, end_day: date, num_days: int) -> Dict:
+    """
+    Average daily intake over the `num_days` ending at `end_day`, counting
+    only days with at least one entry. Also reports how many days were logged.
+    """
+    totals = {field: 0 for field in ROLLUP_FIELDS}
+    days_logged = 0
+    for offset in range(num_days):
+        day = rollup["days"].get((end_day - timedelta(days=offset)).isoformat())
+        if not day:
+            continue
+        days_logged += 1
+        for field in ROLLUP_FIELDS:
+            totals[field] += day[field]
+
+    averages = {
+        field: (totals[field] / days_logged if days_logged else 0) for field in ROLLUP_FIELDS
+    }
+    averages["days_logged"] = days_logged
+    return averages
+
+
+def adherence_streak(
+    rollup: Dict, targets: Dict, end_day: date, tolerance: float = 0.1
+) -> int:
+    """
+    Number of consecutive days ending at `end_day` whose calories landed
+    within `tolerance` of the calorie target. If `end_day` has nothing
+    logged yet, the streak is counted from the day before so it doesn't
+    reset every morning.
+    """
+    target = targets.get("calories", 0)
+    if not target:
+        return 0
+
+    day = end_day
+    if day.isoformat() not in rollup["days"]:
+        day -= timedelta(days=1)
+
+    streak = 0
+    while True:
+        totals = rollup["days"].get(day.isoformat())
+        if not totals or abs(totals["calories"] - target) > tolerance * target:
+            return streak
+        streak += 1
+        day -= timedelta(days=1)
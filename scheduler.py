@@ -0,0 +1,282 @@
+# scheduler.py
+import os
+import time
+import heapq
+import random
+import itertools
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from email.utils import parsedate_to_datetime
+from typing import Callable, Optional
+
+import anthropic
+
+import metrics
+
+# Account limits the scheduler stays under; tokens count the prompt estimate plus max_tokens
+API_REQUESTS_PER_MINUTE = float(os.environ.get("NUTRITION_API_RPM", 50))
+API_TOKENS_PER_MINUTE = float(os.environ.get("NUTRITION_API_TPM", 40000))
+
+# Lower value is served first; the coach is interactive, meal generation is bulk
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+# Time a call may take end to end, including queueing and retries
+DEADLINE_SECONDS = {PRIORITY_INTERACTIVE: 60.0, PRIORITY_BULK: 300.0}
+
+# Retries after the first attempt, and the full-jitter exponential backoff range
+MAX_RETRIES = int(os.environ.get("NUTRITION_API_MAX_RETRIES", 4))
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 30.0
+
+# Hedged calls send a duplicate once the first attempt is slower than this
+# percentile of recent latencies for the same kind of call
+HEDGE_PERCENTILE = 0.95
+HEDGE_MIN_SAMPLES = 20
+_LATENCY_WINDOW = 200
+
+
+class DeadlineExceeded(TimeoutError):
+    """The call could not be admitted or completed before its deadline."""
+
+
+class TokenBucket:
+    """`capacity` units, refilled continuously at `capacity` per minute."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` units are available (0 if they are now)."""
+        self._refill(now)
+        amount = min(amount, self.capacity)  # an oversized call waits for a full bucket
+        return max(0.0, (amount - self.level) / self.rate)
+
+    def take(self, amount: float) -> None:
+        self.level -= min(amount, self.capacity)
+
+    def give_back(self, amount: float) -> None:
+        self.level = min(self.capacity, self.level + amount)
+
+
+class RequestScheduler:
+    """
+    Shared gate in front of every Anthropic API call.
+
+    Calls are admitted in priority order (then FIFO) once both the request
+    and token buckets can cover them, so bulk meal generation queues behind
+    the coach instead of spending the rate limit it needs. Retryable
+    failures (429, 408/409, 5xx, connection errors) are retried with
+    full-jitter exponential backoff, or after the server's retry-after, and
+    a 429 pauses admission for everyone until then. Each call has a deadline
+    covering queueing, attempts and backoff. Hedged calls send a duplicate
+    attempt when the first is slower than recent calls of the same kind,
+    if the buckets have room for it, and use whichever reply lands first.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float = API_REQUESTS_PER_MINUTE,
+        tokens_per_minute: float = API_TOKENS_PER_MINUTE,
+        max_retries: int = MAX_RETRIES,
+    ):
+        self.max_retries = max_retries
+        self._requests = TokenBucket(requests_per_minute)
+        self._tokens = TokenBucket(tokens_per_minute)
+        self._cond = threading.Condition()
+        self._waiting = []  # heap of (priority, ticket) for callers waiting to be admitted
+        self._tickets = itertools.count()
+        self._paused_until = 0.0
+        self._latencies = defaultdict(lambda: deque(maxlen=_LATENCY_WINDOW))
+        self._hedge_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="api-hedge")
+
+    def call(
+        self,
+        fn: Callable,
+        kind: str,
+        priority: int = PRIORITY_BULK,
+        tokens: int = 0,
+        deadline: float = None,
+        hedge: bool = False,
+    ):
+        """
+        Runs `fn(timeout=seconds left)` under the rate limits and returns its
+        result. `tokens` is the estimated cost reserved against the token
+        bucket; `deadline` is seconds from now (default by priority). The last
+        error is raised once retries or time run out.
+        """
+        deadline_at = time.monotonic() + (deadline if deadline is not None else DEADLINE_SECONDS[priority])
+        for attempt in range(self.max_retries + 1):
+            self.acquire(priority, tokens, deadline_at, kind)
+            started = time.monotonic()
+            try:
+                if hedge:
+                    result = self._hedged(fn, kind, tokens, deadline_at)
+                else:
+                    result = fn(timeout=self._remaining(deadline_at))
+            except Exception as e:
+                delay = self.retry_delay(e, attempt, deadline_at, kind)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            with self._cond:
+                self._latencies[kind].append(time.monotonic() - started)
+            self._refund(tokens, result)
+            return result
+
+    def acquire(self, priority: int, tokens: int, deadline_at: float, kind: str = "") -> None:
+        """Blocks until this caller is first in line and the buckets cover it."""
+        ticket = (priority, next(self._tickets))
+        queued_at = time.monotonic()
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    if now >= deadline_at:
+                        raise DeadlineExceeded(f"{kind or 'API call'} was not admitted before its deadline")
+                    wait_for = self._paused_until - now
+                    if self._waiting[0] == ticket and wait_for <= 0:
+                        wait_for = max(self._requests.wait_time(1, now), self._tokens.wait_time(tokens, now))
+                        if wait_for <= 0:
+                            self._requests.take(1)
+                            self._tokens.take(tokens)
+                            break
+                        if now + wait_for > deadline_at:
+                            raise DeadlineExceeded(f"{kind or 'API call'} would exceed its deadline waiting for rate limit")
+                    self._cond.wait(min(wait_for, deadline_at - now) if wait_for > 0 else deadline_at - now)
+            finally:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+        metrics.observe("api_queue_wait_seconds", time.monotonic() - queued_at, priority=priority)
+
+    def try_acquire(self, tokens: int) -> bool:
+        """Takes capacity only if nobody is queued and it's available right now."""
+        with self._cond:
+            now = time.monotonic()
+            if self._waiting or now < self._paused_until:
+                return False
+            if self._requests.wait_time(1, now) > 0 or self._tokens.wait_time(tokens, now) > 0:
+                return False
+            self._requests.take(1)
+            self._tokens.take(tokens)
+            return True
+
+    def retry_delay(self, error: Exception, attempt: int, deadline_at: float, kind: str = "") -> Optional[float]:
+        """Seconds to wait before retrying after `error`, or None if it shouldn't be retried."""
+        if attempt >= self.max_retries or not is_retryable(error):
+            return None
+        delay = retry_after(error)
+        if delay is not None:
+            if getattr(error, "status_code", None) == 429:
+                # The whole account is over its limit, not just this call
+                with self._cond:
+                    self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                    self._cond.notify_all()
+        else:
+            delay = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+        if time.monotonic() + delay >= deadline_at:
+            return None
+        metrics.increment("api_retries_total", kind=kind, reason=_error_reason(error))
+        return delay
+
+    def hedge_after(self, kind: str) -> Optional[float]:
+        """Latency past which a call of this kind gets a duplicate, once enough are recorded."""
+        with self._cond:
+            latencies = sorted(self._latencies[kind])
+        if len(latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        return latencies[int(HEDGE_PERCENTILE * (len(latencies) - 1))]
+
+    def _hedged(self, fn: Callable, kind: str, tokens: int, deadline_at: float):
+        threshold = self.hedge_after(kind)
+        primary = self._hedge_executor.submit(fn, timeout=self._remaining(deadline_at))
+        if threshold is None:
+            return primary.result()
+
+        done, _ = wait([primary], timeout=min(threshold, self._remaining(deadline_at)))
+        if done or not self.try_acquire(tokens):
+            return primary.result()
+
+        metrics.increment("api_hedges_total", kind=kind)
+        pending = {primary, self._hedge_executor.submit(fn, timeout=self._remaining(deadline_at))}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    # The slower attempt finishes in the background; its reply is dropped
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def _refund(self, tokens: int, result) -> None:
+        # Reservations assume the whole max_tokens is generated; return what wasn't
+        usage = getattr(result, "usage", None)
+        if usage is None:
+            return
+        unused = tokens - (usage.input_tokens + usage.output_tokens)
+        if unused > 0:
+            with self._cond:
+                self._tokens.give_back(unused)
+                self._cond.notify_all()
+
+    @staticmethod
+    def _remaining(deadline_at: float) -> float:
+        return max(0.1, deadline_at - time.monotonic())
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, anthropic.APIConnectionError):  # includes timeouts
+        return True
+    if isinstance(error, anthropic.APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """The server's requested wait in seconds (retry-after-ms or retry-after), if any."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _error_reason(error: Exception) -> str:
+    status = getattr(error, "status_code", None)
+    return str(status) if status is not None else type(error).__name__
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_request_scheduler() -> RequestScheduler:
+    """Returns the process-wide scheduler, so every session shares one set of limits."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RequestScheduler()
+        return _scheduler
@@ -0,0 +1,441 @@
+# storage.py
+import os
+import json
+import sqlite3
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+DEFAULT_DB_PATH = os.environ.get("NUTRITION_DB_PATH", "users.db")
+DEFAULT_JSON_PATH = "users.json"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    extra TEXT NOT NULL DEFAULT '{}'
+);
+CREATE TABLE IF NOT EXISTS profiles (
+    user_id TEXT PRIMARY KEY REFERENCES users(user_id),
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS targets (
+    user_id TEXT PRIMARY KEY REFERENCES users(user_id),
+    calories REAL,
+    protein REAL,
+    fat REAL,
+    carbohydrates REAL
+);
+CREATE TABLE IF NOT EXISTS meals (
+    user_id TEXT NOT NULL REFERENCES users(user_id),
+    position INTEGER NOT NULL,
+    day TEXT NOT NULL,
+    meal_type TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (user_id, day, meal_type)
+);
+CREATE TABLE IF NOT EXISTS food_log (
+    user_id TEXT NOT NULL REFERENCES users(user_id),
+    seq INTEGER NOT NULL,
+    timestamp TEXT,
+    food_item TEXT,
+    calories REAL,
+    protein REAL,
+    fat REAL,
+    carbs REAL,
+    quantity REAL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (user_id, seq)
+);
+CREATE INDEX IF NOT EXISTS food_log_by_time ON food_log (user_id, timestamp);
+CREATE TABLE IF NOT EXISTS coach_chat (
+    user_id TEXT NOT NULL REFERENCES users(user_id),
+    seq INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (user_id, seq)
+);
+"""
+
+# Top-level user keys that get their own table; everything else lives in users.extra
+SECTIONS = ("profile", "targets", "meals", "food_log", "coach_chat")
+
+# food_log columns query_food_log can sort by (text columns sort case-insensitively)
+FOOD_LOG_SORT_COLUMNS = {
+    "timestamp": "timestamp",
+    "food_item": "food_item COLLATE NOCASE",
+    "calories": "calories",
+    "protein": "protein",
+    "fat": "fat",
+    "carbs": "carbs",
+    "quantity": "quantity",
+}
+
+
+class SQLiteUserStore:
+    """
+    SQLite-backed user store.
+
+    `load_all`/`save_all` keep the same `{user_id: {...}}` shape as
+    users.json, but `save_all` compares each section against what was last
+    read or written and only touches the rows that changed. Appending to
+    `food_log` or `coach_chat` inserts just the new rows.
+    """
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+        # user_id -> section -> serialized form last seen in the database
+        self._known = {}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def is_empty(self) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM users LIMIT 1").fetchone() is None
+
+    def load_all(self) -> Dict:
+        """Reads every user into the users.json-shaped dict."""
+        with self._lock:
+            user_ids = [row[0] for row in self._conn.execute("SELECT user_id FROM users")]
+            return {user_id: self._load_user(user_id) for user_id in user_ids}
+
+    def list_user_ids(self) -> List[str]:
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT user_id FROM users")]
+
+    def load_user(self, user_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM users WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            return self._load_user(user_id) if row else None
+
+    def save_all(self, users: Dict) -> None:
+        """Writes only the sections and rows that differ from the stored copy."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for user_id, user_data in users.items():
+                    self._save_user(user_id, user_data)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                # Our view of the database may now be stale; re-diff from scratch next time
+                self._known.clear()
+                raise
+
+    def save_user(self, user_id: str, user_data: Dict) -> None:
+        self.save_all({user_id: user_data})
+
+    def update_user(self, user_id: str, update: Callable[[Dict], bool]) -> bool:
+        """
+        Loads a user, applies `update` and writes the changes in one
+        transaction. `update` returns False to leave the user as is.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                exists = self._conn.execute(
+                    "SELECT 1 FROM users WHERE user_id = ?", (user_id,)
+                ).fetchone()
+                user_data = self._load_user(user_id) if exists else None
+                updated = user_data is not None and update(user_data)
+                if updated:
+                    self._save_user(user_id, user_data)
+                self._conn.execute("COMMIT")
+                return updated
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                self._known.clear()
+                raise
+
+    def append(self, user_id: str, section: str, entry: Dict) -> None:
+        """Inserts a single food_log or coach_chat entry without diffing the section."""
+        to_row = _food_log_row if section == "food_log" else _coach_chat_row
+        serialized = json.dumps(entry)
+        with self._lock:
+            known = self._known.setdefault(user_id, {})
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO users (user_id) VALUES (?)", (user_id,)
+                )
+                seq = self._conn.execute(
+                    f"SELECT COALESCE(MAX(seq) + 1, 0) FROM {section} WHERE user_id = ?",
+                    (user_id,),
+                ).fetchone()[0]
+                row = (user_id, seq) + to_row(entry) + (serialized,)
+                placeholders = ", ".join("?" * len(row))
+                self._conn.execute(f"INSERT INTO {section} VALUES ({placeholders})", row)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            known.setdefault(section, []).append(serialized)
+
+    def query_food_log(
+        self,
+        user_id: str,
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+        search: str = "",
+        sort_by: str = "timestamp",
+        descending: bool = True,
+        limit: Optional[int] = None,
+        offset: int = 0,
+    ) -> Tuple[List[Tuple[int, Dict]], int]:
+        """
+        One window of a user's food log, filtered and sorted in SQL.
+
+        `start` <= timestamp < `end` (ISO strings) uses the (user_id,
+        timestamp) index; `search` is a case-insensitive substring match on
+        food_item. Returns ([(seq, entry)], total matching rows); seq is the
+        entry's index in the user's food_log list.
+        """
+        where = ["user_id = ?"]
+        params = [user_id]
+        if start:
+            where.append("timestamp >= ?")
+            params.append(start)
+        if end:
+            where.append("timestamp < ?")
+            params.append(end)
+        if search:
+            escaped = search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            where.append("food_item LIKE ? ESCAPE '\\'")
+            params.append(f"%{escaped}%")
+        clause = " AND ".join(where)
+        direction = "DESC" if descending else "ASC"
+        order = f"{FOOD_LOG_SORT_COLUMNS[sort_by]} {direction}, seq {direction}"
+
+        sql = f"SELECT seq, data FROM food_log WHERE {clause} ORDER BY {order}"
+        page_params = []
+        if limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            page_params = [limit, offset]
+
+        with self._lock:
+            total = self._conn.execute(f"SELECT COUNT(*) FROM food_log WHERE {clause}", params).fetchone()[0]
+            rows = self._conn.execute(sql, params + page_params).fetchall()
+        return [(seq, json.loads(data)) for seq, data in rows], total
+
+    def _load_user(self, user_id: str) -> Dict:
+        # Caller holds the lock
+        conn = self._conn
+        known = {}
+        extra = conn.execute("SELECT extra FROM users WHERE user_id = ?", (user_id,)).fetchone()[0]
+        known["extra"] = extra
+        user_data = json.loads(extra)
+
+        row = conn.execute("SELECT data FROM profiles WHERE user_id = ?", (user_id,)).fetchone()
+        if row:
+            known["profile"] = row[0]
+            user_data["profile"] = json.loads(row[0])
+
+        row = conn.execute(
+            "SELECT calories, protein, fat, carbohydrates FROM targets WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        if row:
+            targets = {
+                "calories": _as_number(row[0]),
+                "protein": _as_number(row[1]),
+                "fat": _as_number(row[2]),
+                "carbohydrates": _as_number(row[3]),
+            }
+            known["targets"] = json.dumps(targets)
+            user_data["targets"] = targets
+
+        meal_rows = conn.execute(
+            "SELECT day, meal_type, data FROM meals WHERE user_id = ? ORDER BY position",
+            (user_id,),
+        ).fetchall()
+        if meal_rows:
+            meals = {}
+            for day, meal_type, data in meal_rows:
+                meals.setdefault(day, {})[meal_type] = json.loads(data)
+            known["meals"] = json.dumps(meals)
+            user_data["meals"] = meals
+
+        for section in ("food_log", "coach_chat"):
+            rows = [
+                row[0]
+                for row in conn.execute(
+                    f"SELECT data FROM {section} WHERE user_id = ? ORDER BY seq", (user_id,)
+                )
+            ]
+            if rows:
+                known[section] = rows
+                user_data[section] = [json.loads(data) for data in rows]
+
+        self._known[user_id] = known
+        return user_data
+
+    def _save_user(self, user_id: str, user_data: Dict) -> None:
+        # Caller holds the lock and an open transaction
+        conn = self._conn
+        known = self._known.setdefault(user_id, {})
+
+        extra = json.dumps({k: v for k, v in user_data.items() if k not in SECTIONS})
+        if known.get("extra") != extra:
+            conn.execute(
+                "INSERT INTO users (user_id, extra) VALUES (?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET extra = excluded.extra",
+                (user_id, extra),
+            )
+            known["extra"] = extra
+
+        if "profile" in user_data:
+            profile = json.dumps(user_data["profile"])
+            if known.get("profile") != profile:
+                conn.execute(
+                    "INSERT OR REPLACE INTO profiles (user_id, data) VALUES (?, ?)",
+                    (user_id, profile),
+                )
+                known["profile"] = profile
+
+        if "targets" in user_data:
+            targets = user_data["targets"]
+            serialized = json.dumps(targets)
+            if known.get("targets") != serialized:
+                conn.execute(
+                    "INSERT OR REPLACE INTO targets (user_id, calories, protein, fat, carbohydrates) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (
+                        user_id,
+                        targets.get("calories"),
+                        targets.get("protein"),
+                        targets.get("fat"),
+                        targets.get("carbohydrates"),
+                    ),
+                )
+                known["targets"] = serialized
+
+        if "meals" in user_data:
+            meals = user_data["meals"]
+            serialized = json.dumps(meals)
+            if known.get("meals") != serialized:
+                # A regenerated plan replaces the old one wholesale
+                conn.execute("DELETE FROM meals WHERE user_id = ?", (user_id,))
+                conn.executemany(
+                    "INSERT INTO meals (user_id, position, day, meal_type, data) VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (user_id, position, day, meal_type, json.dumps(meal))
+                        for position, (day, meal_type, meal) in enumerate(_iter_meals(meals))
+                    ],
+                )
+                known["meals"] = serialized
+
+        if "food_log" in user_data:
+            self._save_rows(user_id, "food_log", user_data["food_log"], _food_log_row)
+        if "coach_chat" in user_data:
+            self._save_rows(user_id, "coach_chat", user_data["coach_chat"], _coach_chat_row)
+
+    def _save_rows(self, user_id: str, section: str, entries: List[Dict], to_row) -> None:
+        """Inserts only appended entries; rewrites the section if earlier entries changed."""
+        known = self._known[user_id]
+        old_rows = known.get(section, [])
+        new_rows = [json.dumps(entry) for entry in entries]
+
+        start = len(old_rows)
+        if len(new_rows) < len(old_rows) or new_rows[:start] != old_rows:
+            self._conn.execute(f"DELETE FROM {section} WHERE user_id = ?", (user_id,))
+            start = 0
+
+        if start < len(new_rows):
+            rows = [
+                (user_id, seq) + to_row(entries[seq]) + (new_rows[seq],)
+                for seq in range(start, len(new_rows))
+            ]
+            placeholders = ", ".join("?" * len(rows[0]))
+            self._conn.executemany(f"INSERT INTO {section} VALUES ({placeholders})", rows)
+        known[section] = new_rows
+
+
+def _iter_meals(meals: Dict):
+    for day, day_meals in meals.items():
+        for meal_type, meal in day_meals.items():
+            yield day, meal_type, meal
+
+
+def _food_log_row(entry: Dict) -> tuple:
+    return (
+        entry.get("timestamp"),
+        entry.get("food_item"),
+        entry.get("calories"),
+        entry.get("protein"),
+        entry.get("fat"),
+        entry.get("carbs"),
+        entry.get("quantity"),
+    )
+
+
+def _coach_chat_row(entry: Dict) -> tuple:
+    return (entry.get("role", ""), entry.get("content", ""))
+
+
+def _as_number(value):
+    """SQLite REAL columns come back as floats; keep whole numbers as ints like the JSON file."""
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def migrate_from_json(json_path: str = DEFAULT_JSON_PATH, db_path: str = DEFAULT_DB_PATH) -> int:
+    """One-shot import of users.json into the SQLite store. Returns the number of users copied."""
+    with open(json_path, "r") as f:
+        users = json.load(f)
+    for user_data in users.values():
+        user_data.pop("_journal_seq", None)  # utils' journal watermark, not user data
+    store = get_store(db_path)
+    store.save_all(users)
+    return len(users)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(db_path: str = DEFAULT_DB_PATH) -> SQLiteUserStore:
+    """Returns the process-wide store for db_path."""
+    with _stores_lock:
+        store = _stores.get(db_path)
+        if store is None:
+            store = SQLiteUserStore(db_path)
+            _stores[db_path] = store
+        return store
+
+
+def load_user_data(db_path: str = DEFAULT_DB_PATH, user_id: Optional[str] = None) -> Dict:
+    """
+    Drop-in replacement for utils.load_user_data backed by SQLite. With a
+    user_id only that user is read.
+    """
+    store = get_store(db_path)
+    if store.is_empty() and os.path.exists(DEFAULT_JSON_PATH):
+        # First run against an empty database: carry over the existing users.json
+        migrate_from_json(DEFAULT_JSON_PATH, db_path)
+    if user_id is None:
+        return store.load_all()
+    user_data = store.load_user(user_id)
+    return {user_id: user_data} if user_data is not None else {}
+
+
+def save_user_data(users: Dict, db_path: str = DEFAULT_DB_PATH) -> None:
+    """Drop-in replacement for utils.save_user_data that only writes changed rows."""
+    get_store(db_path).save_all(users)
+
+
+if __name__ == "__main__":
+    import sys
+
+    json_path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_JSON_PATH
+    db_path = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_DB_PATH
+    count = migrate_from_json(json_path, db_path)
+    print(f"Migrated {count} user(s) from {json_path} to {db_path}")
@@ -0,0 +1,24 @@
+# tests/conftest.py
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """Points the JSON user store at an empty directory for one test."""
+    import utils
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(utils, "STORAGE_BACKEND", "json")
+    monkeypatch.setattr(utils, "SAVE_COALESCING", False)
+    monkeypatch.setattr(utils, "DATA_DIR", str(tmp_path / "data"))
+    monkeypatch.setattr(utils, "USERS_DIR", str(tmp_path / "data" / "users"))
+    monkeypatch.setattr(utils, "INDEX_PATH", str(tmp_path / "data" / "users" / "index.json"))
+    monkeypatch.setattr(utils, "SHARDS_DIR", str(tmp_path / "data" / "users" / "shards"))
+    monkeypatch.setattr(utils, "LOCKS_DIR", str(tmp_path / "data" / "users" / "locks"))
+    monkeypatch.setattr(utils, "_journals", {})
+    return tmp_path
@@ -0,0 +1,34 @@
+# tests/test_cache.py
+import json
+
+from cache import ResponseCache
+
+
+def test_disk_write_failures_dont_raise(tmp_path):
+    # A file where the cache directory should be makes every disk write fail
+    blocked = tmp_path / "cache"
+    blocked.write_text("")
+    cache = ResponseCache(cache_dir=str(blocked))
+
+    cache.set("ab" * 32, {"meal_name": "Oats"})
+
+    assert cache.get("ab" * 32) == {"meal_name": "Oats"}
+
+
+def test_entries_round_trip_through_disk(tmp_path):
+    ResponseCache(cache_dir=str(tmp_path)).set("cd" * 32, {"meal_name": "Stew"})
+
+    assert ResponseCache(cache_dir=str(tmp_path)).get("cd" * 32) == {"meal_name": "Stew"}
+    assert not list(tmp_path.rglob("*.tmp"))
+
+
+def test_malformed_disk_records_are_misses(tmp_path):
+    cache = ResponseCache(cache_dir=str(tmp_path))
+    records = {"ef" * 32: [1, 2], "01" * 32: {"value": "{}"}, "23" * 32: {"created_at": "yesterday", "value": "{}"}}
+    for key, record in records.items():
+        path = tmp_path / key[:2] / f"{key}.json"
+        path.parent.mkdir()
+        path.write_text(json.dumps(record))
+
+    assert all(cache.get(key) is None for key in records)
+    assert cache.stats()["misses"] == len(records)
@@ -0,0 +1,136 @@
+# tests/test_jobs.py
+import threading
+import time
+
+import utils
+from jobs import JobRunner, JobStore
+
+USER_ID = "alice"
+TARGETS = {"calories": 2100, "protein": 150, "fat": 70, "carbohydrates": 220}
+
+
+class FakeCoach:
+    """Stands in for NutritionCoach: every meal comes back at once."""
+
+    def _build_meal_prompt(self, meal_type, *args, **kwargs):
+        return meal_type
+
+    def _call_anthropic_api(self, prompt, profile, variant=None, on_field=None, nonce=None):
+        return {"meal_name": f"{variant} meal", "calories": 700, "protein": 50, "fat": 23, "carbohydrates": 73}
+
+    def _remember_meals(self, meal_plan, profile):
+        pass
+
+
+def _wait_for(store, job_id, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = store.get_job(job_id)
+        if job["status"] not in ("queued", "running"):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def _runner(data_dir):
+    return JobRunner(JobStore(str(data_dir / "jobs.db")), coach_factory=FakeCoach, max_concurrency=1)
+
+
+def test_checkpoint_keeps_food_log_appended_meanwhile(data_dir):
+    user_data = {"profile": {"name": "Alice"}, "targets": TARGETS, "food_log": []}
+    utils.save_user_data({USER_ID: user_data})
+    session_users = utils.load_user_data(USER_ID)
+    runner = _runner(data_dir)
+
+    # Log a food while a checkpoint is between reading and writing the user's data
+    appends = []
+    task_results = runner.store.task_results
+
+    def interleaved_task_results(job_id):
+        if not appends:
+            entry = {"timestamp": "2026-10-17T12:00:00", "food_item": "apple", "calories": 95}
+            thread = threading.Thread(target=utils.append_food_log, args=(session_users, USER_ID, entry))
+            thread.start()
+            appends.append(thread)
+            thread.join(timeout=0.2)
+        return task_results(job_id)
+
+    runner.store.task_results = interleaved_task_results
+    job_id = runner.submit_meal_plan(USER_ID, user_data, num_days=1)
+    assert _wait_for(runner.store, job_id)["status"] == "done"
+    appends[0].join(timeout=5)
+
+    stored = utils.load_user_data(USER_ID)[USER_ID]
+    assert [entry["food_item"] for entry in stored["food_log"]] == ["apple"]
+    assert set(stored["meals"]["Day 1"]) == {"Breakfast", "Lunch", "Dinner"}
+
+
+class GatedCoach(FakeCoach):
+    """Holds every meal request until `gate` is set."""
+
+    def __init__(self, gate, label=""):
+        self.gate = gate
+        self.label = label
+
+    def _call_anthropic_api(self, prompt, profile, variant=None, on_field=None, nonce=None):
+        assert self.gate.wait(timeout=5)
+        return dict(super()._call_anthropic_api(prompt, profile, variant), meal_name=f"{self.label} {variant}")
+
+
+def test_newer_job_supersedes_unfinished_one(data_dir):
+    user_data = {"profile": {"name": "Alice"}, "targets": TARGETS}
+    utils.save_user_data({USER_ID: user_data})
+    store = JobStore(str(data_dir / "jobs.db"))
+    old_gate, new_gate = threading.Event(), threading.Event()
+    old_runner = JobRunner(store, coach_factory=lambda: GatedCoach(old_gate, "old"), max_concurrency=3)
+    new_runner = JobRunner(store, coach_factory=lambda: GatedCoach(new_gate, "new"), max_concurrency=3)
+
+    old_job = old_runner.submit_meal_plan(USER_ID, user_data, num_days=1)
+    new_job = new_runner.submit_meal_plan(USER_ID, user_data, num_days=1)
+    new_gate.set()
+    assert _wait_for(store, new_job)["status"] == "done"
+    old_gate.set()
+    old_runner._executor.shutdown(wait=True)
+
+    assert store.get_job(old_job)["status"] == "superseded"
+    assert not old_runner.resume(old_job)
+    meals = utils.load_user_data(USER_ID)[USER_ID]["meals"]["Day 1"]
+    assert {meal["meal_name"].split()[0] for meal in meals.values()} == {"new"}
+
+
+def test_lease_is_renewed_while_a_meal_is_in_flight(data_dir, monkeypatch):
+    import jobs
+
+    monkeypatch.setattr(jobs, "JOB_LEASE_SECONDS", 0.3)
+    monkeypatch.setattr(jobs, "LEASE_RENEW_SECONDS", 0.05)
+    user_data = {"profile": {"name": "Alice"}, "targets": TARGETS}
+    utils.save_user_data({USER_ID: user_data})
+    store = JobStore(str(data_dir / "jobs.db"))
+    gate = threading.Event()
+    runner = JobRunner(store, coach_factory=lambda: GatedCoach(gate), max_concurrency=3)
+
+    job_id = runner.submit_meal_plan(USER_ID, user_data, num_days=1)
+    time.sleep(0.6)  # twice the lease, with every meal still waiting on the API
+    assert not store.claim(job_id, "another-worker")
+    gate.set()
+    assert _wait_for(store, job_id)["status"] == "done"
+
+
+def test_job_left_running_by_a_quick_restart_is_resumed_once_its_lease_lapses(data_dir, monkeypatch):
+    import jobs
+
+    monkeypatch.setattr(jobs, "JOB_LEASE_SECONDS", 0.3)
+    monkeypatch.setattr(jobs, "LEASE_RENEW_SECONDS", 0.05)
+    user_data = {"profile": {"name": "Alice"}, "targets": TARGETS}
+    utils.save_user_data({USER_ID: user_data})
+    store = JobStore(str(data_dir / "jobs.db"))
+    job_id = store.create_job(USER_ID, "meal_plan", {
+        "profile": user_data["profile"], "targets": TARGETS, "num_days": 1, "meal_prep": False,
+    }, jobs.meal_plan_task_keys(1, False))
+    # The previous process claimed the job and died before its lease ran out
+    assert store.claim(job_id, "previous-process")
+
+    runner = JobRunner(store, coach_factory=FakeCoach, max_concurrency=1)
+    assert runner.resume_all() == []
+
+    assert _wait_for(store, job_id)["status"] == "done"
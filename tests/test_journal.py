@@ -0,0 +1,61 @@
+# tests/test_journal.py
+import utils
+from journal import EventJournal
+
+USER_ID = "alice"
+
+
+def _food(name):
+    return {"timestamp": "2026-10-17T12:00:00", "food_item": name, "calories": 100}
+
+
+def _food_items(user_id=USER_ID):
+    return [entry["food_item"] for entry in utils.load_user_data(user_id)[user_id]["food_log"]]
+
+
+def test_appends_from_the_same_snapshot_are_all_kept(data_dir):
+    utils.save_user_data({USER_ID: {"profile": {}, "food_log": []}})
+    first_session = utils.load_user_data(USER_ID)
+    second_session = utils.load_user_data(USER_ID)
+
+    utils.append_food_log(first_session, USER_ID, _food("A"))
+    utils.append_food_log(second_session, USER_ID, _food("B"))
+
+    assert _food_items() == ["A", "B"]
+
+
+def test_numbering_continues_after_compaction(data_dir):
+    users = {USER_ID: {"profile": {}, "food_log": []}}
+    utils.save_user_data(users)
+    utils.append_food_log(users, USER_ID, _food("A"))
+    utils.compact_journal(USER_ID)
+    utils.append_food_log(users, USER_ID, _food("B"))
+
+    assert _food_items() == ["A", "B"]
+
+
+def test_saving_an_older_copy_keeps_entries_appended_since_it_was_loaded(data_dir):
+    utils.save_user_data({USER_ID: {"profile": {}, "food_log": []}})
+    first_session = utils.load_user_data(USER_ID)
+    second_session = utils.load_user_data(USER_ID)
+
+    utils.append_food_log(first_session, USER_ID, _food("A"))
+    utils.append_food_log(second_session, USER_ID, _food("B"))
+    utils.append_food_log(first_session, USER_ID, _food("C"))
+    utils.save_user_data(second_session)
+    first_session[USER_ID]["profile"]["name"] = "Alice"
+    utils.save_user_data(first_session)
+
+    assert _food_items() == ["A", "B", "C"]
+    assert utils.load_user_data(USER_ID)[USER_ID]["profile"] == {"name": "Alice"}
+
+
+def test_replay_skips_events_already_in_the_snapshot(tmp_path):
+    journal = EventJournal(str(tmp_path / "alice.journal.jsonl"))
+    journal.append(USER_ID, "food_log", _food("A"))
+    journal.append(USER_ID, "food_log", _food("B"))
+
+    # A crash after writing a snapshot holding A, before truncating the journal
+    users = journal.replay({USER_ID: {"food_log": [_food("A")]}}, watermark=1)
+    assert [entry["food_item"] for entry in users[USER_ID]["food_log"]] == ["A", "B"]
+
@@ -0,0 +1,49 @@
+# tests/test_meal_library.py
+import pytest
+
+from meal_library import MealLibrary
+
+pytest.importorskip("scipy")
+
+TARGET = {"calories": 700, "protein": 50, "fat": 23, "carbohydrates": 70}
+
+
+class _NoAPIClient:
+    """Stands in for anthropic.Anthropic; library lookups must not call the API."""
+
+    def __getattr__(self, name):
+        raise AssertionError(f"unexpected API access: {name}")
+
+
+def _meal(name):
+    return dict(TARGET, meal_name=name, ingredients=[])
+
+
+def test_a_meal_can_be_stored_under_several_meal_types(tmp_path):
+    library = MealLibrary(str(tmp_path / "library.jsonl"))
+    assert library.add("Breakfast", _meal("Egg bowl"))
+    assert not library.add("Breakfast", _meal("Egg bowl"))
+    assert library.add("Lunch", _meal("Egg bowl"))
+
+    assert library.nearest("Lunch", TARGET)[1]["meal_name"] == "Egg bowl"
+    assert len(MealLibrary(str(tmp_path / "library.jsonl"))) == 2
+
+
+def test_meals_from_the_plan_being_replaced_are_not_reused(tmp_path, monkeypatch):
+    from cache import ResponseCache
+    from models import NutritionCoach
+    from scheduler import RequestScheduler
+
+    monkeypatch.delenv("ANTHROPIC_API_KEY", raising=False)
+    library = MealLibrary(str(tmp_path / "library.jsonl"))
+    library.add("Lunch", _meal("Last week's lunch"))
+    library.add("Lunch", _meal("Older lunch"))
+    coach = NutritionCoach(
+        cache=ResponseCache(cache_dir=None), client=_NoAPIClient(), library=library, scheduler=RequestScheduler()
+    )
+    targets = {column: value * 3 for column, value in TARGET.items()}
+    recent_plan = {"Day 1": {"Lunch": _meal("Last week's lunch")}}
+
+    hits = coach._fill_from_library([(1, "Lunch")], targets, {}, 3, recent_plan=recent_plan)
+
+    assert hits[(1, "Lunch")]["meal_name"] == "Older lunch"
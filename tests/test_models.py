@@ -0,0 +1,45 @@
+# tests/test_models.py
+import json
+from types import SimpleNamespace
+
+from cache import ResponseCache
+from meal_library import MealLibrary
+from models import NutritionCoach
+from scheduler import RequestScheduler
+
+
+class _CountingClient:
+    """Stands in for anthropic.Anthropic; every create() returns a fresh day plan."""
+
+    def __init__(self):
+        self.calls = 0
+        self.messages = self
+
+    def create(self, **request):
+        self.calls += 1
+        plan = {"Day 1": {"Lunch": {"meal_name": f"Lunch {self.calls}"}}}
+        return SimpleNamespace(content=[SimpleNamespace(text=json.dumps(plan))])
+
+
+def _coach(tmp_path, client):
+    return NutritionCoach(
+        cache=ResponseCache(cache_dir=None),
+        client=client,
+        library=MealLibrary(str(tmp_path / "library.jsonl")),
+        scheduler=RequestScheduler(),
+    )
+
+
+def test_a_new_nonce_asks_for_new_meals(tmp_path):
+    client = _CountingClient()
+    coach = _coach(tmp_path, client)
+
+    first = coach._call_day_plan_api("plan Day 1", {}, variant="Day 1")
+    assert coach._call_day_plan_api("plan Day 1", {}, variant="Day 1") == first
+    assert client.calls == 1
+
+    regenerated = coach._call_day_plan_api("plan Day 1", {}, variant="Day 1", nonce="again")
+    assert client.calls == 2
+    assert regenerated != first
+    assert coach._call_day_plan_api("plan Day 1", {}, variant="Day 1", nonce="again") == regenerated
+    assert client.calls == 2
@@ -0,0 +1,35 @@
+# tests/test_portion_optimizer.py
+from portion_optimizer import macro_value, optimize_meal_plan, portion_multipliers
+
+MEAL_TYPES = ["Breakfast", "Lunch", "Dinner"]
+TARGETS = {"calories": 2100, "protein": 150, "fat": 70, "carbohydrates": 210}
+
+
+def _meal(name, calories=700):
+    return {"meal_name": name, "calories": calories, "protein": 50, "fat": 23, "carbohydrates": 70, "ingredients": []}
+
+
+def test_macro_values_with_units_are_parsed():
+    assert macro_value("800 kcal") == 800
+    assert macro_value(42) == 42
+    assert macro_value("about right") is None
+    assert macro_value(None) is None
+
+
+def test_meals_with_invalid_macros_keep_their_portion():
+    meals = {"Breakfast": _meal("Oats", "plenty"), "Lunch": _meal("Bowl", 500), "Dinner": _meal("Stew", 500)}
+    multipliers = portion_multipliers(meals, TARGETS)
+    assert multipliers["Breakfast"] == 1.0
+
+
+def test_only_complete_days_are_scaled():
+    plan = {
+        "Day 1": {"Breakfast": _meal("Oats", "600 kcal"), "Lunch": _meal("Bowl", 600), "Dinner": _meal("Stew", 600)},
+        "Day 2": {"Breakfast": _meal("Oats")},
+        "Day 3": {"Breakfast": _meal("Error Meal", 0), "Lunch": _meal("Bowl"), "Dinner": _meal("Stew")},
+    }
+    scaled = optimize_meal_plan(plan, TARGETS, MEAL_TYPES, skip_meal_names=["Error Meal"])
+
+    assert all("portion_multiplier" in meal for meal in scaled["Day 1"].values())
+    assert scaled["Day 2"] == plan["Day 2"]
+    assert scaled["Day 3"] == plan["Day 3"]
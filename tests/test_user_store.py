@@ -0,0 +1,47 @@
+# tests/test_user_store.py
+import threading
+
+import pytest
+
+import utils
+
+
+def _save_with_timeout(users, timeout=5.0):
+    # A lock collision would deadlock the save, so run it where the test can give up on it
+    thread = threading.Thread(target=utils.save_user_data, args=(users,), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "save_user_data deadlocked"
+
+
+@pytest.mark.parametrize("user_id", ["index", "migrate", "locks", "shards"])
+def test_user_ids_cannot_collide_with_store_files(data_dir, user_id):
+    _save_with_timeout({"alice": {"profile": {"name": "Alice"}}})
+    _save_with_timeout({user_id: {"profile": {"name": user_id}}})
+
+    assert sorted(utils.list_user_ids()) == sorted(["alice", user_id])
+    assert utils.load_user_data(user_id)[user_id]["profile"] == {"name": user_id}
+    assert utils.load_user_data("alice")["alice"]["profile"] == {"name": "Alice"}
+
+
+def test_empty_user_id_is_rejected(data_dir):
+    with pytest.raises(ValueError):
+        utils.save_user_data({"": {"profile": {}}})
+
+
+
+def test_concurrent_coalesced_saves_are_all_written(data_dir, monkeypatch):
+    monkeypatch.setattr(utils, "SAVE_COALESCING", True)
+    monkeypatch.setattr(utils, "_coalescer", utils._SaveCoalescer())
+    user_ids = [f"user{i}" for i in range(8)]
+    threads = [
+        threading.Thread(target=utils.save_user_data, args=({user_id: {"profile": {"name": user_id}}},))
+        for user_id in user_ids
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5.0)
+
+    users = utils.load_user_data()
+    assert {user_id: users[user_id]["profile"]["name"] for user_id in user_ids} == dict(zip(user_ids, user_ids))
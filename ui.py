@@ -1,18 +1,76 @@
 # ui.py
 import streamlit as st
 import json
-from st_aggrid import AgGrid, GridOptionsBuilder, GridUpdateMode, DataReturnMode
-from models import NutritionCoach
-from utils import save_user_data, create_weekly_schedule
-import pandas as pd
+import time
+import threading
+import hashlib
+import uuid
+from nutrition_targets import compute_targets
+from utils import save_user_data, create_weekly_schedule, append_food_log, append_coach_message, query_food_log
 from typing import Dict
-from datetime import datetime
+from datetime import date, datetime, timedelta
+from coach_memory import archive_old_messages
+import metrics
+from cache import get_response_cache
+from food_db import get_food_database, scale_macros, MIN_MATCH_SCORE
+from rollups import ensure_daily_totals, day_totals, rolling_average, adherence_streak
 
-def display_tracker_page(users):
+# pandas, st_aggrid and models (which pulls in anthropic) are imported inside the
+# page handlers that use them, so a rerun only pays for what the current page needs.
+
+# Built frames and grid options kept per distinct meal plan / schedule
+GRID_CACHE_ENTRIES = 32
+
+# How often the meal plan page re-checks a running background job
+JOB_POLL_SECONDS = 1.0
+
+# Trends page periods, in days (None = all history)
+TRENDS_PERIODS = {"Last 4 weeks": 28, "Last 12 weeks": 84, "Last 6 months": 182, "Last year": 365, "All time": None}
+
+FOOD_LOG_PAGE_SIZES = [25, 50, 100]
+FOOD_LOG_SORTS = {
+    "Newest first": ("timestamp", True),
+    "Oldest first": ("timestamp", False),
+    "Calories (high to low)": ("calories", True),
+    "Protein (high to low)": ("protein", True),
+    "Food (A-Z)": ("food_item", False),
+}
+
+
+def _content_key(data) -> str:
+    """Stable hash of a JSON-serializable value, used to memoize views of it."""
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def _plain_grid_options(gb):
+    """
+    GridOptionsBuilder output as plain dicts, so st.cache_data can pickle it
+    (the builder uses local defaultdicts) and each rerun gets its own copy.
+    """
+    return json.loads(json.dumps(gb.build()))
+
+
+def _rerun():
+    # st.experimental_rerun was renamed to st.rerun in newer Streamlit releases
+    rerun = getattr(st, "rerun", None) or st.experimental_rerun
+    rerun()
+
+
+def _selected_row(grid_response):
+    """First selected row as a dict; st_aggrid returns a list or a DataFrame depending on version."""
+    rows = grid_response["selected_rows"] if grid_response else None
+    if rows is None or len(rows) == 0:
+        return None
+    if hasattr(rows, "iloc"):
+        return rows.iloc[0].to_dict()
+    return rows[0]
+
+
+@metrics.timed("page_render_seconds", page="tracker")
+def display_tracker_page(users, user_id):
     """Displays the food tracker page."""
     st.header("Food Tracker")
 
-    user_id = "user1"  # Replace with actual user ID later
     if user_id not in users:
         st.warning("No user profile found. Please create one under 'Profile'.")
         return
@@ -21,15 +79,36 @@ def display_tracker_page(users):
     if "food_log" not in users[user_id]:
         users[user_id]["food_log"] = []
 
+    # Look up a food in the local database to pre-fill the form
+    st.subheader("Log a New Food Item")
+    food_db = get_food_database()
+    food_search = st.text_input("Search foods (e.g., 'Chicken Breast')")
+    matches = []
+    if food_search:
+        matches = food_db.autocomplete(food_search) or [
+            food for score, food in food_db.search(food_search, limit=5) if score >= MIN_MATCH_SCORE
+        ]
+    selected_food = st.selectbox(
+        "Matching foods",
+        options=[None] + matches,
+        format_func=lambda food: "Enter manually" if food is None else f'{food["name"]} ({food["serving"]})',
+    )
+    quantity = st.number_input("Quantity / Serving Size", min_value=1, value=1)
+
+    prefill = {"calories": 0, "protein": 0, "fat": 0, "carbs": 0}
+    if selected_food:
+        prefill = {field: round(value) for field, value in scale_macros(selected_food, quantity).items()}
+
     # Input form for adding a new food entry
     with st.form("food_entry_form"):
-        st.subheader("Log a New Food Item")
-        food_item = st.text_input("Food Item (e.g., 'Chicken Breast')")
-        calories = st.number_input("Calories", min_value=0, value=0)
-        protein = st.number_input("Protein (g)", min_value=0, value=0)
-        fat = st.number_input("Fat (g)", min_value=0, value=0)
-        carbs = st.number_input("Carbohydrates (g)", min_value=0, value=0)
-        quantity = st.number_input("Quantity / Serving Size", min_value=1, value=1)
+        food_item = st.text_input(
+            "Food Item (e.g., 'Chicken Breast')",
+            value=selected_food["name"] if selected_food else food_search,
+        )
+        calories = st.number_input("Calories", min_value=0, value=prefill["calories"])
+        protein = st.number_input("Protein (g)", min_value=0, value=prefill["protein"])
+        fat = st.number_input("Fat (g)", min_value=0, value=prefill["fat"])
+        carbs = st.number_input("Carbohydrates (g)", min_value=0, value=prefill["carbs"])
 
         submitted = st.form_submit_button("Add to Tracker")
         if submitted:
@@ -43,36 +122,122 @@ def display_tracker_page(users):
                 "carbs": carbs,
                 "quantity": quantity,
             }
-            users[user_id]["food_log"].append(entry)
-            save_user_data(users)
+            append_food_log(users, user_id, entry)
             st.success(f"Added {food_item} to the tracker!")
 
-    # Display the current food log in a table
+    display_daily_dashboard(users[user_id])
+
     if users[user_id]["food_log"]:
-        st.subheader("Your Logged Foods")
-        df_log = pd.DataFrame(users[user_id]["food_log"])
-        AgGrid(df_log, fit_columns_on_grid_load=True)
+        display_food_log(users, user_id)
     else:
         st.info("No foods logged yet.")
 
-    if users[user_id]["food_log"]:
+def display_food_log(users, user_id):
+    """
+    Windowed view of the food log: date range, search, sort and paging are
+    applied by query_food_log, so the grid and the analyze picker only ever
+    hold one page of entries no matter how long the history is.
+    """
+    import pandas as pd
+    from st_aggrid import AgGrid
+
+    st.subheader("Your Logged Foods")
+    today = date.today()
+    filter_cols = st.columns(2)
+    date_range = filter_cols[0].date_input("Dates", value=(today - timedelta(days=6), today))
+    search = filter_cols[1].text_input("Search logged foods")
+    sort_cols = st.columns(3)
+    sort_label = sort_cols[0].selectbox("Sort by", list(FOOD_LOG_SORTS))
+    page_size = sort_cols[1].selectbox("Rows per page", FOOD_LOG_PAGE_SIZES)
+    page = sort_cols[2].number_input("Page", min_value=1, value=1)
+
+    # The picker returns a single date while a range is still being chosen
+    if isinstance(date_range, (tuple, list)):
+        start, end = (tuple(date_range) + (None, None))[:2]
+    else:
+        start, end = date_range, date_range
+    sort_by, descending = FOOD_LOG_SORTS[sort_label]
+
+    rows, total = query_food_log(
+        users, user_id, start=start, end=end or start, search=search,
+        sort_by=sort_by, descending=descending, page=page - 1, page_size=page_size,
+    )
+    num_pages = max(1, -(-total // page_size))
+    if not rows:
+        st.info("No logged foods match these filters." if total == 0 else f"There are only {num_pages} page(s).")
+    else:
+        first = (page - 1) * page_size + 1
+        st.caption(f"Showing {first}-{first + len(rows) - 1} of {total} (page {page} of {num_pages})")
+        df_log = pd.DataFrame([dict(entry, **{"#": index}) for index, entry in rows])
+        AgGrid(df_log, fit_columns_on_grid_load=True)
+
         st.subheader("Analyze a Food Entry")
-        selected_entry = st.selectbox(
+        selected_index = st.selectbox(
             "Select an entry to analyze",
-            options=[f'{i}: {e["food_item"]}' for i, e in enumerate(users[user_id]["food_log"])]
+            options=[index for index, _ in rows],
+            format_func=lambda index: f'{index}: {users[user_id]["food_log"][index]["food_item"]}',
         )
         if st.button("Analyze Selected Entry"):
-            idx = int(selected_entry.split(":")[0])
-            entry_text = users[user_id]["food_log"][idx]["food_item"]
+            entry_text = users[user_id]["food_log"][selected_index]["food_item"]
+            from models import NutritionCoach
             nutrition_coach = NutritionCoach()
             analysis_result = nutrition_coach.analyze_food_entry(users[user_id], entry_text)
             st.json(analysis_result)
 
-def display_coach_page(users):
+    todays_rows, _ = query_food_log(users, user_id, start=today, end=today, page_size=None)
+    todays_indices = sorted(index for index, _ in todays_rows)
+    if todays_indices and st.button("Analyze all of today"):
+        from models import NutritionCoach
+        nutrition_coach = NutritionCoach()
+        analyses = nutrition_coach.analyze_food_entries(users[user_id], todays_indices)
+        for idx in todays_indices:
+            st.markdown(f'**{idx}: {users[user_id]["food_log"][idx]["food_item"]}**')
+            st.json(analyses[idx])
+
+def display_daily_dashboard(user_data):
+    """Shows today's intake against targets, rolling averages and the adherence streak."""
+    rollup = ensure_daily_totals(user_data)
+    if not rollup["days"]:
+        return
+
+    today = date.today()
+    targets = user_data.get("targets", {})
+    today_totals = day_totals(rollup, today)
+
+    st.subheader("Today vs Target")
+    macro_labels = [
+        ("Calories", "calories", "calories", ""),
+        ("Protein", "protein", "protein", " g"),
+        ("Fat", "fat", "fat", " g"),
+        ("Carbs", "carbs", "carbohydrates", " g"),
+    ]
+    columns = st.columns(len(macro_labels))
+    for column, (label, field, target_field, unit) in zip(columns, macro_labels):
+        target = targets.get(target_field)
+        column.metric(
+            label,
+            f"{round(today_totals[field])}{unit}",
+            f"{round(today_totals[field] - target)}{unit} vs target" if target else None,
+            delta_color="off",
+        )
+
+    week = rolling_average(rollup, today, 7)
+    month = rolling_average(rollup, today, 30)
+    st.write(
+        f"**7-day average:** {round(week['calories'])} kcal "
+        f"({week['days_logged']} days logged) · "
+        f"**30-day average:** {round(month['calories'])} kcal "
+        f"({month['days_logged']} days logged)"
+    )
+    if targets:
+        streak = adherence_streak(rollup, targets, today)
+        st.write(f"**Adherence streak:** {streak} day{'s' if streak != 1 else ''} within 10% of your calorie target")
+
+@metrics.timed("page_render_seconds", page="coach")
+def display_coach_page(users, user_id):
     """Displays the AI/human coach interaction page."""
     st.header("Ask the Coach")
 
-    user_id = "user1"  # Replace with actual user ID later
     if user_id not in users:
         st.warning("No user profile found. Please create one under 'Profile'.")
         return
@@ -94,23 +259,39 @@ def display_coach_page(users):
         submitted = st.form_submit_button("Send")
         if submitted and user_message.strip():
             # Append user message to conversation
-            users[user_id]["coach_chat"].append({"role": "user", "content": user_message})
+            append_coach_message(users, user_id, {"role": "user", "content": user_message})
+
+            st.markdown(f"**You:** {user_message}")
 
-            # Get AI response
+            # Stream the AI response into the chat as it is generated
+            from models import NutritionCoach
             nutrition_coach = NutritionCoach()
-            response = nutrition_coach.get_ai_coach_response(users[user_id], user_message)
-            # Append coach response
-            users[user_id]["coach_chat"].append({"role": "assistant", "content": response})
+            response_placeholder = st.empty()
+            response = ""
+            for text in nutrition_coach.stream_ai_coach_response(users[user_id], user_message):
+                response += text
+                response_placeholder.markdown(f"**Coach:** {response}▌")
+            response_placeholder.markdown(f"**Coach:** {response}")
+
+            # Append the finished coach response along with how long it took
+            append_coach_message(users, user_id, {
+                "role": "assistant",
+                "content": response,
+                "timing": nutrition_coach.last_response_timing,
+            })
 
-            save_user_data(users)
-            st.experimental_rerun()  # Refresh to show updated conversation
+            # Keep the hot chat bounded by folding older turns into the summary
+            if archive_old_messages(users[user_id], user_id, nutrition_coach.summarize_conversation):
+                save_user_data(users)
+
+            _rerun()  # Refresh to show updated conversation
 
 
-def display_calendar_page(users):
+@metrics.timed("page_render_seconds", page="calendar")
+def display_calendar_page(users, user_id):
     """Displays the meal planning calendar."""
     st.header("Calendar")
 
-    user_id = "user1"  # Replace with actual user ID later
     if user_id not in users:
         st.warning("No user profile found. Please create one under 'Profile'.")
         return
@@ -125,9 +306,23 @@ def display_calendar_page(users):
     st.subheader("Your Weekly Meal Calendar")
     meal_plan = users[user_id]["meals"]  # This is a dict with Day X => {Breakfast, Lunch, ...}
 
+    from st_aggrid import AgGrid
+
+    df = _calendar_frame(_content_key(meal_plan), meal_plan)
+
+    if not df.empty:
+        AgGrid(df, fit_columns_on_grid_load=True)
+    else:
+        st.info("No data to display.")
+
+@st.cache_data(max_entries=GRID_CACHE_ENTRIES, show_spinner=False)
+def _calendar_frame(plan_key, _meal_plan):
+    """Calendar rows for a meal plan, memoized on plan_key (its content hash)."""
+    import pandas as pd
+
     # Convert to a format suitable for displaying with AgGrid
     data = []
-    for day, meals in meal_plan.items():
+    for day, meals in _meal_plan.items():
         for meal_type, meal_details in meals.items():
             data.append({
                 "Day": day,
@@ -135,22 +330,17 @@ def display_calendar_page(users):
                 "Meal Name": meal_details["meal_name"],
                 "Instructions": meal_details["instructions"]
             })
+    return pd.DataFrame(data)
 
-    df = pd.DataFrame(data)
-
-    if not df.empty:
-        AgGrid(df, fit_columns_on_grid_load=True)
-    else:
-        st.info("No data to display.")
-
-def display_group_page(users):
+@metrics.timed("page_render_seconds", page="group")
+def display_group_page(users, user_id):
     """Displays the group interaction page."""
     # ... (Implementation later)
 
-def display_profile_page(users):
+@metrics.timed("page_render_seconds", page="profile")
+def display_profile_page(users, user_id):
     st.header("User Profile")
 
-    user_id = "user1"  # Replace with actual user ID logic
     if user_id not in users:
         users[user_id] = {
             "profile": {},
@@ -274,13 +464,10 @@ def display_profile_page(users):
         user_profile["lean_body_mass"] = lean_body_mass
         user_profile["rate_of_progress"] = rate_of_progress
 
-        save_user_data(users)
-        st.success("Profile saved successfully!")
-
         # Now automatically calculate macros (or you can do a separate button):
-        nutrition_coach = NutritionCoach()
-        users[user_id] = nutrition_coach.calculate_targets(users[user_id])
-        save_user_data(users)
+        users[user_id]["targets"] = compute_targets(user_profile)
+        save_user_data({user_id: users[user_id]})
+        st.success("Profile saved successfully!")
         st.success("Macro targets calculated!")
 
     # --- Display Macro Targets if they exist ---
@@ -294,9 +481,38 @@ def display_profile_page(users):
 
 def display_weekly_schedule_table(schedule_data, users, selected_user=None):
     """Displays the weekly schedule using Ag-Grid."""
-    if selected_user:
+    from st_aggrid import AgGrid, GridUpdateMode, DataReturnMode
+
+    df, gridOptions = _weekly_schedule_grid(_content_key(schedule_data), schedule_data, bool(selected_user))
+
+    if not df.empty:
+        grid_response = AgGrid(
+            df,
+            gridOptions=gridOptions,
+            data_return_mode=DataReturnMode.AS_INPUT,
+            update_mode=GridUpdateMode.MODEL_CHANGED
+            if selected_user
+            else GridUpdateMode.VALUE_CHANGED,
+            fit_columns_on_grid_load=True,
+            allow_unsafe_jscode=True,
+            enable_enterprise_modules=False,
+            height=350,
+            width="100%",
+            reload_data=False,
+        )
+
+@st.cache_data(max_entries=GRID_CACHE_ENTRIES, show_spinner=False)
+def _weekly_schedule_grid(schedule_key, _schedule_data, is_meal_plan):
+    """
+    Frame and grid options for display_weekly_schedule_table, memoized on
+    schedule_key (the schedule's content hash) and the table flavor.
+    """
+    import pandas as pd
+    from st_aggrid import GridOptionsBuilder
+
+    if is_meal_plan:
         data = []
-        for day, meals in schedule_data.items():
+        for day, meals in _schedule_data.items():
             for meal_type, meal_details in meals.items():
                 data.append(
                     {
@@ -309,74 +525,58 @@ def display_weekly_schedule_table(schedule_data, users, selected_user=None):
         df = pd.DataFrame(data)
     else:
         data = []
-        for day, entries in schedule_data.items():
+        for day, entries in _schedule_data.items():
             for entry in entries:
                 data.append({"Day": day, "Appointment": entry})
         df = pd.DataFrame(data)
 
-    if not df.empty:
-        if "Day" not in df.columns:
-            df["Day"] = ""
-
-        days_order = [
-            "Monday",
-            "Tuesday",
-            "Wednesday",
-            "Thursday",
-            "Friday",
-            "Saturday",
-            "Sunday",
-        ]
-        # Check if 'Day' column exists and create it if it doesn't
-        if "Day" not in df.columns:
-            df["Day"] = ""  # or some default value, or another logic to fill it
-
-        # Check if 'Day' column has the expected categories before setting the category type
-        if set(df["Day"].unique()).issubset(set(days_order)):
-            df["Day"] = pd.Categorical(df["Day"], categories=days_order, ordered=True)
-            df = df.sort_values("Day")
-        else:
-            print("Warning: 'Day' column contains unexpected values. Skipping sorting.")
-
-        gb = GridOptionsBuilder.from_dataframe(df)
-        gb.configure_default_column(
-            groupable=True, value=True, enableRowGroup=True, autoHeight=True, wrapText=True
-        )
-        gb.configure_grid_options(domLayout="normal")
-
-        if selected_user:
-            gb.configure_selection("multiple", use_checkbox=False)
-            gb.configure_column(
-                "Day",
-                editable=False,
-                cellEditor="agSelectCellEditor",
-                cellEditorParams={"values": days_order},
-            )
-            gb.configure_column("Meal Type", editable=True)
-            gb.configure_column("Meal Name", editable=True)
-            gb.configure_column("Details", editable=True)
+    if df.empty:
+        return df, None
+
+    days_order = [
+        "Monday",
+        "Tuesday",
+        "Wednesday",
+        "Thursday",
+        "Friday",
+        "Saturday",
+        "Sunday",
+    ]
+    # Check if 'Day' column exists and create it if it doesn't
+    if "Day" not in df.columns:
+        df["Day"] = ""  # or some default value, or another logic to fill it
+
+    # Check if 'Day' column has the expected categories before setting the category type
+    if set(df["Day"].unique()).issubset(set(days_order)):
+        df["Day"] = pd.Categorical(df["Day"], categories=days_order, ordered=True)
+        df = df.sort_values("Day")
+    else:
+        print("Warning: 'Day' column contains unexpected values. Skipping sorting.")
 
-        gridOptions = gb.build()
+    gb = GridOptionsBuilder.from_dataframe(df)
+    gb.configure_default_column(
+        groupable=True, value=True, enableRowGroup=True, autoHeight=True, wrapText=True
+    )
+    gb.configure_grid_options(domLayout="normal")
 
-        grid_response = AgGrid(
-            df,
-            gridOptions=gridOptions,
-            data_return_mode=DataReturnMode.AS_INPUT,
-            update_mode=GridUpdateMode.MODEL_CHANGED
-            if selected_user
-            else GridUpdateMode.VALUE_CHANGED,
-            fit_columns_on_grid_load=True,
-            allow_unsafe_jscode=True,
-            enable_enterprise_modules=False,
-            height=350,
-            width="100%",
-            reload_data=False,
+    if is_meal_plan:
+        gb.configure_selection("multiple", use_checkbox=False)
+        gb.configure_column(
+            "Day",
+            editable=False,
+            cellEditor="agSelectCellEditor",
+            cellEditorParams={"values": days_order},
         )
+        gb.configure_column("Meal Type", editable=True)
+        gb.configure_column("Meal Name", editable=True)
+        gb.configure_column("Details", editable=True)
+
+    return df, _plain_grid_options(gb)
 
-def display_meal_plan_page(users):
+@metrics.timed("page_render_seconds", page="meal_plan")
+def display_meal_plan_page(users, user_id):
     st.header("Meal Plan")
 
-    user_id = "user1"  # Or however you're handling user login
     if user_id not in users or "profile" not in users[user_id] or "targets" not in users[user_id]:
         st.warning("Please complete your profile and calculate targets first.")
         return
@@ -388,61 +588,144 @@ def display_meal_plan_page(users):
 
     # Example: checkboxes or radio for meal prep
     meal_prep_lunch = st.checkbox("Meal Prep Lunch for all days?", value=False)
+    in_background = st.checkbox(
+        "Generate in the background", value=True,
+        help="Meals are saved as they finish, so leaving the page or a restart doesn't lose them.",
+    )
+    whole_days = st.checkbox(
+        "Generate whole days per request", value=True, disabled=in_background,
+        help="Fewer, larger API calls; meals that miss the day's targets are re-requested individually.",
+    )
+    use_library = st.checkbox(
+        "Reuse meals from the library", value=False,
+        help="Fill slots with close matches from previously generated meals (other than your current "
+        "plan's) before calling the API.",
+    )
 
     if st.button("Generate Meal Plan"):
-        nutrition_coach = NutritionCoach()
-
         # Store your date + meal prep flags if needed
         users[user_id]["meal_plan_settings"] = {
             "start_date": str(start_date),
             "num_days": num_days,
             "meal_prep_lunch": meal_prep_lunch
         }
+        # Generating over an existing plan asks for new meals rather than the cached ones
+        nonce = uuid.uuid4().hex if users[user_id].get("meals") else None
+
+        if in_background:
+            # Meals are saved into the plan as they finish; progress is shown below
+            # The job replaces the stored plan as soon as it's submitted
+            from jobs import get_job_runner
+            save_user_data(users)
+            get_job_runner().submit_meal_plan(
+                user_id, users[user_id], num_days, meal_prep=meal_prep_lunch, use_library=use_library,
+                nonce=nonce,
+            )
+            users[user_id]["meals"] = {}
+        else:
+            from models import NutritionCoach, DEFAULT_DAYS_PER_REQUEST
+            nutrition_coach = NutritionCoach()
 
-        # Possibly pass meal_prep_lunch to your generate function
-        users[user_id] = nutrition_coach.generate_meal_plan(users[user_id], num_days, meal_prep=meal_prep_lunch)
+            # Meals show up here field by field while they are generated
+            preview = st.empty()
+            streamed = {}
+            preview_lock = threading.Lock()
+
+            def on_meal_field(slot, field, value):
+                with preview_lock:
+                    streamed.setdefault(slot, {})[field] = value
+                    preview.markdown(_meal_previews(streamed))
+
+            # Possibly pass meal_prep_lunch to your generate function
+            users[user_id] = nutrition_coach.generate_meal_plan(
+                users[user_id], num_days, meal_prep=meal_prep_lunch,
+                days_per_request=DEFAULT_DAYS_PER_REQUEST if whole_days else 0,
+                use_library=use_library,
+                on_meal_field=on_meal_field,
+                nonce=nonce,
+            )
+            preview.empty()
+
+            save_user_data(users)
+            st.success("Meal plan generated!")
 
-        save_user_data(users)
-        st.success("Meal plan generated!")
+    job_running = display_meal_plan_job(user_id)
 
     # Display the meal plan if it exists
     if "meals" in users[user_id]:
+        meal_plan = users[user_id]["meals"]
+        if st.checkbox(
+            "Scale portions to my targets", value=True,
+            help="Adjusts each meal's portion size so every day's totals land as close to your targets as possible.",
+        ):
+            targets = users[user_id]["targets"]
+            meal_plan = _scaled_meal_plan(_content_key([meal_plan, targets]), meal_plan, targets)
+
         # We pass the entire data structure to a function that renders the interactive table
-        display_interactive_meal_table(users[user_id]["meals"], users, user_id)
+        display_interactive_meal_table(meal_plan, users, user_id)
+
+    if job_running:
+        # The plan above fills in as meals are checkpointed; check again shortly
+        time.sleep(JOB_POLL_SECONDS)
+        _rerun()
+
+def display_meal_plan_job(user_id):
+    """Shows the user's latest background meal plan job; returns True while it's still running."""
+    from jobs import get_job_runner, ACTIVE_STATUSES
+
+    runner = get_job_runner()
+    job = runner.store.latest_job(user_id, "meal_plan")
+    if job is None:
+        return False
+
+    if job["status"] in ACTIVE_STATUSES:
+        abandoned = job["status"] == "queued" or (job["lease_expires"] or 0) < time.time()
+        if abandoned and not runner.resume(job["job_id"]):
+            # No live worker holds the job and this one can't take it over, so polling would never end
+            st.warning("Generating the meal plan stopped. Generate the plan again to finish it.")
+            return False
+        st.progress(
+            job["completed"] / max(job["total"], 1),
+            text=f'Generating meal plan: {job["completed"]} of {job["total"]} meals ready',
+        )
+        partial = runner.store.partial_results(job["job_id"])
+        if partial:
+            st.markdown(_meal_previews(partial))
+        return True
+    if job["status"] == "failed":
+        st.warning(
+            f'{job["total"] - job["completed"]} of {job["total"]} meals could not be generated. '
+            "The rest are saved in your plan."
+        )
+        if st.button("Retry failed meals"):
+            runner.resume(job["job_id"])
+            _rerun()
+    return False
+
+def _meal_previews(meals_by_slot):
+    """One markdown line per meal still being generated, with whatever fields have arrived."""
+    lines = []
+    for slot, fields in meals_by_slot.items():
+        parts = [fields.get("meal_name", "…")]
+        if "ingredients" in fields:
+            parts.append(f'{len(fields["ingredients"])} ingredients')
+        if "calories" in fields:
+            parts.append(f'{fields["calories"]} kcal')
+        if "protein" in fields:
+            parts.append(f'{fields["protein"]}g protein')
+        lines.append(f"- **{slot}**: " + " · ".join(str(part) for part in parts))
+    return "\n".join(lines)
 
 def display_interactive_meal_table(schedule_data, users, user_id):
     """
     Display an AgGrid table of the meal plan with clickable rows.
     When a row is selected, show detailed info in a separate container.
     """
-    st.subheader("Your Meal Plan")
+    from st_aggrid import AgGrid, GridUpdateMode, DataReturnMode
 
-    # Convert to a DataFrame for AgGrid
-    data = []
-    for day, meals in schedule_data.items():
-        for meal_type, meal_details in meals.items():
-            data.append({
-                "Day": day,
-                "Meal Type": meal_type,
-                "Meal Name": meal_details.get("meal_name", ""),
-                # We'll store the entire meal_details in a hidden column so we can reference later
-                "Meal Details": json.dumps(meal_details)  
-            })
+    st.subheader("Your Meal Plan")
 
-    df = pd.DataFrame(data)
-
-    # Build AgGrid config
-    gb = GridOptionsBuilder.from_dataframe(df)
-    gb.configure_default_column(
-        groupable=True, 
-        value=True, 
-        enableRowGroup=True, 
-        autoHeight=True, 
-        wrapText=True
-    )
-    gb.configure_selection("single")  # single row selection
-    gb.configure_grid_options(domLayout="normal")
-    gridOptions = gb.build()
+    df, gridOptions = _meal_plan_grid(_content_key(schedule_data), schedule_data)
 
     grid_response = AgGrid(
         df,
@@ -458,15 +741,18 @@ def display_interactive_meal_table(schedule_data, users, user_id):
     )
 
     # Check if a row is selected
-    if grid_response and grid_response["selected_rows"]:
-        selected_row = grid_response["selected_rows"][0]  # single selection
-        meal_json_str = selected_row.get("Meal Details", "")
-        if meal_json_str:
-            meal_details = json.loads(meal_json_str)
+    selected_row = _selected_row(grid_response)
+    if selected_row:
+        # The hidden row key points back into the plan, so nothing is parsed out of the grid
+        day, meal_type = selected_row["Row Key"].split("|", 1)
+        meal_details = schedule_data.get(day, {}).get(meal_type)
+        if meal_details:
 
             # Display the detailed info here
             st.markdown("### Selected Meal Details")
             st.write(f"**Meal Name:** {meal_details.get('meal_name', '')}")
+            if meal_details.get("portion_multiplier", 1) != 1:
+                st.write(f"**Portion:** {meal_details['portion_multiplier']}× the original recipe")
             
             # Ingredients
             ingredients = meal_details.get("ingredients", [])
@@ -487,4 +773,190 @@ def display_interactive_meal_table(schedule_data, users, user_id):
             st.write(f"Calories: {meal_details.get('calories', 0)}")
             st.write(f"Protein: {meal_details.get('protein', 0)} g")
             st.write(f"Fat: {meal_details.get('fat', 0)} g")
-            st.write(f"Carbs: {meal_details.get('carbohydrates', 0)} g")
\ No newline at end of file
+            st.write(f"Carbs: {meal_details.get('carbohydrates', 0)} g")
+
+@st.cache_data(max_entries=GRID_CACHE_ENTRIES, show_spinner=False)
+def _scaled_meal_plan(plan_key, _meal_plan, _targets):
+    """
+    The plan with portions scaled to the targets, memoized on plan_key (the
+    content hash of both) so reruns don't re-solve every day.
+    """
+    from jobs import MEAL_TYPES
+    from models import ERROR_MEAL_NAME
+    from portion_optimizer import optimize_meal_plan
+
+    return optimize_meal_plan(_meal_plan, _targets, MEAL_TYPES, skip_meal_names=[ERROR_MEAL_NAME])
+
+@st.cache_data(max_entries=GRID_CACHE_ENTRIES, show_spinner=False)
+def _meal_plan_grid(plan_key, _meal_plan):
+    """
+    Frame and grid options for the interactive meal table, memoized on
+    plan_key (the plan's content hash) so reruns with an unchanged plan skip
+    rebuilding both. Rows carry a hidden "Row Key" of "<day>|<meal type>".
+    """
+    import pandas as pd
+    from st_aggrid import GridOptionsBuilder
+
+    # Convert to a DataFrame for AgGrid
+    data = []
+    for day, meals in _meal_plan.items():
+        for meal_type, meal_details in meals.items():
+            data.append({
+                "Day": day,
+                "Meal Type": meal_type,
+                "Meal Name": meal_details.get("meal_name", ""),
+                "Row Key": f"{day}|{meal_type}",
+            })
+
+    df = pd.DataFrame(data)
+
+    # Build AgGrid config
+    gb = GridOptionsBuilder.from_dataframe(df)
+    gb.configure_default_column(
+        groupable=True, 
+        value=True, 
+        enableRowGroup=True, 
+        autoHeight=True, 
+        wrapText=True
+    )
+    gb.configure_column("Row Key", hide=True)
+    gb.configure_selection("single")  # single row selection
+    gb.configure_grid_options(domLayout="normal")
+    return df, _plain_grid_options(gb)
+
+@metrics.timed("page_render_seconds", page="trends")
+def display_trends_page(users, user_id):
+    """Weekly adherence, calorie trend and top foods, queried from the Parquet history."""
+    st.header("Trends")
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        st.error("The Trends page needs pyarrow (pip install pyarrow).")
+        return
+    import pandas as pd
+    from history_store import export_user_history, has_history, load_history
+    from nutrition_targets import PROGRESS_CALORIE_DELTAS
+
+    if user_id not in users:
+        st.warning("No user profile found. Please create one under 'Profile'.")
+        return
+    user_data = users[user_id]
+    if not user_data.get("food_log"):
+        st.info("Log some food to see your trends here.")
+        return
+    # Cheap when nothing changed; otherwise rewrites just the months with new entries
+    export_user_history(user_id, user_data)
+
+    period = st.selectbox("Period", list(TRENDS_PERIODS), index=1)
+    days = TRENDS_PERIODS[period]
+    start = date.today() - timedelta(days=days - 1) if days else None
+
+    food = load_history(
+        user_id, "food_log", columns=["date", "food_item", "calories", "protein", "fat", "carbs"], start=start
+    )
+    if food.empty:
+        st.info("Nothing logged in this period yet.")
+        return
+
+    macros = ["calories", "protein", "fat", "carbs"]
+    daily = food.groupby("date")[macros].sum()
+    weeks = daily.index.to_period("W").start_time
+    weekly = daily.groupby(weeks).mean()
+    targets = user_data.get("targets", {})
+    target_by_macro = {macro: targets.get("carbohydrates" if macro == "carbs" else macro, 0) for macro in macros}
+
+    st.subheader("Weekly Macro Adherence")
+    if all(target_by_macro.values()):
+        adherence = pd.DataFrame(
+            {macro.capitalize(): weekly[macro] / target_by_macro[macro] * 100 for macro in macros}
+        )
+        st.line_chart(adherence)
+        calorie_target = target_by_macro["calories"]
+        on_target = (daily["calories"] - calorie_target).abs() <= 0.1 * calorie_target
+        summary = pd.DataFrame({
+            "Days logged": daily.groupby(weeks).size(),
+            "Days within 10% of calories": on_target.groupby(weeks).sum(),
+            **{f"{column} (% of target)": adherence[column].round() for column in adherence.columns},
+        })
+        summary.index = summary.index.date
+        st.dataframe(summary, use_container_width=True)
+    else:
+        st.info("Set up your profile to compare your intake against targets.")
+
+    st.subheader("Calorie Trend")
+    trend = pd.DataFrame({"Logged (daily average)": weekly["calories"]})
+    if target_by_macro["calories"]:
+        trend["Target"] = target_by_macro["calories"]
+    if has_history(user_id, "meals"):
+        planned = load_history(user_id, "meals", columns=["date", "calories"], start=start)
+    else:
+        planned = None
+    if planned is not None and not planned.empty:
+        planned_daily = planned.groupby("date")["calories"].sum()
+        trend["Meal plan"] = planned_daily.groupby(planned_daily.index.to_period("W").start_time).mean()
+    st.line_chart(trend)
+
+    if target_by_macro["calories"]:
+        # Targets already include the chosen deficit/surplus; 3500 kcal ≈ 1 lb
+        rate_of_progress = user_data.get("profile", {}).get("rate_of_progress", "Maintenance")
+        planned_delta = PROGRESS_CALORIE_DELTAS.get(rate_of_progress, 0)
+        maintenance = target_by_macro["calories"] - planned_delta
+        actual_rate = (daily["calories"].mean() - maintenance) * 7 / 3500
+        st.metric(
+            "Implied weekly weight change",
+            f"{actual_rate:+.2f} lb",
+            f"{actual_rate - planned_delta * 7 / 3500:+.2f} lb vs {rate_of_progress}",
+            delta_color="off",
+        )
+
+    st.subheader("Top Foods")
+    top_foods = (
+        food.groupby("food_item")
+        .agg(times_logged=("food_item", "size"), total_calories=("calories", "sum"))
+        .nlargest(10, "times_logged")
+    )
+    top_foods.columns = ["Times logged", "Total calories"]
+    st.dataframe(top_foods, use_container_width=True)
+
+def display_diagnostics_page(users):
+    """Hidden page (shown only when metrics are enabled) with live metrics and cache stats."""
+    st.header("Diagnostics")
+
+    if not metrics.ENABLED:
+        st.info("Metrics are disabled. Set NUTRITION_METRICS=1 to collect them.")
+        return
+
+    import pandas as pd
+
+    data = metrics.snapshot()
+
+    st.subheader("Latency")
+    rows = []
+    for (name, labels), histogram in sorted(data["histograms"].items()):
+        if histogram["count"] == 0:
+            continue
+        rows.append({
+            "Metric": name,
+            "Labels": ", ".join(f"{k}={v}" for k, v in labels),
+            "Count": histogram["count"],
+            "Mean": round(histogram["sum"] / histogram["count"], 4),
+            "Total": round(histogram["sum"], 3),
+        })
+    if rows:
+        st.dataframe(pd.DataFrame(rows), use_container_width=True)
+    else:
+        st.info("Nothing recorded yet.")
+
+    st.subheader("Counters")
+    counters = [
+        {"Metric": name, "Labels": ", ".join(f"{k}={v}" for k, v in labels), "Value": value}
+        for (name, labels), value in sorted(data["counters"].items())
+    ]
+    if counters:
+        st.dataframe(pd.DataFrame(counters), use_container_width=True)
+
+    st.subheader("Response Cache")
+    st.json(get_response_cache().stats())
+
+    with st.expander("Prometheus exposition"):
+        st.code(metrics.render_prometheus(), language="text")
@@ -1,24 +1,410 @@
 # utils.py
+import os
+import re
 import json
-from datetime import datetime
-import pandas as pd
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from typing import Dict
+from rollups import ensure_daily_totals
+from journal import EventJournal, DEFAULT_COMPACT_THRESHOLD, compact_in_background
+import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the in-process locks apply
+    fcntl = None
+
+# "json" keeps one JSON file per user under data/users; "sqlite" uses the row-level store in storage.py
+STORAGE_BACKEND = os.environ.get("NUTRITION_STORAGE", "json")
+
+DATA_DIR = os.environ.get("NUTRITION_DATA_DIR", "data")
+USERS_DIR = os.path.join(DATA_DIR, "users")
+INDEX_PATH = os.path.join(USERS_DIR, "index.json")
+# User IDs come from free text, so per-user files get directories of their own
+# where no ID can collide with the index or the store-wide lock files
+SHARDS_DIR = os.path.join(USERS_DIR, "shards")
+LOCKS_DIR = os.path.join(USERS_DIR, "locks")
+
+# Single-file store from before sharding; split into per-user files on first load
+LEGACY_USERS_PATH = "users.json"
+
+# Key holding the last journal sequence number folded into a copy of a user's data,
+# both in the shard and in the copies load_user_data hands out
+JOURNAL_WATERMARK_KEY = "_journal_seq"
+
+# Food log fields query_food_log can sort by
+FOOD_LOG_SORT_FIELDS = ("timestamp", "food_item", "calories", "protein", "fat", "carbs", "quantity")
+
+CHARS_PER_TOKEN = 4  # rough estimate for English text
+
+# Saves arriving while another save is being written go out together in the next flush
+SAVE_COALESCING = os.environ.get("NUTRITION_SAVE_COALESCING", "1") not in ("", "0", "false")
+
+# Food log entries and chat messages are journaled per user instead of rewriting the shard
+_journals = {}
+_journals_lock = threading.Lock()
+_index_lock = threading.Lock()
 
 def create_weekly_schedule():
     """Create a weekly schedule template."""
     days = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
     return {day: [] for day in days}
 
-def load_user_data():
-    """Loads user data from a JSON file or initializes an empty dictionary."""
-    try:
-        with open("users.json", "r") as f:
-            users = json.load(f)
-    except FileNotFoundError:
-        users = {}
+def estimate_tokens(text):
+    """Cheap token count estimate used for prompt budgeting."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def normalize_user_id(name):
+    """Turns a login name into a user ID that is safe to use as a file name."""
+    return re.sub(r"[^a-z0-9_-]+", "-", name.strip().lower()).strip("-")
+
+@metrics.timed("storage_seconds", operation="load", backend=STORAGE_BACKEND)
+def load_user_data(user_id=None):
+    """
+    Loads user data from the configured backend or initializes an empty dictionary.
+    With a user_id only that user's shard is read and the result is {user_id: data}
+    (or {} for a new user); without one every user is loaded.
+    """
+    if STORAGE_BACKEND == "sqlite":
+        import storage
+        return storage.load_user_data(user_id=user_id)
+
+    _migrate_legacy_store()
+    user_ids = [user_id] if user_id is not None else list_user_ids()
+    users = {}
+    for uid in user_ids:
+        journal = _journal_for(uid)
+        # Shared lock so a compaction in another process can't truncate the journal between the two reads
+        with journal.lock, _user_lock(uid, exclusive=False):
+            users.update(_read_user(uid, journal))
     return users
 
+@metrics.timed("storage_seconds", operation="save", backend=STORAGE_BACKEND)
 def save_user_data(users):
-    """Saves user data to a JSON file."""
-    with open("users.json", "w") as f:
-        json.dump(users, f, indent=4)
\ No newline at end of file
+    """
+    Saves user data to the configured backend, writing only the users in `users`.
+    Returns once the data is on disk; concurrent saves are merged into one flush.
+    """
+    if STORAGE_BACKEND == "sqlite":
+        import storage
+        storage.save_user_data(users)
+        return
+
+    if SAVE_COALESCING:
+        _coalescer.save(users)
+    else:
+        _flush_users(users)
+
+def update_user_data(user_id, update):
+    """
+    Read-modify-write of one user's stored data, for writers outside the page
+    session (background jobs). `update(user_data)` is called on the latest
+    stored copy, journaled appends included, while the user's locks are held,
+    so entries appended meanwhile wait instead of being overwritten. It
+    returns False to leave the data as is. Returns True if the user exists
+    and was updated.
+    """
+    if STORAGE_BACKEND == "sqlite":
+        import storage
+        return storage.get_store().update_user(user_id, update)
+
+    _migrate_legacy_store()
+    journal = _journal_for(user_id)
+    with journal.lock, _user_lock(user_id):
+        users = _read_user(user_id, journal)
+        if user_id not in users or not update(users[user_id]):
+            return False
+        _write_snapshot(user_id, users[user_id], journal)
+        return True
+
+def list_user_ids():
+    """IDs of every user in the index."""
+    if STORAGE_BACKEND == "sqlite":
+        import storage
+        return storage.get_store().list_user_ids()
+
+    _migrate_legacy_store()
+    return list(_read_index().get("users", {}))
+
+def append_food_log(users, user_id, entry):
+    """Appends a food log entry without rewriting the whole user document."""
+    _append(users, user_id, "food_log", entry)
+    # Keep the per-day totals current; this folds just the new entry
+    ensure_daily_totals(users[user_id])
+
+def append_coach_message(users, user_id, message):
+    """Appends a coach chat message without rewriting the whole user document."""
+    _append(users, user_id, "coach_chat", message)
+
+def query_food_log(users, user_id, start=None, end=None, search="", sort_by="timestamp",
+                   descending=True, page=0, page_size=50):
+    """
+    One page of a user's food log as ([(log index, entry)], total matching).
+
+    `start`/`end` are inclusive dates, `search` a case-insensitive substring
+    of the food name, `sort_by` one of FOOD_LOG_SORT_FIELDS; page_size=None
+    returns every match. The SQLite backend runs this as an indexed query.
+    The JSON backend bisects the in-memory log, which is in timestamp order
+    because entries are only ever appended, so only the date window is
+    filtered and sorted and the cost doesn't grow with the whole history.
+    """
+    if sort_by not in FOOD_LOG_SORT_FIELDS:
+        raise ValueError(f"Can't sort the food log by {sort_by!r}")
+    start_key = start.isoformat() if start else None
+    end_key = (end + timedelta(days=1)).isoformat() if end else None
+
+    if STORAGE_BACKEND == "sqlite":
+        import storage
+        limit = page_size
+        offset = page * page_size if page_size else 0
+        return storage.get_store().query_food_log(
+            user_id, start_key, end_key, search, sort_by, descending, limit, offset
+        )
+
+    food_log = users[user_id].get("food_log", [])
+    timestamp = lambda entry: entry.get("timestamp") or ""
+    lo = bisect_left(food_log, start_key, key=timestamp) if start_key else 0
+    hi = bisect_left(food_log, end_key, key=timestamp) if end_key else len(food_log)
+    rows = [(index, food_log[index]) for index in range(lo, hi)]
+
+    if search:
+        needle = search.lower()
+        rows = [row for row in rows if needle in str(row[1].get("food_item", "")).lower()]
+    if sort_by == "timestamp":
+        if descending:
+            rows.reverse()
+    elif sort_by == "food_item":
+        rows.sort(key=lambda row: str(row[1].get(sort_by, "")).lower(), reverse=descending)
+    else:
+        rows.sort(key=lambda row: row[1].get(sort_by) or 0, reverse=descending)
+
+    total = len(rows)
+    if page_size:
+        rows = rows[page * page_size:(page + 1) * page_size]
+    return rows, total
+
+def compact_journal(user_id):
+    """
+    Folds a user's journal into their shard and truncates it. The only
+    place events are dropped, so copies loaded before a compaction can't
+    pick up entries appended between their load and the compaction.
+    """
+    journal = _journal_for(user_id)
+    with journal.lock, _user_lock(user_id):
+        users = _read_user(user_id, journal)
+        _write_snapshot(user_id, users.get(user_id, {}), journal)
+        journal.truncate()
+
+def _append(users, user_id, section, record):
+    if STORAGE_BACKEND == "sqlite":
+        users[user_id].setdefault(section, []).append(record)
+        import storage
+        storage.get_store().append(user_id, section, record)
+        return
+
+    journal = _journal_for(user_id)
+    os.makedirs(SHARDS_DIR, exist_ok=True)
+    with journal.lock, _user_lock(user_id):
+        # Take in what other sessions appended first, so this copy's watermark stays exact
+        _catch_up(user_id, users[user_id], journal)
+        users[user_id].setdefault(section, []).append(record)
+        pending = journal.append(user_id, section, record)
+        users[user_id][JOURNAL_WATERMARK_KEY] = journal.last_seq()
+    if pending >= DEFAULT_COMPACT_THRESHOLD:
+        compact_in_background(journal, lambda: compact_journal(user_id))
+
+class _SaveCoalescer:
+    """
+    Group commit for save_user_data. A save is written at once unless a
+    flush is already running. Saves that arrive meanwhile form the next
+    batch: its first caller waits for the running flush, then writes the
+    latest version of every user saved in the meantime, and the other
+    callers block until that flush is done, so each save is still durable
+    when it returns.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flushing = threading.Lock()  # held while a batch is being written
+        self._pending = {}
+        self._batch = None
+
+    def save(self, users):
+        with self._lock:
+            self._pending.update(users)
+            batch = self._batch
+            is_leader = batch is None
+            if is_leader:
+                batch = self._batch = {"done": threading.Event(), "error": None}
+
+        if is_leader:
+            with self._flushing:
+                with self._lock:
+                    pending, self._pending = self._pending, {}
+                    self._batch = None
+                try:
+                    _flush_users(pending)
+                except Exception as e:
+                    batch["error"] = e
+                finally:
+                    batch["done"].set()
+            metrics.increment("storage_coalesced_saves_total", len(pending))
+        else:
+            batch["done"].wait()
+
+        if batch["error"] is not None:
+            raise batch["error"]
+
+_coalescer = _SaveCoalescer()
+
+def _flush_users(users):
+    for user_id, user_data in users.items():
+        journal = _journal_for(user_id)
+        with journal.lock, _user_lock(user_id):
+            _write_snapshot(user_id, user_data, journal)
+
+@contextmanager
+def _file_lock(name, exclusive=True, directory=None):
+    """
+    Advisory flock on <directory>/<name>.lock (data/users by default),
+    serializing writers across processes (and threads, since each call
+    opens its own descriptor).
+    """
+    if fcntl is None:
+        yield
+        return
+    directory = directory or USERS_DIR
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, f"{name}.lock"), "a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def _atomic_write(path, data):
+    """Writes to a temp file and renames it over `path`, so readers never see a partial file."""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def _check_user_id(user_id):
+    if not user_id or normalize_user_id(user_id) != user_id:
+        raise ValueError(f"Invalid user ID: {user_id!r}")
+
+def _user_lock(user_id, exclusive=True):
+    """_file_lock for one user, kept in LOCKS_DIR apart from the index and migration locks."""
+    _check_user_id(user_id)
+    return _file_lock(user_id, exclusive, directory=LOCKS_DIR)
+
+def _shard_path(user_id):
+    _check_user_id(user_id)
+    return os.path.join(SHARDS_DIR, f"{user_id}.json")
+
+def _journal_for(user_id):
+    with _journals_lock:
+        journal = _journals.get(user_id)
+        if journal is None:
+            _check_user_id(user_id)
+            journal = EventJournal(os.path.join(SHARDS_DIR, f"{user_id}.journal.jsonl"))
+            _journals[user_id] = journal
+        return journal
+
+def _read_shard(user_id):
+    try:
+        with open(_shard_path(user_id), "r") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    metrics.observe("storage_bytes", len(data), buckets=metrics.BYTES_BUCKETS, operation="load")
+    return json.loads(data)
+
+def _read_user(user_id, journal):
+    """
+    {user_id: shard caught up with the journal}, or {} for a user with
+    neither. Caller holds the user's locks.
+    """
+    user_data = _read_shard(user_id)
+    if user_data is None:
+        # Only journaled entries so far; the copy still gets a watermark
+        user_data = journal.replay({}).get(user_id)
+        if user_data is None:
+            return {}
+        user_data[JOURNAL_WATERMARK_KEY] = journal.last_seq()
+    else:
+        _catch_up(user_id, user_data, journal)
+    return {user_id: user_data}
+
+def _catch_up(user_id, user_data, journal):
+    """
+    Applies the journal events newer than the copy's watermark (all of them
+    for a copy without one) and moves the watermark to the journal's end.
+    Caller holds the user's locks.
+    """
+    journal.replay({user_id: user_data}, user_data.get(JOURNAL_WATERMARK_KEY, 0))
+    user_data[JOURNAL_WATERMARK_KEY] = journal.last_seq()
+
+def _write_snapshot(user_id, user_data, journal):
+    """
+    Writes a copy of the user's data as their shard, first folding in the
+    journal events it hasn't seen: entries another session appended after
+    this copy was loaded are kept rather than overwritten. The journal is
+    left as is, so copies loaded even earlier can still catch up.
+    """
+    _catch_up(user_id, user_data, journal)
+    _write_shard(user_id, user_data)
+
+def _write_shard(user_id, user_data, update_index=True):
+    path = _shard_path(user_id)
+    is_new = not os.path.exists(path)
+    os.makedirs(SHARDS_DIR, exist_ok=True)
+
+    data = json.dumps(user_data, indent=4)
+    _atomic_write(path, data)
+    metrics.observe("storage_bytes", len(data), buckets=metrics.BYTES_BUCKETS, operation="save")
+
+    if is_new and update_index:
+        _add_to_index([user_id])
+
+def _read_index():
+    try:
+        with open(INDEX_PATH, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"users": {}}
+
+def _add_to_index(user_ids):
+    with _index_lock, _file_lock("index"):
+        index = _read_index()
+        new_ids = [user_id for user_id in user_ids if user_id not in index["users"]]
+        if not new_ids and os.path.exists(INDEX_PATH):
+            return
+        for user_id in new_ids:
+            index["users"][user_id] = {"created_at": datetime.now().isoformat()}
+        _atomic_write(INDEX_PATH, json.dumps(index, indent=4))
+
+def _migrate_legacy_store():
+    """One-shot split of the old single users.json into per-user shards."""
+    if os.path.exists(INDEX_PATH) or not os.path.exists(LEGACY_USERS_PATH):
+        return
+    with _file_lock("migrate"):
+        # Another process may have finished the migration while we waited
+        if os.path.exists(INDEX_PATH):
+            return
+        with open(LEGACY_USERS_PATH, "r") as f:
+            legacy_users = json.load(f)
+        user_ids = []
+        for user_id, user_data in legacy_users.items():
+            user_id = normalize_user_id(user_id)
+            # The watermark counted the old shared journal; the shard starts a fresh one
+            user_data.pop(JOURNAL_WATERMARK_KEY, None)
+            with _user_lock(user_id):
+                _write_shard(user_id, user_data, update_index=False)
+            user_ids.append(user_id)
+        # The index goes last: its existence marks the migration as done
+        _add_to_index(user_ids)